@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Joystick axis mapping class
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# Maps each joystick axis to a pair of joint commands, one for each way
+# the stick is moved. The position of an axis is smoothed and then
+# quantised to a speed level: 0 inside the dead zone, full speed from the
+# threshold and, with part speed, evenly spaced levels in between. A level
+# only changes once the stick has moved past its boundary by the
+# hysteresis, so a stick resting on a boundary does not flick between two
+# commands. Changes within the hysteresis are smoothed, larger ones are
+# taken at once so that the arm never lags the stick.
+#
+# The state of every axis is kept in lists allocated when the map is
+# made and the moves for every level are worked out then too.
+#
+# An axis is ignored until it has been seen in its dead zone, as the
+# device reports where every axis is when it is opened and some, such as
+# the triggers of a pad, rest at one end.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+class AxisMap:
+
+    # axes maps an axis number to (command for +, command for -) and
+    # tuning an axis number to (deadzone, hysteresis, smoothing) for axes
+    # that do not use the defaults. smoothing is the weight of a new
+    # position from 0 to 1 (1 is no smoothing). levels is the number of
+    # speeds from the dead zone to the threshold, 1 for full speed only
+    def __init__(self,table,axes,threshold,deadzone=0.15,hysteresis=0.05,smoothing=0.5,
+            levels=1,tuning={}):
+        self.levels = levels
+        size = max(axes) + 1
+        self.mapped = [False] * size
+        self.deadzone = [0.0] * size
+        self.centred = [False] * size   # Seen in the dead zone since reset
+        self.lower = [0.0] * size       # Start of the first level
+        self.step = [0.0] * size        # Width of each level
+        self.hysteresis = [0.0] * size
+        self.smoothing = [1.0] * size
+        self.position = [0.0] * size    # Smoothed position
+        self.level = [0] * size         # Signed speed level
+        self.moves = [None] * size      # Current (payload, duty) or None
+        self.levelMoves = [None] * size     # Moves for each signed level
+
+        for axis, (plus, minus) in axes.items():
+            zone, band, weight = tuning.get(axis, (deadzone, hysteresis, smoothing))
+            self.deadzone[axis] = zone
+            # With one level the first boundary is the threshold
+            if levels == 1:
+                zone = threshold
+            self.mapped[axis] = True
+            self.lower[axis] = zone
+            self.step[axis] = (threshold - zone) / levels
+            self.hysteresis[axis] = band
+            self.smoothing[axis] = weight
+            moves = [None] * (2 * levels + 1)
+            for level in range(1, levels + 1):
+                moves[level] = (table.byName[plus], level / levels)
+                moves[-level] = (table.byName[minus], level / levels)
+            self.levelMoves[axis] = moves
+        self.changes = 0                # Level changes
+        self.events = 0                 # Axis positions given
+
+    # Speed level for a distance from the centre
+    def quantise(self,axis,distance):
+        if distance < self.lower[axis]:
+            return 0
+        if self.levels == 1:
+            return 1
+        return min(int((distance - self.lower[axis]) / self.step[axis]) + 1, self.levels)
+
+    # Update an axis with a new position from -1 to 1. Returns True if
+    # its level has changed and so the joystick moves
+    def update(self,axis,value):
+        self.events += 1
+        if axis >= len(self.mapped) or not self.mapped[axis]:
+            return False
+        if not self.centred[axis]:
+            if abs(value) >= self.deadzone[axis]:
+                return False
+            self.centred[axis] = True
+        band = self.hysteresis[axis]
+        position = self.position[axis]
+        if abs(value - position) <= band:
+            position += self.smoothing[axis] * (value - position)
+        else:
+            position = value
+        self.position[axis] = position
+
+        level = self.level[axis]
+        distance = abs(position)
+        sign = 1 if position > 0 else -1
+        if level != 0 and (level > 0) != (sign > 0):
+            # Moved through the centre, joydev may send no more events so
+            # the level the other way is taken now
+            new = self.quantise(axis, distance - band)
+        else:
+            current = abs(level)
+            new = current
+            if self.quantise(axis, distance - band) > current:
+                new = self.quantise(axis, distance - band)
+            elif self.quantise(axis, distance + band) < current:
+                new = self.quantise(axis, distance + band)
+        new *= sign
+        if new == level:
+            return False
+        self.level[axis] = new
+        self.moves[axis] = self.levelMoves[axis][new]
+        self.changes += 1
+        return True
+
+    # The moves wanted by all axes as a list of (payload, duty)
+    def joystickMoves(self):
+        return [move for move in self.moves if move is not None]
+
+    # Centre every axis, each is then ignored until it is seen centred
+    def reset(self):
+        for axis in range(len(self.mapped)):
+            self.centred[axis] = False
+            self.position[axis] = 0.0
+            self.level[axis] = 0
+            self.moves[axis] = None
+
+# End of AxisMap class
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
@@ -0,0 +1,1536 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Benchmarks
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# Run: ./benchmark.py <benchmark>
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import os
+import sys
+import math
+import time
+import random
+import logging
+import threading
+import subprocess
+import tempfile
+import tracemalloc
+import contextlib
+
+from log_class import Log
+from stats_class import Histogram
+
+# The logging method used before the queue based writer. A new file
+# handler is created for every message and shell commands are run
+# to create the log directory
+def legacyMessage(logdir,module,message,level,loglevel):
+    logrobot = logdir + "/" + module
+    os.popen("mkdir -p " + logrobot).readline()
+    os.popen("chown " + str(os.getuid()) + " " + logrobot).readline()
+    logger = logging.getLogger('legacy')
+    hdlr = logging.FileHandler(logrobot + '/' + module + '.log')
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    hdlr.setFormatter(formatter)
+    logger.addHandler(hdlr)
+    logger.setLevel(loglevel)
+    logger.log(level, message)
+    logger.removeHandler(hdlr)
+    hdlr.close()
+
+# Print a messages per second result
+def report(name,count,elapsed):
+    print ("%-28s %8d msgs %8.3f s %12.0f msgs/s" % (name, count, elapsed, count/elapsed))
+
+# Send log files to a temporary directory
+def setupLog(module="bench"):
+    tmpdir = tempfile.mkdtemp(prefix='robotbench')
+    Log.RobotLibDir = tmpdir
+    Log.LogLevelFile = tmpdir + "/loglevel"
+    Log.LogDir = tmpdir
+    log = Log()
+    log.init(module)
+    # Start the writer now so it is not timed with the first message
+    log.message("Benchmark started", log.INFO)
+    return log, tmpdir
+
+# Log messages per second before and after
+def benchLog(count=2000):
+    log, tmpdir = setupLog()
+
+    # The legacy method is slow so run fewer messages
+    legacyCount = max(count//20, 10)
+    for level, name in ((logging.INFO, "INFO"), (logging.DEBUG, "DEBUG (filtered)")):
+        start = time.perf_counter()
+        for i in range(legacyCount):
+            legacyMessage(tmpdir, "legacy", "message " + str(i), level, logging.INFO)
+        report("legacy " + name, legacyCount, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(count):
+            log.message("message " + str(i), level)
+        report("queued " + name, count, time.perf_counter() - start)
+
+    # Include the time for the writer to empty the queue
+    start = time.perf_counter()
+    for i in range(count):
+        log.message("message " + str(i), logging.INFO)
+    Log.stop()
+    report("queued INFO incl. flush", count, time.perf_counter() - start)
+
+# Create a robot connected to a simulated arm and switches
+def simRobot(latency=0.0):
+    log, tmpdir = setupLog()
+    import robotd
+    from usb_class import UsbArm
+    from sim_class import SimBackend, FakeGPIO
+    robot = robotd.Robot(tmpdir + '/robotd.pid')
+    backend = SimBackend(latency)
+    robot.arm = UsbArm(robotd.usb_vendor_id, robotd.usb_prod_id, backend)
+    robot.gpio = FakeGPIO()
+    robot.setupSwitches()
+    robot.control.start()
+    return robot, backend.device
+
+# Run action(i) count times and report call latency, transfers per
+# second and memory allocation. Live inputs are sent by the control
+# loop so wait for its next tick before counting transfers
+def measureStage(name,count,device,action,tick=0.0):
+    hist = Histogram(name)
+    device.clear()
+    with open(os.devnull,'w') as null, contextlib.redirect_stdout(null):
+        start = time.perf_counter()
+        for i in range(count):
+            t0 = time.perf_counter()
+            action(i)
+            hist.add(time.perf_counter() - t0)
+        time.sleep(tick)
+        elapsed = time.perf_counter() - start
+        transfers = len(device.transfers)
+
+        # Measure memory with a second run as tracing slows everything down
+        tracemalloc.start()
+        blocks = sys.getallocatedblocks()
+        tracemalloc.reset_peak()
+        for i in range(count):
+            action(i)
+        blocks = sys.getallocatedblocks() - blocks
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    print (hist.summary())
+    print ("%-20s transfers=%d %.0f transfers/s net blocks/op=%.2f peak=%.1fKiB"
+            % ('', transfers, transfers/elapsed, blocks/count, peak/1024.0))
+    return transfers
+
+# Wait for the simulated arm to receive a number of transfers
+def waitTransfers(device,count,timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while len(device.transfers) < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+# Press and release a switch and report the latency from each edge
+# to the transfer it causes
+def measureSwitch(name,count,robot,device,pin,hold=0.05):
+    gpio = robot.gpio
+    press = Histogram(name + ' press')
+    release = Histogram(name + ' release')
+    device.clear()
+    with open(os.devnull,'w') as null, contextlib.redirect_stdout(null):
+        for i in range(count):
+            time.sleep(random.uniform(0, robot.control.period))
+            n = len(device.transfers)
+            t0 = time.monotonic()
+            gpio.press(pin)
+            waitTransfers(device, n + 1)
+            # Do not keep in step with the control loop
+            time.sleep(hold + random.uniform(0, robot.control.period))
+            t1 = time.monotonic()
+            gpio.release(pin)
+            waitTransfers(device, n + 2)
+            gpio.join()
+            sent = device.transfers[n:]
+            if len(sent) >= 2:
+                press.add(sent[0][0] - t0)
+                release.add(sent[-1][0] - t1)
+    print (press.summary())
+    print (release.summary())
+    return len(device.transfers)
+
+# Hold several switches at once and return the last command sent
+def combineSwitches(robot,device,pins):
+    gpio = robot.gpio
+    n = len(device.transfers)
+    for pin in pins:
+        gpio.press(pin)
+        gpio.join()
+    waitTransfers(device, n + len(pins))
+    time.sleep(robot.control.period * 3)
+    cmd = tuple(device.transfers[-1][1])
+    for pin in pins:
+        gpio.release(pin)
+    gpio.join()
+    time.sleep(robot.control.period * 3)
+    return cmd
+
+# End to end latency and throughput using the simulated arm
+def benchPipeline(count=2000):
+    import robotd
+    from sim_class import FakeJoystick
+    robot, device = simRobot()
+    joystick = FakeJoystick()
+    failed = []
+
+    def axis(i):
+        robot.handleEvent(joystick.axis(i & 1, (0.0, 0.9, -0.9)[i % 3]))
+
+    def button(i):
+        if i & 1:
+            robot.handleEvent(joystick.buttonUp(6))
+        else:
+            robot.handleEvent(joystick.buttonDown(6))
+
+    moves = [cmd for cmd in robotd.commands if 'light' not in cmd]
+    def execute(i):
+        robot.execute(0, moves[i % len(moves)])
+
+    # The handlers only update the control loop so time them flat out,
+    # then pace the inputs to see the transfers the control loop sends.
+    # Inputs that arrive in the same tick are sent as one transfer
+    tick = robot.control.period * 2
+    def paced(action):
+        def run(i):
+            action(i)
+            time.sleep(0.001)
+        return run
+
+    for name, action in (('handleEvent axis', axis), ('handleEvent button', button)):
+        measureStage(name, count, device, action, tick)
+        if measureStage(name + ' 1ms apart', 200, device, paced(action), tick) == 0:
+            failed.append(name)
+        robot.handleEvent(joystick.axis(0, 0.0))
+        robot.handleEvent(joystick.axis(1, 0.0))
+    print ("control loop " + robot.control.summary())
+
+    if measureStage('execute', count, device, execute) == 0:
+        failed.append('execute')
+
+    if measureSwitch('switch_event', 10, robot, device, robotd.ELBOW_UP) == 0:
+        failed.append('switch_event')
+    cmd = combineSwitches(robot, device, (robotd.ELBOW_UP, robotd.BASE_CLOCKWISE))
+    print ("switch_event elbow-up + base-clockwise sent " + str(cmd))
+
+    # A release that RPi.GPIO dropped within the bounce time
+    gpio = robot.gpio
+    with open(os.devnull,'w') as null, contextlib.redirect_stdout(null):
+        gpio.press(robotd.WRIST_UP)
+        gpio.join()
+        gpio.levels[robotd.WRIST_UP] = 0
+        time.sleep(robotd.switch_bouncetime / 1000.0 + 0.05)
+    stopped = device.transfers[-1][1][0] == 0
+    print ("switch_event dropped release stopped=%s" % stopped)
+    if not stopped:
+        failed.append('dropped release')
+    print (robot.control.latency.summary())
+    print (robot.control.stopLatency.summary())
+    print (robot.control.jitter.summary())
+
+    if len(failed) > 0:
+        print ("Failed: " + ', '.join(failed))
+        sys.exit(1)
+
+# Compile a large commands file with and without the cache
+def benchScript(lines=20000):
+    import robotd
+    from script_class import ScriptCompiler
+    log, tmpdir = setupLog()
+    path = tmpdir + "/commands"
+    moves = [cmd for cmd in robotd.commands if 'light' not in cmd]
+    with open(path, 'w') as f:
+        for i in range(lines):
+            f.write(moves[i % len(moves)] + " 0.0%d\n" % (i % 10))
+
+    compiler = ScriptCompiler(robotd.table, tmpdir + "/cache")
+    for name in ('parse and cache', 'cached'):
+        start = time.perf_counter()
+        program = compiler.compile(path)
+        elapsed = time.perf_counter() - start
+        print ("%-16s %6d lines %6d steps %8.2f ms" % (name, lines, len(program), elapsed*1000))
+
+    # Legacy parsing as done line by line before the compiler
+    start = time.perf_counter()
+    with open(path) as f:
+        for command in f.readlines():
+            command = " ".join(command.rstrip().split())
+            cmds = command.split(' ')
+            float(cmds[1])
+            robotd.commands[cmds[0]]
+    elapsed = time.perf_counter() - start
+    print ("%-16s %6d lines %14s %8.2f ms" % ('legacy parse', lines, '', elapsed*1000))
+
+# Requested against achieved motor on-time using the simulated arm with
+# a transfer latency, for sleep based timing and deadline timing
+def benchTiming(steps=100,t=0.02,latency=0.002):
+    import robotd
+    from timer_class import MotionTimer
+    robot, device = simRobot(latency)
+    robot.control.stop()
+    robot.checkComms()
+    stop = robotd.table.byName['stop']
+    payload = robotd.table.byName['elbow-up']
+
+    # Sleep for the time between the two transfers as done previously
+    legacy = MotionTimer()
+    device.clear()
+    for i in range(steps):
+        robot.sendCommand(payload)
+        time.sleep(t)
+        robot.sendCommand(stop)
+    for i in range(0, len(device.transfers), 2):
+        legacy.record(t, device.transfers[i+1][0] - device.transfers[i][0])
+    print ("%-10s %s" % ('sleep', legacy.summary()))
+
+    robot.timer = MotionTimer()
+    device.clear()
+    for i in range(steps):
+        robot.timer.move(robot.sendCommand, payload, stop, t)
+    print ("%-10s %s" % ('deadline', robot.timer.summary()))
+
+    # A script is timed from its start so errors must not add up
+    program = robot.compiler.compileLines('bench', ["elbow-up %f\n" % t] * steps)
+    robot.timer = MotionTimer()
+    start = time.monotonic()
+    with open(os.devnull,'w') as null, contextlib.redirect_stdout(null):
+        robot.runProgram(program)
+    drift = time.monotonic() - start - program.duration()
+    print ("%-10s %s drift=%.3fms" % ('script', robot.timer.summary(), drift*1000))
+
+# Daemon start up code run in a new interpreter for each input path.
+# Prints the start up time in seconds and the peak RSS in KiB
+STARTUP = {
+    'joydev' : """
+import time, resource
+start = time.perf_counter()
+import robotd, input_class
+joystick = input_class.JoydevInput(%r)
+print (time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+""",
+    'pygame' : """
+import os, time, resource
+start = time.perf_counter()
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+import robotd, pygame
+pygame.init()
+pygame.joystick.get_count()
+print (time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+""",
+    }
+
+# Start up time and memory of each input path, the median of several runs
+def measureStartup(name,code,runs=5):
+    times = []
+    rss = []
+    for i in range(runs):
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode != 0:
+            print ("%-8s start up failed: %s" % (name, result.stderr.strip().splitlines()[-1]))
+            return
+        t, kib = result.stdout.split()
+        times.append(float(t))
+        rss.append(int(kib))
+    times.sort()
+    rss.sort()
+    print ("%-8s cold start %8.1f ms  max RSS %8.1f MiB"
+            % (name, times[runs//2]*1000, rss[runs//2]/1024.0))
+
+# Write joystick events to a pipe from another thread and measure the
+# time until each is returned by the input class
+def measureEventLatency(joystick,fifo,count):
+    from input_class import JoydevInput, JS_EVENT_AXIS
+    hist = Histogram('joydev event')
+    fd = os.open(fifo, os.O_WRONLY)
+    sent = [0.0] * count
+
+    def writer():
+        for i in range(count):
+            time.sleep(random.uniform(0.0005, 0.002))
+            sent[i] = time.monotonic()
+            os.write(fd, JoydevInput.EVENT.pack(int(sent[i]*1000) & 0xffffffff,
+                    (0, 30000, -30000)[i % 3], JS_EVENT_AXIS, i & 1))
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    received = 0
+    while received < count:
+        for event in joystick.wait(1.0):
+            hist.add(event.time - sent[received])
+            received += 1
+    thread.join()
+    os.close(fd)
+    return hist
+
+# The same through the pygame event queue as used before
+def measurePygameLatency(count):
+    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+    import pygame
+    pygame.init()
+    hist = Histogram('pygame event')
+    sent = [0.0] * count
+
+    def writer():
+        for i in range(count):
+            time.sleep(random.uniform(0.0005, 0.002))
+            sent[i] = time.monotonic()
+            pygame.event.post(pygame.event.Event(pygame.JOYAXISMOTION, axis=i & 1, value=0.0))
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    received = 0
+    while received < count:
+        event = pygame.event.wait()
+        if event.type == pygame.JOYAXISMOTION:
+            hist.add(time.monotonic() - sent[received])
+            received += 1
+    thread.join()
+    return hist
+
+# Joystick input read directly from the device against pygame. A named
+# pipe stands in for /dev/input/js0 and the events written to it are
+# recorded then replayed through the robot
+def benchInput(count=500):
+    from input_class import JoydevInput, ReplayInput
+    log, tmpdir = setupLog()
+    fifo = tmpdir + "/js0"
+    os.mkfifo(fifo)
+
+    for name in ('joydev', 'pygame'):
+        code = STARTUP[name]
+        if name == 'joydev':
+            code = code % fifo
+        measureStartup(name, code)
+
+    recording = tmpdir + "/joystick.rec"
+    joystick = JoydevInput(fifo, recording)
+    print (measureEventLatency(joystick, fifo, count).summary())
+    joystick.close()
+    try:
+        print (measurePygameLatency(count).summary())
+    except ImportError:
+        print ("pygame event latency: pygame not installed")
+
+    # Replay the recording with its original timing through the robot
+    robot, device = simRobot()
+    replay = ReplayInput(recording)
+    device.clear()
+    events = 0
+    while not replay.finished():
+        for event in replay.wait(0):
+            robot.handleEvent(event)
+            events += 1
+    waitTransfers(device, 1)
+    robot.control.stop()
+    print ("replayed %d events, %d transfers" % (events, len(device.transfers)))
+    if events != count or len(device.transfers) == 0:
+        sys.exit(1)
+# Wait until check() is true, returns the time taken or None
+def waitUntil(check,timeout=5.0):
+    start = time.monotonic()
+    while not check():
+        if time.monotonic() - start > timeout:
+            return None
+        time.sleep(0.0002)
+    return time.monotonic() - start
+
+# Plug the simulated arm out and in, reporting the time until the robot
+# has noticed. plug(attached) changes the device and sends the event
+def measureHotplug(name,robot,backend,plug,count):
+    detach = Histogram(name + ' detach')
+    attach = Histogram(name + ' attach')
+    for i in range(count):
+        time.sleep(random.uniform(0, 0.01))
+        backend.unplug()
+        plug(False)
+        t = waitUntil(lambda: robot.arm.attached is False)
+        if t is not None:
+            detach.add(t)
+        backend.plug()
+        plug(True)
+        t = waitUntil(lambda: robot.arm.isOpen())
+        if t is not None:
+            attach.add(t)
+    print (detach.summary())
+    print (attach.summary())
+    return attach.count + detach.count == 2 * count
+
+# Arm and joystick replug times with hotplug events and with polling /sys,
+# against the 10 second sleep loops used before
+def benchHotplug(count=50,polls=5):
+    import robotd
+    from hotplug_class import PollingSource
+    from sim_class import FakeUevents
+    robot, device = simRobot()
+    backend = robot.arm.backend
+    robot.checkComms()
+    failed = False
+
+    events = FakeUevents()
+    robot.startHotplug(events)
+    def uevent(attached):
+        if attached:
+            events.armAdd()
+        else:
+            events.armRemove()
+    failed |= not measureHotplug('uevent arm', robot, backend, uevent, count)
+
+    plugged = Histogram('uevent joystick attach')
+    for i in range(count):
+        robot.joystickPlugged.clear()
+        events.joystickAdd()
+        t = waitUntil(robot.joystickPlugged.is_set)
+        if t is not None:
+            plugged.add(t)
+    print (plugged.summary())
+
+    # A copy of the /sys tree for the arm
+    root = tempfile.mkdtemp(prefix='robotsys')
+    usbdir = root + '/sys/bus/usb/devices/1-1'
+    uevent = "DEVTYPE=usb_device\nPRODUCT=%x/%x/100\n" % (device.idVendor, device.idProduct)
+    def poll(attached):
+        if attached:
+            os.makedirs(usbdir)
+            with open(usbdir + '/uevent', 'w') as f:
+                f.write(uevent)
+        else:
+            os.remove(usbdir + '/uevent')
+            os.rmdir(usbdir)
+
+    # The add uevent for the arm is lost, the arm is found by scanning /sys
+    robot.hotplug.root = root
+    backend.unplug()
+    events.armRemove()
+    waitUntil(lambda: robot.arm.attached is False)
+    backend.plug()
+    poll(True)
+    events.overflow()
+    t = waitUntil(lambda: robot.arm.isOpen())
+    print ("uevents lost, arm found by rescan after %s" % ("%.1fms" % (t * 1000)
+            if t is not None else "never"))
+    failed |= t is None
+    print ("uevent counts " + robot.hotplug.summary())
+    robot.hotplug.stop()
+
+    # Polling the copy of /sys
+    robot.startHotplug(PollingSource(robotd.hotplug_poll_interval, root))
+    failed |= not measureHotplug('polling arm', robot, backend, poll, polls)
+    print ("polling counts " + robot.hotplug.summary())
+    robot.hotplug.stop()
+    print ("10s sleep loop arm attach mean=5000ms max=10000ms, detach never seen")
+    robot.control.stop()
+    if failed:
+        sys.exit(1)
+# Robot daemon commands timed by the startup benchmark
+STARTUP_COMMANDS = (['version'], ['status'], ['execute', '/nonexistent'])
+
+# Run robotd.py with -X importtime and return a list of (cumulative
+# microseconds, module, imported by robotd.py itself) for each import
+def traceStartup(robotd,args):
+    result = subprocess.run([sys.executable, '-X', 'importtime', robotd] + args,
+            capture_output=True, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) != 3 or not line.startswith('import time:'):
+            continue
+        name = fields[2]
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            continue
+        modules.append((cumulative, name.strip(), len(name) - len(name.lstrip()) == 1))
+    return modules
+
+# Wall clock time and imports of each robotd.py command
+def benchStartup(runs=9):
+    if os.geteuid() != 0:
+        print ("robotd.py must be run as root, run the startup benchmark with sudo")
+        sys.exit(1)
+    robotd = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'robotd.py')
+    for args in STARTUP_COMMANDS:
+        times = []
+        for i in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, robotd] + args, capture_output=True)
+            times.append(time.perf_counter() - start)
+        times.sort()
+        modules = traceStartup(robotd, args)
+        top = sorted((m for m in modules if m[2]), reverse=True)[:5]
+        print ("%-22s %7.1f ms %4d modules  %s" % (' '.join(args), times[runs//2]*1000,
+                len(modules), ' '.join("%s=%.1fms" % (name, us/1000.0) for us, name, t in top)))
+
+    # The interpreter alone
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'])
+        times.append(time.perf_counter() - start)
+    times.sort()
+    print ("%-22s %7.1f ms" % ('python (no script)', times[runs//2]*1000))
+# Record a session of joystick, button, switch and light changes with the
+# simulated arm, replay it and convert it to a commands file and back
+def benchReplay(changes=60):
+    import robotd
+    import record_class
+    from sim_class import FakeJoystick
+    from timer_class import MotionTimer
+    robot, device = simRobot()
+    table = robotd.table
+    joystick = FakeJoystick()
+    gpio = robot.gpio
+    path = tempfile.mkdtemp(prefix='robotrec') + "/session.rec"
+
+    # Each input is let go before the next so every change is one transfer
+    actions = (
+        lambda: robot.handleEvent(joystick.axis(robotd.AXIS_VERTICAL, 0.9)),
+        lambda: robot.handleEvent(joystick.axis(robotd.AXIS_VERTICAL, 0.0)),
+        lambda: robot.handleEvent(joystick.buttonDown(6)),
+        lambda: robot.handleEvent(joystick.buttonUp(6)),
+        lambda: gpio.press(robotd.BASE_CLOCKWISE),
+        lambda: gpio.release(robotd.BASE_CLOCKWISE),
+        lambda: robot.setLight(not robot.light_on),
+        )
+    error = robot.startRecording(path)
+    if error is not None:
+        print (error)
+        sys.exit(1)
+    device.clear()
+    start = time.monotonic()
+    for i in range(changes):
+        actions[i % len(actions)]()
+        gpio.join()
+        time.sleep(random.uniform(0.02, 0.06))
+    elapsed = time.monotonic() - start
+    robot.stopRecording()
+    robot.control.stop()
+    live = [payload for t, payload in device.transfers]
+    records = record_class.load(path, table)
+    print ("recorded %d changes in %.2fs, %d bytes" % (len(records), elapsed,
+            os.path.getsize(path)))
+
+    robot.timer = MotionTimer()
+    device.clear()
+    with open(os.devnull,'w') as null, contextlib.redirect_stdout(null):
+        error = robot.replay(path)
+    replayed = [payload for t, payload in device.transfers]
+    print ("replay     " + robot.timer.summary())
+    # The replay starts and ends with the arm stopped
+    same = replayed[1:len(live)+1] == live
+    print ("replay sent %d transfers, live session %d, same payloads: %s"
+            % (len(replayed), len(live), same))
+
+    # To a commands file and back
+    script = record_class.toScript(table, records)
+    program = robot.compiler.compileLines('recording', [line + "\n" for line in script])
+    steps = record_class.timeline(table, record_class.fromProgram(table, program))
+    original = record_class.timeline(table, records)
+    drift = (steps[-1][0] - original[-1][0]) / 1000000.0
+    print ("to-script %d lines, back to %d changes, length difference %.3fms"
+            % (len(script), len(steps), drift))
+    if error is not None or not same or abs(drift) > 1.0:
+        sys.exit(1)
+# Time from the first transfer that moves a joint to the transfer that
+# stops it, None if it was not stopped
+def moveTime(transfers,armBits,baseBits):
+    start = None
+    for t, payload in transfers:
+        moving = payload[0] & armBits or payload[1] & baseBits
+        if moving and start is None:
+            start = t
+        elif not moving and start is not None:
+            return t - start
+    return None
+
+# Soft limits with the simulated arm. Joints are made fast with a small
+# limit so that each check takes a fraction of a second
+def benchPose(speed=100.0,limit=20.0):
+    import robotd
+    from pose_class import PoseEstimator
+    from command_class import JOINTS
+    robot, device = simRobot()
+    table = robotd.table
+    gpio = robot.gpio
+    moves = {}
+    for name, ((up, s1), (down, s2)) in robotd.joint_moves.items():
+        moves[name] = ((up, speed), (down, speed))
+    robot.pose = PoseEstimator(table, moves, dict((name, (-limit, limit)) for name in moves))
+    bits = dict((name, (armBits, baseBits)) for name, armBits, baseBits in JOINTS)
+    expected = limit / speed
+    failed = []
+
+    def check(name,t,want,tolerance):
+        if t is None:
+            print ("%-34s not stopped" % name)
+            failed.append(name)
+            return
+        print ("%-34s %7.1f ms (limit at %.1f ms) overshoot %.2f degrees"
+                % (name, t*1000, want*1000, (t - want) * speed))
+        if abs(t - want) > tolerance:
+            failed.append(name)
+
+    # A switch held past the limit is stopped by the control loop
+    device.clear()
+    gpio.press(robotd.SHOULDER_UP)
+    time.sleep(expected * 2)
+    gpio.release(robotd.SHOULDER_UP)
+    gpio.join()
+    check('switch shoulder-up held', moveTime(device.transfers, *bits['shoulder']),
+            expected, robot.control.period * 2)
+
+    # Pressing it again does not move the shoulder, the other way does
+    device.clear()
+    gpio.press(robotd.SHOULDER_UP)
+    time.sleep(0.05)
+    gpio.release(robotd.SHOULDER_UP)
+    gpio.join()
+    time.sleep(0.02)
+    moved = [p for t, p in device.transfers if p[0] & bits['shoulder'][0]]
+    print ("%-34s %d moving transfers" % ('switch shoulder-up at limit', len(moved)))
+    if len(moved) > 0:
+        failed.append('at limit')
+    gpio.press(robotd.SHOULDER_DOWN)
+    time.sleep(expected / 2)
+    gpio.release(robotd.SHOULDER_DOWN)
+    gpio.join()
+    time.sleep(0.02)
+
+    # Timed moves and scripts are cut short
+    robot.control.stop()
+    with open(os.devnull,'w') as null, contextlib.redirect_stdout(null):
+        device.clear()
+        robot.execute(1.0, 'elbow-up')
+        elbow = moveTime(device.transfers, *bits['elbow'])
+        device.clear()
+        program = robot.compiler.compileLines('pose', ["parallel { wrist-down 1; base-clockwise 0.1 }\n"])
+        robot.runProgram(program)
+    check('execute elbow-up 1.0', elbow, expected, 0.002)
+    check('script base-clockwise 0.1', moveTime(device.transfers, *bits['base']), 0.1, 0.002)
+    check('script wrist-down 1 (parallel)', moveTime(device.transfers, *bits['wrist']),
+            expected, 0.002)
+    print ("pose " + robot.pose.summary())
+
+    # Back at the start up position every joint can move again
+    masked = robot.pose.limit(table.byName['elbow-up']) is not table.byName['elbow-up']
+    robot.homeArms()
+    homed = all(angle == 0.0 for name, angle in robot.pose.pose())
+    free = robot.pose.limit(table.byName['elbow-up']) is table.byName['elbow-up']
+    print ("home: elbow was masked %s, angles zero %s, elbow free %s" % (masked, homed, free))
+    if not homed or not free:
+        failed.append('home')
+
+    # Cost of masking and updating on each transfer
+    payload = table.byName['grip-open']
+    count = 100000
+    start = time.perf_counter()
+    for i in range(count):
+        robot.pose.update(robot.pose.limit(payload))
+    elapsed = time.perf_counter() - start
+    print ("limit and update %.2f us" % (elapsed / count * 1000000))
+
+    if len(failed) > 0:
+        print ("Failed: " + ', '.join(failed))
+        sys.exit(1)
+
+# Angles in commands files converted with the calibrated joint speeds,
+# recompiling when the calibration changes and checking scripts against
+# the soft limits
+def benchCalibration(lines=20000):
+    import robotd
+    from script_class import ScriptCompiler
+    from calibration_class import Calibration
+    from pose_class import PoseEstimator
+    log, tmpdir = setupLog()
+    table = robotd.table
+    failed = []
+
+    # Measured speeds survive a save and load
+    calibration = Calibration(robotd.joint_moves, tmpdir + "/calibration")
+    for cmd in calibration.speeds:
+        calibration.measure(cmd, 90.0, 90.0 / (10.0 + len(cmd)))
+    calibration.save()
+    loaded = Calibration(robotd.joint_moves, tmpdir + "/calibration")
+    loaded.load()
+    same = all(abs(loaded.speeds[cmd] - calibration.speeds[cmd]) < 0.01
+            for cmd in calibration.speeds)
+    print ("%-24s %d speeds %s" % ('save and load', len(loaded.calibrated),
+            'match' if same else 'differ'))
+    if not same or len(loaded.calibrated) != len(calibration.speeds):
+        failed.append('save and load')
+
+    # Angles become the same durations as the equivalent times
+    path = tmpdir + "/commands"
+    moves = [cmd for cmd in calibration.speeds]
+    with open(path, 'w') as f:
+        for i in range(lines):
+            f.write(moves[i % len(moves)] + " %ddeg\n" % (i % 10))
+    compiler = ScriptCompiler(table, tmpdir + "/cache", loaded)
+    for name in ('parse and cache', 'cached'):
+        start = time.perf_counter()
+        program = compiler.compile(path)
+        elapsed = time.perf_counter() - start
+        print ("%-24s %6d lines %6d steps %8.2f ms" % (name, lines, len(program), elapsed*1000))
+    wanted = sum((i % 10) / loaded.speeds[moves[i % len(moves)]] for i in range(lines))
+    print ("%-24s %.3f s (expected %.3f s)" % ('program time', program.duration(), wanted))
+    if abs(program.duration() - wanted) > 0.001:
+        failed.append('durations')
+
+    # A new calibration makes the cached program out of date
+    loaded.measure(moves[0], 90.0, 1.0)
+    misses = compiler.misses
+    compiler.compile(path)
+    print ("%-24s %s" % ('after calibration', 'recompiled' if compiler.misses > misses
+            else 'cached'))
+    if compiler.misses == misses:
+        failed.append('recompile')
+
+    # Batch validation reports the line that passes a limit
+    good = tmpdir + "/good"
+    bad = tmpdir + "/bad"
+    with open(good, 'w') as f:
+        for i in range(lines // 2):
+            f.write("shoulder-up 10deg\nshoulder-down 10deg\n")
+    with open(bad, 'w') as f:
+        f.write("elbow-up 100deg\nparallel { elbow-up 100deg; base-clockwise 10deg }\n")
+    for name in (good, bad):
+        program = compiler.compile(name)
+        start = time.perf_counter()
+        pose = PoseEstimator(table, loaded.moves(), robotd.joint_limits)
+        problems = pose.check(program)
+        elapsed = time.perf_counter() - start
+        print ("%-24s %6d steps %8.2f ms %s" % ('validate ' + os.path.basename(name),
+                len(program), elapsed*1000, problems))
+        if (name == good) != (len(problems) == 0):
+            failed.append('validate')
+    if problems[0][:2] != (2, 'elbow'):
+        failed.append('validate line')
+
+    if len(failed) > 0:
+        print ("Failed: " + ', '.join(failed))
+        sys.exit(1)
+
+# move-to planning: building and loading the grid, query latency against
+# a search of the whole grid and how close the grip gets to the point
+def benchIK(queries=500):
+    import robotd
+    import numpy as np
+    from ik_class import IKPlanner
+    from pose_class import PoseEstimator
+    from script_class import ScriptCompiler
+    log, tmpdir = setupLog()
+    table = robotd.table
+    moves = robotd.joint_moves
+    failed = []
+
+    planner = IKPlanner(robotd.arm_lengths, robotd.joint_home, robotd.joint_limits,
+            robotd.ik_step, robotd.ik_tolerance, tmpdir + "/cache")
+    planner.open()
+    print ("%-24s %8.1f ms %d points" % ('build grid', planner.buildTime * 1000,
+            len(planner.grid['r'])))
+    cached = IKPlanner(robotd.arm_lengths, robotd.joint_home, robotd.joint_limits,
+            robotd.ik_step, robotd.ik_tolerance, tmpdir + "/cache")
+    start = time.perf_counter()
+    cached.open()
+    print ("%-24s %8.1f ms" % ('load cached grid', (time.perf_counter() - start) * 1000))
+    if cached.buildTime is not None:
+        failed.append('cache')
+
+    # Points the grip can reach, worked out from random joint angles
+    height, upper, fore, grip = robotd.arm_lengths
+    rng = random.Random(1)
+    points = []
+    for i in range(queries):
+        angles = dict((joint, rng.uniform(*cached.ranges[joint]) * 0.9)
+                for joint in ('shoulder', 'elbow', 'wrist', 'base'))
+        a1 = math.radians(angles['shoulder'])
+        a2 = a1 + math.radians(angles['elbow'])
+        a3 = a2 + math.radians(angles['wrist'])
+        r = upper * math.cos(a1) + fore * math.cos(a2) + grip * math.cos(a3)
+        z = height + upper * math.sin(a1) + fore * math.sin(a2) + grip * math.sin(a3)
+        b = math.radians(angles['base'])
+        if r < 0:
+            continue
+        points.append((r * math.cos(b), r * math.sin(b), z))
+
+    pose = PoseEstimator(table, moves, robotd.joint_limits)
+    angles = dict(zip(pose.names, pose.angle))
+    speeds = dict((name, (up, -down)) for name, (up, down) in zip(pose.names, pose.speeds))
+    start = time.perf_counter()
+    results = [cached.solve(x, y, z, angles, speeds) for x, y, z in points]
+    elapsed = time.perf_counter() - start
+    print ("%-24s %8.1f us" % ('query', elapsed / len(points) * 1000000))
+
+    # The same query searching the whole grid
+    grid = cached.grid
+    start = time.perf_counter()
+    for x, y, z in points:
+        dr = grid['r'] - math.hypot(x, y)
+        dz = grid['z'] - z
+        np.argmin(dr * dr + dz * dz)
+    elapsed = time.perf_counter() - start
+    print ("%-24s %8.1f us" % ('whole grid search', elapsed / len(points) * 1000000))
+
+    # How far the planned angles leave the grip from the point
+    errors = []
+    for (x, y, z), target in zip(points, results):
+        if target is None:
+            continue
+        absolute = dict((joint, target[joint] + robotd.joint_home[joint]) for joint in target)
+        a1 = math.radians(absolute['shoulder'])
+        a2 = a1 + math.radians(absolute['elbow'])
+        a3 = a2 + math.radians(absolute['wrist'])
+        r = upper * math.cos(a1) + fore * math.cos(a2) + grip * math.cos(a3)
+        b = math.radians(absolute['base'])
+        errors.append(math.dist((r * math.cos(b), r * math.sin(b),
+                height + upper * math.sin(a1) + fore * math.sin(a2) + grip * math.sin(a3)),
+                (x, y, z)))
+    errors.sort()
+    print ("%-24s %d of %d, error median %.1f mm max %.1f mm" % ('reached', len(errors),
+            len(points), errors[len(errors) // 2], errors[-1]))
+    if len(errors) < len(points) * 0.95 or errors[-1] > robotd.ik_tolerance:
+        failed.append('reach')
+
+    # Planning a commands file of move-to points
+    compiler = ScriptCompiler(table, tmpdir + "/cache")
+    program = compiler.compileLines('ik', ["move-to %.1f %.1f %.1f\n" % p for p in points])
+    start = time.perf_counter()
+    planned = cached.expand(compiler, 'ik', program, PoseEstimator(table, moves,
+            robotd.joint_limits))
+    elapsed = time.perf_counter() - start
+    print ("%-24s %8.1f ms %d moves, %d steps %.1f s" % ('plan commands file', elapsed * 1000,
+            len(points), len(planned), planned.duration()))
+    problems = PoseEstimator(table, moves, robotd.joint_limits).check(planned)
+    if len(problems) > 0:
+        print ("Past limits: " + str(problems[:5]))
+        failed.append('limits')
+
+    if len(failed) > 0:
+        print ("Failed: " + ', '.join(failed))
+        sys.exit(1)
+
+# A commands file run on every arm at once with 1, 4 and 16 simulated
+# arms: how far apart the arms start, the on-time error and the time
+# taken against the length of the file
+def benchArms(counts=(1, 4, 16),latency=0.002):
+    import robotd
+    from usb_class import UsbArm
+    from sim_class import SimBackend
+    log, tmpdir = setupLog()
+    path = tmpdir + "/commands"
+    with open(path, 'w') as f:
+        for i in range(10):
+            f.write("parallel { shoulder-up 0.05; base-clockwise 0.03 }\n")
+            f.write("parallel { shoulder-down 0.05; base-anti-clockwise 0.03 }\n")
+    failed = []
+    for count in counts:
+        robot = robotd.Robot(tmpdir + '/robotd.pid')
+        backend = SimBackend(latency, count)
+        robot.arm = UsbArm(robotd.usb_vendor_id, robotd.usb_prod_id, backend)
+        robot.findArms()
+        with open(os.devnull,'w') as null, contextlib.redirect_stdout(null):
+            start = time.monotonic()
+            error = robot.executeFile(path, 'all')
+            elapsed = time.monotonic() - start
+        firsts = [device.transfers[0][0] for device in backend.devices if device.transfers]
+        sent = set(tuple(p for t, p in device.transfers) for device in backend.devices)
+        errors = [abs(worker.timer.accuracy()[0]) for worker in robot.workers]
+        jitter = [worker.timer.accuracy()[1] for worker in robot.workers]
+        print ("%2d arms %d workers: start skew %6.3f ms, mean error %.3f ms, jitter %.3f ms, "
+                "%.3f s for %.3f s" % (count, len(robot.workers),
+                (max(firsts) - min(firsts)) * 1000, max(errors) * 1000, max(jitter) * 1000,
+                elapsed, robot.compiler.compile(path).duration()))
+        if error is not None or len(firsts) != count or len(sent) != 1:
+            failed.append(str(count) + " arms " + str(error))
+        for worker in robot.workers:
+            worker.stop()
+
+    # An arm still busy with another file when the broadcast is due
+    with open(tmpdir + "/elbow", 'w') as f:
+        f.write("elbow-up 0.3\nwait 0.1\nelbow-down 0.3\n")
+    robot = robotd.Robot(tmpdir + '/robotd.pid')
+    backend = SimBackend(latency, 2)
+    robot.arm = UsbArm(robotd.usb_vendor_id, robotd.usb_prod_id, backend)
+    robot.findArms()
+    busy = robot.workers[1].submit(robot.compiler.compileLines('busy', ["wait 0.3\n"]))
+    with open(os.devnull,'w') as null, contextlib.redirect_stdout(null):
+        error = robot.executeFile(tmpdir + "/elbow", 'all')
+    end = time.monotonic()
+    ups = [onTime(list(device.transfers), 0x10, 0, end) for device in backend.devices]
+    print ("busy arm elbow-up on %s (0.3s) late starts=%d"
+            % (' '.join("%.3fs" % up for up in ups), robot.workers[1].lateStarts))
+    busy.wait()
+    if error is not None or busy.error is not None or any(abs(up - 0.3) > 0.02 for up in ups):
+        failed.append('busy arm')
+    for worker in robot.workers:
+        worker.stop()
+    if len(failed) > 0:
+        print ("Failed: " + ', '.join(failed))
+        sys.exit(1)
+
+# Live input changes while a transfer times out, with the control loop
+# sending each payload and waiting for it and with the transfer thread
+def benchTransfer(seconds=1.5,latency=0.002):
+    import robotd
+    from stats_class import Histogram
+    robot, device = simRobot(latency)
+    table = robotd.table
+    moves = [table.byName['elbow-up'], table.byName['elbow-down'], table.byName['stop']]
+    failed = []
+    for name, send in (('wait for transfer', robot.sendCommand),
+            ('transfer thread', robot.postCommand)):
+        control = robot.control
+        control.stop()
+        control.send = send
+        control.overruns = 0
+        control.jitter.reset()
+        sender = robot.worker.sender
+        posted = sender.posted
+        superseded = sender.superseded
+        timeouts = robot.arm.timeouts
+        setTime = Histogram(name + ' set')
+        control.start()
+        device.clear()
+        device.timeouts = 1
+        end = time.monotonic() + seconds
+        i = 0
+        while time.monotonic() < end:
+            t0 = time.perf_counter()
+            control.set('joystick', moves[i % len(moves)])
+            setTime.add(time.perf_counter() - t0)
+            i += 1
+            time.sleep(0.005)
+        control.set('joystick', table.byName['stop'], released=True)
+        time.sleep(0.05)
+        sender.flush(2.0)
+        print ("%-18s overruns=%d jitter max=%.1fms timeouts=%d transfers=%d "
+                "posted=%d superseded=%d" % (name, control.overruns, control.jitter.maximum*1000,
+                robot.arm.timeouts - timeouts, len(device.transfers),
+                sender.posted - posted, sender.superseded - superseded))
+        if robot.arm.timeouts == timeouts or device.transfers[-1][1] != table.byName['stop']:
+            failed.append(name)
+    print (robot.arm.transferTime.summary())
+    print (sender.latency.summary())
+    if robot.control.overruns > 0:
+        failed.append('overruns')
+    robot.control.stop()
+    if len(failed) > 0:
+        print ("Failed: " + ', '.join(failed))
+        sys.exit(1)
+
+# Joystick part speed: a joint pulsed at a duty cycle by the control loop
+# at 100 to 500 slices a second. Reports the duty achieved at the arm,
+# the slice timing jitter and the CPU time used
+def benchPWM(rates=(100, 200, 500),duty=0.3,seconds=1.0,latency=0.0005):
+    import robotd
+    from control_class import ControlLoop
+    robot, device = simRobot(latency)
+    table = robotd.table
+    move = table.byName['base-clockwise']
+    robot.control.stop()
+    failed = []
+    for rate in rates:
+        control = ControlLoop(table, robot.postCommand, rate, robot.limitCommand)
+        robot.control = control
+        control.start()
+        time.sleep(0.05)
+        device.clear()
+        cpu = time.process_time()
+        start = time.monotonic()
+        control.setDuty('joystick', [(move, duty)])
+        time.sleep(seconds)
+        control.set('joystick', table.byName['stop'], released=True)
+        end = time.monotonic()
+        cpu = time.process_time() - cpu
+        robot.worker.sender.flush(1.0)
+
+        # Stopped with nothing pending the loop waits instead of ticking
+        time.sleep(0.05)
+        ticks = control.ticks
+        idleCpu = time.process_time()
+        time.sleep(0.2)
+        idleCpu = time.process_time() - idleCpu
+        idleTicks = control.ticks - ticks
+        control.stop()
+
+        # Time the base was on between the first transfer and the stop
+        on = 0.0
+        transfers = device.transfers
+        for (t, payload), (next, p) in zip(transfers, transfers[1:]):
+            if payload[1] & 0x03:
+                on += min(next, end) - t
+        achieved = on / (end - transfers[0][0])
+        print ("%3d Hz duty %.3f (wanted %.2f) jitter p99=%.3fms max=%.3fms "
+                "transfers=%d/s cpu=%.1f%% overruns=%d" % (rate, achieved, duty,
+                control.jitter.percentile(99)*1000, control.jitter.maximum*1000,
+                len(transfers) / (end - start), cpu / (end - start) * 100, control.overruns))
+        print ("%3d Hz idle ticks=%d cpu=%.1f%%" % (rate, idleTicks, idleCpu / 0.2 * 100))
+        if abs(achieved - duty) > 0.05:
+            failed.append(str(rate) + " Hz")
+        if idleTicks > 0:
+            failed.append(str(rate) + " Hz idle")
+    if len(failed) > 0:
+        print ("Failed: " + ', '.join(failed))
+        sys.exit(1)
+
+# Write a joydev recording of a noisy stick: the shoulder held about the
+# threshold, the base swept slowly from one side to the other and the
+# twist resting at the edge of the dead zone, each with a wobble
+def noisyStick(path,seconds,rate=250,noise=0.04):
+    from input_class import JoydevInput, JS_EVENT_AXIS
+    import robotd
+    rng = random.Random(1)
+    axes = (
+        (robotd.AXIS_VERTICAL, lambda t: robotd.threshold),
+        (robotd.AXIS_HORIZONTAL, lambda t: math.sin(math.pi * t / seconds)),
+        (robotd.AXIS_TWIST, lambda t: robotd.joystick_deadzone),
+        )
+    with open(path, 'wb') as f:
+        for i in range(int(seconds * rate)):
+            t = i / rate
+            axis, position = axes[i % len(axes)]
+            value = max(-1.0, min(1.0, position(t) + rng.gauss(0.0, noise)))
+            f.write(JoydevInput.EVENT.pack(int(t * 1000), int(value * 32767),
+                    JS_EVENT_AXIS, axis))
+
+# Joystick changes and USB transfers per second replaying a noisy stick
+# with the old threshold only, then with hysteresis and smoothing, then
+# with part speed levels
+def benchAxes(seconds=3.0):
+    import robotd
+    from axis_class import AxisMap
+    from input_class import ReplayInput
+    robot, device = simRobot()
+    path = tempfile.mkdtemp(prefix='robotaxes') + "/noisy.js"
+    noisyStick(path, seconds)
+    settings = (
+        ('threshold', 1, 0.0, 1.0),
+        ('hysteresis', 1, robotd.joystick_hysteresis, robotd.joystick_smoothing),
+        ('levels %d' % robotd.joystick_levels, robotd.joystick_levels,
+                robotd.joystick_hysteresis, robotd.joystick_smoothing),
+        )
+    results = {}
+    for name, levels, hysteresis, smoothing in settings:
+        robot.axes = AxisMap(robotd.table, robotd.axisMap, robotd.threshold,
+                robotd.joystick_deadzone, hysteresis, smoothing, levels, robotd.axisTuning)
+        stick = ReplayInput(path)
+        hist = Histogram('update')
+        device.clear()
+        start = time.monotonic()
+        while not stick.finished():
+            for event in stick.wait(0.1):
+                t0 = time.perf_counter()
+                robot.handleEvent(event)
+                hist.add(time.perf_counter() - t0)
+        elapsed = time.monotonic() - start
+        robot.control.set('joystick', robotd.table.byName['stop'], released=True)
+        time.sleep(0.05)
+        robot.worker.sender.flush(1.0)
+        results[name] = robot.axes.changes
+        print ("%-12s events=%d/s changes=%.1f/s usb transfers=%.1f/s handle p50=%.1fus"
+                % (name, robot.axes.events / elapsed, robot.axes.changes / elapsed,
+                len(device.transfers) / elapsed, hist.percentile(50)*1000000))
+    robot.control.stop()
+    if results['hysteresis'] >= results['threshold']:
+        print ("Failed: hysteresis does not suppress changes")
+        sys.exit(1)
+
+    # A stick thrown from one side to the other in one event
+    axes = AxisMap(robotd.table, robotd.axisMap, robotd.threshold)
+    axes.update(robotd.AXIS_HORIZONTAL, 0.0)
+    axes.update(robotd.AXIS_HORIZONTAL, 1.0)
+    axes.update(robotd.AXIS_HORIZONTAL, -1.0)
+    if axes.joystickMoves() != [(robotd.table.byName['base-clockwise'], 1.0)]:
+        print ("Failed: stick reversed in one event does not move the other way")
+        sys.exit(1)
+
+    # A trigger reported at rest at -1 when the device is opened
+    axes = AxisMap(robotd.table, {robotd.AXIS_TWIST : ('wrist-up', 'wrist-down')},
+            robotd.threshold)
+    axes.update(robotd.AXIS_TWIST, -1.0)
+    ignored = axes.joystickMoves() == []
+    axes.update(robotd.AXIS_TWIST, 0.0)
+    axes.update(robotd.AXIS_TWIST, -1.0)
+    if not ignored or axes.joystickMoves() != [(robotd.table.byName['wrist-down'], 1.0)]:
+        print ("Failed: an axis at rest off centre moves the arm before it is centred")
+        sys.exit(1)
+
+# Type into a pipe as a terminal does for a key held down: the key once,
+# again after the repeat delay and then at the repeat rate. Returns the
+# time the last character was written
+def holdKey(fd,key,seconds,delay=0.5,interval=0.033):
+    start = time.monotonic()
+    os.write(fd, key.encode())
+    time.sleep(delay)
+    while time.monotonic() - start < seconds:
+        os.write(fd, key.encode())
+        time.sleep(interval)
+    return time.monotonic()
+
+# Times a joint starts and stops moving in a list of transfers
+def moveEdges(transfers,armBits,baseBits):
+    edges = []
+    moving = False
+    for t, payload in transfers:
+        now = bool(payload[0] & armBits or payload[1] & baseBits)
+        if now != moving:
+            edges.append(t)
+            moving = now
+    return edges
+
+# Hold the base key down for a while, then latch the shoulder with shift
+# and hold the elbow key with it. Compares the old key handling, which
+# ran each character for 0.1s, with hold-to-move
+def benchKeyboard(seconds=1.5):
+    import robotd
+    from keyboard_class import KeyboardInput, keyLoop, UNHELD
+    robot, device = simRobot()
+    table = robotd.table
+    holdable = [key for key, cmd in robotd.keyMap.items() if cmd not in UNHELD]
+
+    # The old keyboard loop, a blocking read and a 0.1s move per character
+    def legacy(fd):
+        while True:
+            key = os.read(fd, 1).decode()
+            if key == 'x':
+                return
+            cmd = robotd.keyMap.get(key)
+            if cmd is None:
+                continue
+            robot.control.set('keyboard', table.byName[cmd])
+            time.sleep(0.1)
+            robot.control.set('keyboard', table.byName['stop'], released=True)
+
+    def hold(fd):
+        keyLoop(KeyboardInput(fd, holdable, robotd.key_repeat_delay), robotd.keyMap, robot)
+
+    failed = []
+    for name, loop in (('legacy', legacy), ('hold-to-move', hold)):
+        r, w = os.pipe()
+        thread = threading.Thread(target=loop, args=(r,))
+        thread.start()
+        device.clear()
+        start = time.monotonic()
+        baseReleased = holdKey(w, 'a', seconds)
+        time.sleep(0.3)
+        os.write(w, b'D')
+        time.sleep(0.1)
+        os.write(w, b'j')
+        elbowReleased = holdKey(w, 'f', seconds)
+        time.sleep(0.3)
+        os.write(w, b'm')
+        os.write(w, b'k')
+        time.sleep(0.2)
+        os.write(w, b'x')
+        thread.join()
+        time.sleep(0.05)
+        robot.worker.sender.flush(1.0)
+        elapsed = time.monotonic() - start
+        os.close(r)
+        os.close(w)
+
+        transfers = list(device.transfers)
+        base = moveEdges(transfers, 0, 0x03)
+        elbow = moveEdges(transfers, 0x30, 0)
+        shoulder = moveEdges(transfers, 0xC0, 0)
+        together = any(p[0] & 0x30 and p[0] & 0xC0 for t, p in transfers)
+        lit = any(p[0] & 0xC0 and p[2] for t, p in transfers)
+        release = base[-1] - baseReleased if len(base) > 0 else float('nan')
+        elbowRelease = elbow[-1] - elbowReleased if len(elbow) > 0 else float('nan')
+        print ("%-13s transfers=%d (%.1f/s) base starts=%d elbow starts=%d "
+                "base stop after release=%.0fms elbow stop after release=%.0fms "
+                "shoulder+elbow together=%s light with shoulder=%s"
+                % (name, len(transfers), len(transfers) / elapsed, len(base) // 2,
+                len(elbow) // 2, release * 1000, elbowRelease * 1000, together, lit))
+        if name == 'hold-to-move':
+            if (len(base) != 2 or len(elbow) != 2 or len(shoulder) != 2 or not together
+                    or not lit):
+                failed.append(name)
+            elif max(release, elbowRelease) > robotd.key_repeat_delay:
+                failed.append(name + ' release')
+
+    # Exit with a key latched, the arm is stopped before the threads go
+    r, w = os.pipe()
+    thread = threading.Thread(target=hold, args=(r,))
+    thread.start()
+    os.write(w, b'D')
+    time.sleep(0.1)
+    os.write(w, b'x')
+    thread.join()
+    robot.stopLive()
+    os.close(r)
+    os.close(w)
+    last = tuple(device.transfers[-1][1])
+    print ("exit with shoulder latched last transfer=%s" % (last,))
+    if last[0] != 0:
+        failed.append('exit')
+    if len(failed) > 0:
+        print ("Failed: " + ', '.join(failed))
+        sys.exit(1)
+
+# Seconds a joint was moving in a list of transfers, up to end
+def onTime(transfers,armBits,baseBits,end):
+    total = 0.0
+    for (t, payload), (next, p) in zip(transfers, transfers[1:] + [(end, None)]):
+        if payload[0] & armBits or payload[1] & baseBits:
+            total += next - t
+    return total
+
+# The daemon job queue: commands files queued together run in priority
+# order, live input takes over a running file within a control loop tick
+# and the file resumes or is aborted, a single command waits for the
+# running file and a running file is cancelled
+def benchJobs(move=1.0,live=0.3,resume=0.2):
+    import robotd
+    from worker_class import RESUME, ABORT
+    robot, device = simRobot()
+    table = robotd.table
+    worker = robot.worker
+    worker.resumeDelay = resume
+    compile = lambda lines: robot.compiler.compileLines('bench', lines)
+    failed = []
+
+    # Priorities, queued behind a file that is already running
+    first = worker.submit(compile(["wait 0.2\n"]))
+    while worker.running is None:
+        time.sleep(0.001)
+    jobs = [(priority, worker.submit(compile(["wait 0.02\n"]), priority=priority))
+            for priority in (0, 5, 1, 5)]
+    first.wait()
+    order = []
+    while len(order) < len(jobs):
+        for priority, job in jobs:
+            if job.done.is_set() and (priority, job) not in order:
+                order.append((priority, job))
+        time.sleep(0.001)
+    priorities = [priority for priority, job in order]
+    print ("priority order %s, %s" % (priorities, worker.waitTime.summary()))
+    if priorities != sorted(priorities, reverse=True) or order[0][1] is not jobs[1][1]:
+        failed.append('priority')
+
+    # Live input takes over and the file carries on
+    for policy in (RESUME, ABORT):
+        program = compile(["base-clockwise %g\n" % move])
+        device.clear()
+        start = time.monotonic()
+        job = worker.submit(program, policy=policy)
+        time.sleep(move / 3)
+        pressed = time.monotonic()
+        robot.control.set('joystick', table.byName['shoulder-up'], pressed)
+        time.sleep(live)
+        robot.control.set('joystick', table.byName['stop'], released=True)
+        result = job.wait()
+        end = time.monotonic()
+        transfers = list(device.transfers)
+        takeover = [t for t, payload in transfers if payload[0] & 0xC0]
+        latency = takeover[0] - pressed if len(takeover) > 0 else float('nan')
+        # Nothing from the file while the joystick has the arm
+        during = [p for t, p in transfers if takeover and takeover[0] < t < pressed + live
+                and p[1] & 0x03]
+        base = onTime(transfers, 0, 0x03, end)
+        print ("%-6s result=%s takeover=%.1fms base on=%.3fs (file %.1fs) length=%.3fs "
+                "file sends during live=%d" % (policy, result, latency*1000, base, move,
+                end - start, len(during)))
+        if latency > 2.0 / robotd.control_rate or len(during) > 0:
+            failed.append(policy)
+        if policy == RESUME and (not result or abs(base - move) > 0.05):
+            failed.append(policy)
+        if policy == ABORT and (result or base > move / 3 + 0.05):
+            failed.append(policy)
+        time.sleep(0.05)
+
+    # A file is planned from where the file before it left the arm
+    angles = []
+    before = dict(worker.pose.pose())['base']
+    first = worker.submit(compile(["base-clockwise 0.2\n"]))
+    second = worker.submit(compile(["wait 0.01\n"]),
+            plan=lambda program, pose: angles.append(dict(pose.pose())['base']) or program)
+    second.wait()
+    print ("planned from base %.1f (was %.1f before the file ahead)"
+            % (angles[0] if angles else float('nan'), before))
+    if len(angles) == 0 or abs(angles[0] - before) < 1.0:
+        failed.append('plan')
+
+    # A single command waits for the running file and live input takes
+    # over from it as it does from a file
+    device.clear()
+    job = worker.submit(compile(["base-clockwise 0.2\n"]))
+    time.sleep(0.05)
+    start = time.monotonic()
+    errors = []
+    thread = threading.Thread(target=lambda: errors.append(robot.executeJob(0.3, 'elbow-up')))
+    thread.start()
+    time.sleep(0.25)
+    pressed = time.monotonic()
+    robot.control.set('joystick', table.byName['shoulder-up'], pressed)
+    time.sleep(0.05)
+    released = time.monotonic()
+    robot.control.set('joystick', table.byName['stop'], released, True)
+    thread.join()
+    end = time.monotonic()
+    transfers = list(device.transfers)
+    elbow = [t for t, p in transfers if p[0] & 0x30]
+    overlap = len(elbow) > 0 and any(p[1] & 0x03 for t, p in transfers if t > elbow[0])
+    # Nothing from the command while the joystick has the arm
+    during = [p for t, p in transfers if pressed < t < released and p[0] & 0x30]
+    elbowOn = onTime(transfers, 0x30, 0, end)
+    print ("exec after file=%s elbow on=%.3fs (0.3s) base during exec=%s "
+            "exec sends during live=%d error=%s"
+            % (len(elbow) > 0 and elbow[0] - start > 0.1, elbowOn, overlap, len(during),
+            errors[0] if errors else None))
+    if (len(elbow) == 0 or elbow[0] - start < 0.1 or overlap or len(during) > 0
+            or abs(elbowOn - 0.3) > 0.02 or errors != [None]):
+        failed.append('exec')
+    time.sleep(0.05)
+
+    # Cancel a running file
+    device.clear()
+    job = worker.submit(compile(["base-clockwise %g\n" % move]))
+    time.sleep(0.1)
+    cancelled = time.monotonic()
+    worker.cancel()
+    result = job.wait()
+    stopped = [t for t, payload in device.transfers if t > cancelled and payload[1] == 0]
+    stop = stopped[0] - cancelled if len(stopped) > 0 else float('nan')
+    print ("cancel result=%s stopped after %.1fms" % (result, stop*1000))
+    if result or not stop < 0.01:
+        failed.append('cancel')
+    print (worker.summary())
+    robot.control.stop()
+    if len(failed) > 0:
+        print ("Failed: " + ', '.join(failed))
+        sys.exit(1)
+
+# Reads a status file over and over in another process while this one
+# rewrites it thousands of times a second. Every field of a record is written with the same count so
+# a torn read shows up as fields that differ
+STATUS_READER = """
+import sys, time
+import status_class
+path, count = sys.argv[1], int(sys.argv[2])
+torn = failed = 0
+start = time.perf_counter()
+for i in range(count):
+    status = status_class.readStatus(path)
+    if status is None:
+        failed += 1
+    elif len(set(int(v) % 200 for v in status.values())) != 1:
+        torn += 1
+print(torn, failed, (time.perf_counter() - start) / count)
+"""
+
+# The status file: torn reads while it is rewritten as fast as possible,
+# the time to read it against a STATUS request to the daemon, and the
+# time the daemon takes to publish it
+def benchStatus(reads=20000,requests=500):
+    import status_class
+    from status_class import StatusWriter, readStatus
+    from ipc_class import RobotServer
+    from client_class import RobotClient
+    robot, device = simRobot()
+    tmpdir = os.path.dirname(status_class.StatusFile)
+    failed = []
+
+    # Torn reads
+    writer = StatusWriter(tmpdir + "/torn")
+    writer.open()
+    writer.publish([1] * len(status_class.FIELDS))
+    reader = subprocess.Popen([sys.executable, '-c', STATUS_READER, writer.path, str(reads)],
+            stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+    count = 0
+    while reader.poll() is None:
+        count += 1
+        writer.publish([count % 200] * len(status_class.FIELDS))
+        time.sleep(0.0001)
+    torn, unread, readTime = reader.stdout.read().decode().split()
+    print ("seqlock   %d reads during %d updates, torn=%s unread=%s read=%.1fus"
+            % (reads, writer.updates, torn, unread, float(readTime)*1000000))
+    if int(torn) > 0 or int(unread) > 0:
+        failed.append('seqlock')
+
+    # Reading the status file against asking the daemon
+    robot.startStatus()
+    time.sleep(0.3)
+    hist = Histogram('status-file')
+    for i in range(requests):
+        t0 = time.perf_counter()
+        status = readStatus()
+        hist.add(time.perf_counter() - t0)
+    print ("read      " + hist.summary())
+    server = RobotServer(robot, tmpdir + "/robotd.sock")
+    with open(os.devnull,'w') as null, contextlib.redirect_stdout(null):
+        server.start()
+    client = RobotClient(server.path)
+    client.connect()
+    hist = Histogram('STATUS-request')
+    for i in range(requests):
+        t0 = time.perf_counter()
+        client.request("STATUS")
+        hist.add(time.perf_counter() - t0)
+    print ("ipc       " + hist.summary())
+    client.close()
+    server.stop()
+    if status is None or status['pid'] != os.getpid() or status['arms'] != len(robot.workers):
+        failed.append('status')
+
+    # Publishing, with the control loop running
+    hist = Histogram('publish')
+    for i in range(requests):
+        t0 = time.perf_counter()
+        writer.publish(robot.statusRecord())
+        hist.add(time.perf_counter() - t0)
+    print ("publish   " + hist.summary())
+    print (status_class.formatStatus(readStatus()))
+    robot.statusWriter.stop()
+    robot.control.stop()
+    if len(failed) > 0:
+        print ("Failed: " + ', '.join(failed))
+        sys.exit(1)
+
+benchmarks = {
+    'axes' : benchAxes,
+    'arms' : benchArms,
+    'calibration' : benchCalibration,
+    'hotplug' : benchHotplug,
+    'ik' : benchIK,
+    'input' : benchInput,
+    'jobs' : benchJobs,
+    'keyboard' : benchKeyboard,
+    'log' : benchLog,
+    'pipeline' : benchPipeline,
+    'pose' : benchPose,
+    'pwm' : benchPWM,
+    'replay' : benchReplay,
+    'script' : benchScript,
+    'startup' : benchStartup,
+    'status' : benchStatus,
+    'timing' : benchTiming,
+    'transfer' : benchTransfer,
+    }
+
+### Main routine ###
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print ("Usage: %s %s" % (sys.argv[0], '|'.join(benchmarks)))
+        sys.exit(2)
+    benchmarks[sys.argv[1]]()
+
+# End of benchmarks
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
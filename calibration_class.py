@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Joint speed calibration class
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# Holds the speed of each joint move in degrees per second. The speeds
+# start as the estimates in robotd.py and are replaced by those measured
+# with "robotd.py calibrate", which are kept in the calibration file:
+#
+#   shoulder-up 12.40
+#   shoulder-down 15.10
+#
+# They are used to estimate the joint angles (See pose_class.py) and to
+# turn angles in commands files such as "shoulder-up 15deg" into times.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import os
+import zlib
+
+from log_class import Log
+
+log = Log()
+
+class Calibration:
+
+    CalibrationFile = Log.RobotLibDir + "/calibration"
+
+    # moves maps each joint to ((command, speed), (command, speed))
+    def __init__(self,moves,path=None):
+        if path is not None:
+            self.CalibrationFile = path
+        self.joints = {}        # Joint to (command, command)
+        self.speeds = {}        # Command to degrees per second
+        for joint, ((up, upSpeed), (down, downSpeed)) in moves.items():
+            self.joints[joint] = (up, down)
+            self.speeds[up] = upSpeed
+            self.speeds[down] = downSpeed
+        self.calibrated = set()     # Commands with measured speeds
+        self.update()
+
+    # Changes when any speed is changed (See script_class.py)
+    def update(self):
+        self.signature = zlib.crc32(repr(sorted(self.speeds.items())).encode('utf-8'))
+
+    # Read the measured speeds, returns False if there is no calibration file
+    def load(self):
+        try:
+            with open(self.CalibrationFile) as f:
+                lines = f.readlines()
+        except IOError:
+            return False
+        for line in lines:
+            words = line.split()
+            if len(words) != 2 or words[0] not in self.speeds:
+                continue
+            try:
+                speed = float(words[1])
+            except ValueError:
+                continue
+            if speed > 0:
+                self.speeds[words[0]] = speed
+                self.calibrated.add(words[0])
+        self.update()
+        return True
+
+    # Write the speeds to the calibration file
+    def save(self):
+        os.makedirs(os.path.dirname(self.CalibrationFile), exist_ok=True)
+        tmpfile = self.CalibrationFile + ".tmp"
+        with open(tmpfile, 'w') as f:
+            for joint, (up, down) in self.joints.items():
+                for cmd in (up, down):
+                    f.write("%s %.2f\n" % (cmd, self.speeds[cmd]))
+        os.replace(tmpfile, self.CalibrationFile)
+
+    # Record a sweep of a joint through a number of degrees
+    def measure(self,cmd,degrees,seconds):
+        self.speeds[cmd] = degrees / seconds
+        self.calibrated.add(cmd)
+        self.update()
+        log.message("Calibrated " + cmd + " %.2f degrees/s" % self.speeds[cmd], log.INFO)
+
+    # Seconds to move a joint through a number of degrees,
+    # None if the command does not move a joint
+    def duration(self,cmd,degrees):
+        speed = self.speeds.get(cmd)
+        if speed is None:
+            return None
+        return degrees / speed
+
+    # The speeds in the form used by PoseEstimator
+    def moves(self):
+        return dict((joint, ((up, self.speeds[up]), (down, self.speeds[down])))
+                for joint, (up, down) in self.joints.items())
+
+# End of Calibration class
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
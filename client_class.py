@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Control socket client
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# Command line programs use this class to send requests to the robot
+# daemon (See ipc_class.py). It is kept apart from the server so that
+# commands such as status start quickly.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import socket
+
+SocketPath = "/var/run/robotd.sock"
+
+# Command line side of the socket
+class RobotClient:
+
+    def __init__(self,path=SocketPath):
+        self.path = path
+        self.sock = None
+        self.rfile = None
+
+    # Connect to the daemon, returns False if it is not listening
+    def connect(self):
+        try:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(self.path)
+        except OSError:
+            self.close()
+            return False
+        self.rfile = self.sock.makefile('rb')
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.rfile = None
+
+    # Send a request and return the reply line
+    def request(self,line):
+        self.sock.sendall((line + "\n").encode('utf-8'))
+        reply = self.rfile.readline()
+        if len(reply) == 0:
+            raise IOError("robotd closed the connection")
+        return reply.decode('utf-8').rstrip('\n')
+
+    # Same as Robot.execute but run by the daemon
+    def execute(self,t,cmd):
+        reply = self.request("EXEC " + cmd + " " + str(t))
+        if not reply.startswith("OK"):
+            print (reply)
+            return False
+        return True
+
+    # Same as Robot.hold but run by the daemon
+    def hold(self,cmds):
+        reply = self.request(' '.join(["HOLD"] + cmds))
+        if not reply.startswith("OK"):
+            print (reply)
+            return False
+        return True
+
+    # Same as Robot.setLight but run by the daemon
+    def setLight(self,on):
+        reply = self.request("LIGHT " + ("ON" if on else "OFF"))
+        if not reply.startswith("OK"):
+            print (reply)
+            return False
+        return True
+
+# End of RobotClient class
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
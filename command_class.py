@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Command table class
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# The command, button, switch and key maps are compiled once at startup
+# into a single dispatch table. Every 3 byte payload the arm can be sent
+# is created in advance so that no objects are created per event.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import zlib
+
+# Bits used by each joint as (name, arm bits, base bits)
+JOINTS = (
+    ('shoulder', 0xC0, 0),
+    ('elbow', 0x30, 0),
+    ('wrist', 0x0C, 0),
+    ('grip', 0x03, 0),
+    ('base', 0, 0x03),
+    )
+
+class CommandTable:
+
+    # Input sources
+    BUTTON = 'button'
+    SWITCH = 'switch'
+    KEY = 'key'
+
+    # Byte 0 is the arm bitmask, byte 1 the base (0-3) and byte 2 the light
+    ARM_VALUES = 256
+    BASE_VALUES = 4
+
+    def __init__(self,commands,buttonMap={},switchMap={},keyMap={}):
+        # All payloads indexed by (light, base, arm)
+        self.payloads = []
+        for light in (0,1):
+            for base in range(self.BASE_VALUES):
+                for arm in range(self.ARM_VALUES):
+                    self.payloads.append(bytes((arm,base,light)))
+
+        # Command name to payload and payload to command name
+        self.byName = {}
+        self.names = {}
+        for name, value in commands.items():
+            arm, base, light = value
+            payload = self.payload(arm, base, light)
+            self.byName[name] = payload
+            if light == 0:
+                self.names[self.withLight(payload, 1)] = name
+            self.names[payload] = name
+        # Changes if any command is changed (See script_class.py)
+        self.signature = zlib.crc32(repr(sorted(self.byName.items())).encode('utf-8'))
+
+        # stop and light-off are the same payload, always log it as stop
+        if 'stop' in self.byName:
+            self.names[self.byName['stop']] = 'stop'
+
+        # Input source and ID to (command name, payload)
+        self.inputs = {}
+        for source, inputMap in ((self.BUTTON, buttonMap),
+                (self.SWITCH, switchMap), (self.KEY, keyMap)):
+            for ident, name in inputMap.items():
+                self.inputs[(source, ident)] = (name, self.byName[name])
+
+    # Payload for an arm bitmask, base direction and light
+    def payload(self,arm,base,light):
+        return self.payloads[(light << 10) | (base << 8) | arm]
+
+    # Index of a payload in the table
+    def index(self,payload):
+        return (payload[2] << 10) | (payload[1] << 8) | payload[0]
+
+    # The same payload with the light bit set or cleared
+    def withLight(self,payload,light):
+        return self.payloads[(light << 10) | (payload[1] << 8) | payload[0]]
+
+    # Command name for a payload or None for a combination (joystick)
+    def name(self,payload):
+        return self.names.get(payload)
+
+    # Merge the payloads wanted by several inputs into one. A joint asked
+    # to move both ways at once is stopped
+    def merge(self,payloads):
+        arm = 0
+        base = 0
+        for payload in payloads:
+            arm |= payload[0]
+            base |= payload[1]
+        for name, armBits, baseBits in JOINTS:
+            if (arm & armBits) == armBits and armBits:
+                arm &= ~armBits
+            if (base & baseBits) == baseBits and baseBits:
+                base &= ~baseBits
+        return self.payload(arm, base, 0)
+
+    # Look up an input, returns (command name, payload) or None
+    def lookup(self,source,ident):
+        return self.inputs.get((source, ident))
+
+# End of CommandTable class
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Fixed rate control loop class
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# The joystick, buttons, switches and keyboard each set the command they
+# want in their own slot. Once per tick the slots are merged into one
+# bitmask which is only sent to the arm if it has changed, so a noisy
+# joystick cannot flood the USB control endpoint and two sources cannot
+# interleave conflicting commands.
+#
+# A source can also ask for moves at part speed. Each tick is a time
+# slice and a move with a duty cycle of 0.3 is on in 3 slices out of 10,
+# spread as evenly as possible by carrying the remainder from one slice
+# to the next.
+#
+# The loop only ticks while there is something to do: input not yet
+# sent, part speed moves or a move that may run into a soft limit. Once
+# the arm is stopped and nothing is pending it waits for the next set()
+# or setDuty() and then ticks at the fixed rate again.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import time
+import threading
+
+from stats_class import Histogram
+from log_class import Log
+
+log = Log()
+
+class ControlLoop:
+
+    def __init__(self,table,send,rate=100,limit=None):
+        self.table = table
+        self.send = send                # Function to send a payload to the arm
+        self.limit = limit              # Function to mask joints at their limits
+        self.period = 1.0 / rate
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)  # Notified on new input
+        self.sources = {}               # Source name to payload
+        self.duties = {}                # Source name to [(payload, duty)]
+        self.phase = {}                 # Part speed payload to its carried on time
+        self.last = None                # Last payload sent
+        self.force = False              # Send on the next tick even if unchanged
+        self.pendingEvent = None        # Earliest input not yet sent
+        self.pendingRelease = None      # Earliest release not yet sent
+        self.running = False
+        self.thread = None
+        self.recorder = None            # Records source changes (See record_class.py)
+
+        # Statistics
+        self.ticks = 0
+        self.updates = 0
+        self.transfers = 0
+        self.overruns = 0
+        self.idles = 0                  # Times the loop waited for input
+        self.jitter = Histogram('control-loop-jitter')
+        self.latency = Histogram('event-to-transfer')
+        self.stopLatency = Histogram('release-to-stop')
+
+    # Set the payload wanted by a source. eventTime is when the input
+    # happened and released is True if the input was let go
+    def set(self,source,payload,eventTime=None,released=False):
+        if eventTime is None:
+            eventTime = time.monotonic()
+        if self.recorder is not None:
+            self.recorder.record(source, payload, eventTime)
+        self.update(source, payload, None, eventTime, released)
+
+    # Set the moves wanted by a source at part speed as a list of
+    # (payload, duty) where duty is from 0 (off) to 1 (full speed).
+    # Recordings hold the moves at full speed
+    def setDuty(self,source,moves,eventTime=None,released=False):
+        if eventTime is None:
+            eventTime = time.monotonic()
+        full = [self.table.byName['stop']]
+        pulsed = []
+        for payload, duty in moves:
+            if duty >= 1.0:
+                full.append(payload)
+            elif duty > 0.0:
+                pulsed.append((payload, duty))
+        if self.recorder is not None:
+            self.recorder.record(source, self.table.merge(full
+                    + [payload for payload, duty in pulsed]), eventTime)
+        self.update(source, self.table.merge(full), pulsed or None, eventTime, released)
+
+    def update(self,source,payload,pulsed,eventTime,released):
+        with self.lock:
+            self.sources[source] = payload
+            if pulsed is not None:
+                self.duties[source] = pulsed
+            else:
+                self.duties.pop(source, None)
+            self.updates += 1
+            if self.pendingEvent is None:
+                self.pendingEvent = eventTime
+            if released and self.pendingRelease is None:
+                self.pendingRelease = eventTime
+            self.wake.notify()
+
+    # Send the merged command on the next tick even if it has not changed,
+    # used when the light is switched on or off
+    def touch(self,eventTime=None):
+        with self.lock:
+            self.force = True
+            if self.pendingEvent is None:
+                self.pendingEvent = eventTime or time.monotonic()
+            self.wake.notify()
+
+    # Merge the wanted payloads of all sources, with the part speed moves
+    # that are on in this slice. A new move is on in its first slice
+    def merged(self):
+        if len(self.duties) == 0:
+            return self.table.merge(self.sources.values())
+        payloads = list(self.sources.values())
+        phase = {}
+        for moves in self.duties.values():
+            for payload, duty in moves:
+                on = self.phase.get(payload, 1.0 - duty) + duty
+                if on >= 1.0:
+                    on -= 1.0
+                    payloads.append(payload)
+                phase[payload] = on
+        self.phase = phase
+        return self.table.merge(payloads)
+
+    # One pass of the control loop
+    def tick(self):
+        with self.lock:
+            payload = self.merged()
+            if self.limit is not None:
+                payload = self.limit(payload)
+            changed = payload is not self.last or self.force
+            self.force = False
+            eventTime = self.pendingEvent
+            releaseTime = self.pendingRelease
+            self.pendingEvent = None
+            self.pendingRelease = None
+        self.ticks += 1
+        if not changed:
+            return False
+        if self.send(payload):
+            now = time.monotonic()
+            self.last = payload
+            self.transfers += 1
+            if eventTime is not None:
+                self.latency.add(now - eventTime)
+            if releaseTime is not None:
+                self.stopLatency.add(now - releaseTime)
+        return True
+
+    # True if there is nothing for the next tick to do. The last payload
+    # sent must not move the arm as a moving joint is stopped at its soft
+    # limit by a later tick. Called with the lock held
+    def idle(self):
+        last = self.last
+        return (self.running and not self.force and self.pendingEvent is None
+            and len(self.duties) == 0 and last is not None
+            and last[0] == 0 and last[1] == 0)
+
+    # Wait until there is something to do, returns True if it waited
+    def waitForInput(self):
+        with self.lock:
+            if not self.idle():
+                return False
+            self.idles += 1
+            while self.idle():
+                self.wake.wait()
+        return True
+
+    # Run ticks at the loop rate against monotonic deadlines. Ticks that
+    # are missed because a tick overran are skipped, not run late.
+    # Between inputs the loop waits and starts again from the next input
+    def run(self):
+        period = self.period
+        deadline = time.monotonic()
+        while self.running:
+            if not self.tick() and self.waitForInput():
+                deadline = time.monotonic()
+                continue
+            deadline += period
+            now = time.monotonic()
+            if now > deadline:
+                missed = int((now - deadline) / period) + 1
+                self.overruns += missed
+                deadline += missed * period
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            self.jitter.add(abs(time.monotonic() - deadline))
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name='control')
+            self.thread.daemon = True
+            self.thread.start()
+            log.message("Control loop running at " + str(self.rate) + " Hz", log.INFO)
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.wake.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # Source updates that did not need a transfer of their own
+    def saved(self):
+        return max(self.updates - self.transfers, 0)
+
+    # One line summary
+    def summary(self):
+        return ("rate=%dHz ticks=%d updates=%d transfers=%d saved=%d overruns=%d idles=%d"
+            % (self.rate, self.ticks, self.updates, self.transfers, self.saved(),
+            self.overruns, self.idles))
+
+# End of ControlLoop class
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Hotplug device discovery classes
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# The kernel sends a netlink uevent when a device is plugged in or out.
+# A watcher thread waits for these and calls the attach or detach
+# function of the device (the arm or joystick) that matches, so a
+# replugged device is used again straight away and a device that is
+# unplugged is noticed. If netlink cannot be used /sys is scanned for
+# changes instead. See sim_class.py for a fake event source.
+#
+# Uevents that come faster than they are read are lost and the socket
+# reports ENOBUFS. The watcher then scans /sys and reports every device
+# there as added, so that a device plugged in meanwhile is still found.
+#
+# Event sources have the same methods:
+#   fileno()      - File descriptor to wait on (None if there is not one)
+#   wait(timeout) - Wait up to timeout seconds, returns a list of Uevents.
+#                   Raises OSError if events have been lost
+#   close()       - Stop listening
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import os
+import glob
+import errno
+import time
+import select
+import socket
+import threading
+
+from log_class import Log
+
+log = Log()
+
+NETLINK_KOBJECT_UEVENT = 15
+KERNEL_GROUP = 1
+
+# A device added or removed. props holds the uevent properties
+# such as SUBSYSTEM, DEVTYPE, DEVNAME and PRODUCT
+class Uevent:
+
+    def __init__(self,action,devpath,props,time=None):
+        self.action = action
+        self.devpath = devpath
+        self.props = props
+        self.time = time
+
+    def get(self,key,default=''):
+        return self.props.get(key, default)
+
+# Parse the KEY=VALUE lines of a uevent
+def parseProps(lines):
+    props = {}
+    for line in lines:
+        key, sep, value = line.partition('=')
+        if sep:
+            props[key] = value
+    return props
+
+# Kernel uevents read from a netlink socket
+class NetlinkSource:
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                NETLINK_KOBJECT_UEVENT)
+        self.sock.bind((0, KERNEL_GROUP))
+        self.sock.setblocking(False)
+
+    def name(self):
+        return "netlink"
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    # Messages are "action@devpath" then NUL separated KEY=VALUE fields
+    def read(self):
+        events = []
+        while True:
+            try:
+                data = self.sock.recv(16384)
+            except BlockingIOError:
+                return events
+            now = time.monotonic()
+            fields = data.decode('utf-8', 'replace').split('\0')
+            action, sep, devpath = fields[0].partition('@')
+            if not sep:
+                continue
+            props = parseProps(fields[1:])
+            events.append(Uevent(props.get('ACTION', action), devpath, props, now))
+
+    def wait(self,timeout=None):
+        readable, w, x = select.select([self.sock], [], [], timeout)
+        if len(readable) == 0:
+            return []
+        return self.read()
+
+    def close(self):
+        self.sock.close()
+
+# Scans /sys for USB and joystick devices every interval seconds and
+# reports the ones that have appeared or gone since the last scan
+class PollingSource:
+
+    SCAN = (('usb', '/sys/bus/usb/devices/*'), ('input', '/sys/class/input/js*'))
+
+    def __init__(self,interval=1.0,root=''):
+        self.interval = interval
+        self.root = root
+        self.devices = self.scan()
+        self.nextScan = time.monotonic() + interval
+
+    def name(self):
+        return "polling every " + str(self.interval) + "s"
+
+    def fileno(self):
+        return None
+
+    # Current devices as devpath to properties
+    def scan(self):
+        devices = {}
+        for subsystem, pattern in self.SCAN:
+            for path in glob.glob(self.root + pattern):
+                try:
+                    with open(path + '/uevent') as f:
+                        props = parseProps(f.read().splitlines())
+                except (IOError, OSError):
+                    continue
+                props['SUBSYSTEM'] = subsystem
+                devices[os.path.realpath(path)] = props
+        return devices
+
+    def wait(self,timeout=None):
+        delay = self.nextScan - time.monotonic()
+        if timeout is not None and timeout < delay:
+            time.sleep(max(timeout, 0))
+            return []
+        if delay > 0:
+            time.sleep(delay)
+        self.nextScan = time.monotonic() + self.interval
+
+        devices = self.scan()
+        now = time.monotonic()
+        events = []
+        for devpath, props in devices.items():
+            if devpath not in self.devices:
+                events.append(Uevent('add', devpath, props, now))
+        for devpath, props in self.devices.items():
+            if devpath not in devices:
+                events.append(Uevent('remove', devpath, props, now))
+        self.devices = devices
+        return events
+
+    def close(self):
+        pass
+
+# Netlink if it can be used, otherwise polling
+def openSource(interval=1.0):
+    try:
+        return NetlinkSource()
+    except (OSError, AttributeError) as e:
+        log.message("Cannot listen for uevents (" + str(e) + "), polling for devices",
+                log.WARNING)
+        return PollingSource(interval)
+
+# Matches the arm (or any USB device) by vendor and product ID
+def usbMatch(vendor_id,product_id):
+    product = "%x/%x/" % (vendor_id, product_id)
+    def match(event):
+        return event.get('SUBSYSTEM') == 'usb' and event.get('DEVTYPE') == 'usb_device' \
+                and event.get('PRODUCT').startswith(product)
+    return match
+
+# Matches joystick devices (/dev/input/js*)
+def joystickMatch(event):
+    return event.get('SUBSYSTEM') == 'input' and event.get('DEVNAME').startswith('input/js')
+
+class HotplugWatcher:
+
+    # root is put in front of the /sys paths scanned after lost events
+    def __init__(self,source,root=''):
+        self.source = source
+        self.root = root
+        self.devices = []           # (name, match, attach, detach)
+        self.attaches = {}          # Name to number of attach events
+        self.detaches = {}          # Name to number of detach events
+        self.latency = 0.0          # Uevent to handler time of the last event
+        self.rescans = 0            # Scans of /sys after lost events
+        self.running = False
+        self.thread = None
+
+    # Call attach(event) or detach(event) when a device matching
+    # match(event) is plugged in or out, either may be None
+    def watch(self,name,match,attach,detach):
+        self.devices.append((name, match, attach, detach))
+        self.attaches[name] = 0
+        self.detaches[name] = 0
+
+    # Pass an event to the devices that match it
+    def dispatch(self,event):
+        for name, match, attach, detach in self.devices:
+            if not match(event):
+                continue
+            if event.action == 'add':
+                self.attaches[name] += 1
+                handler = attach
+            elif event.action == 'remove':
+                self.detaches[name] += 1
+                handler = detach
+            else:
+                continue
+            if event.time is not None:
+                self.latency = time.monotonic() - event.time
+            log.message("Hotplug " + event.action + " " + name + " " + event.devpath, log.INFO)
+            if handler is None:
+                continue
+            try:
+                handler(event)
+            except Exception as e:
+                log.message("Hotplug " + name + " handler error: " + str(e), log.ERROR)
+
+    # Every device in /sys as an add event
+    def rescan(self):
+        self.rescans += 1
+        now = time.monotonic()
+        return [Uevent('add', devpath, props, now)
+                for devpath, props in PollingSource(root=self.root).devices.items()]
+
+    def run(self):
+        while self.running:
+            try:
+                events = self.source.wait(1.0)
+            except OSError as e:
+                log.message("Hotplug events lost (" + str(e) + "), scanning for devices",
+                        log.ERROR)
+                events = self.rescan()
+                if e.errno != errno.ENOBUFS:
+                    # Do not spin on an error that does not go away
+                    time.sleep(1.0)
+            for event in events:
+                self.dispatch(event)
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name='hotplug')
+            self.thread.daemon = True
+            self.thread.start()
+            log.message("Hotplug watcher using " + self.source.name(), log.INFO)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # One line summary of the attach and detach counts
+    def summary(self):
+        return ' '.join(["%s attached=%d detached=%d" % (name, self.attaches[name],
+                self.detaches[name]) for name, m, a, d in self.devices]
+                + ["rescans=%d" % self.rescans])
+
+# End of hotplug classes
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
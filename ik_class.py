@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Inverse kinematics planner class
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# Plans "move-to x y z" in commands files. The position of the grip tip
+# is worked out once for every combination of shoulder, elbow and wrist
+# angle on a grid and the grid is cached on disk. The base is turned to
+# face the point so the grid only needs the reach and height of each
+# combination. A query looks at the grid points near the point and picks
+# the one that the joints, moving at once at their calibrated speeds,
+# get to in the least time.
+#
+# Points are in millimetres from the base, x along the arm with the base
+# at 0 degrees, y to its left and z up from the table.
+#
+# Needs NumPy: sudo apt install python3-numpy
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import os
+import math
+import time
+import zlib
+import zipfile
+
+import numpy as np
+
+from log_class import Log
+from script_class import Program, ScriptError, OP_MOVETO
+
+log = Log()
+
+class IKPlanner:
+
+    CacheDir = Log.RobotLibDir + "/cache"
+    JOINTS = ('shoulder', 'elbow', 'wrist')     # Joints on the grid
+
+    # lengths is (shoulder height, shoulder to elbow, elbow to wrist,
+    # wrist to grip tip). home maps each joint to its angle at start up
+    # and limits to its (minimum, maximum) from there (See robotd.py)
+    def __init__(self,lengths,home,limits,step=3.0,tolerance=10.0,cachedir=None):
+        if cachedir is not None:
+            self.CacheDir = cachedir
+        self.lengths = tuple(float(length) for length in lengths)
+        self.home = home
+        self.step = step
+        self.tolerance = tolerance
+        self.ranges = {}            # Joint to (minimum, maximum) angle
+        for joint in self.JOINTS + ('base',):
+            lower, upper = limits.get(joint, (None, None))
+            angle = home.get(joint, 0.0)
+            self.ranges[joint] = (angle + (-180.0 if lower is None else lower),
+                    angle + (180.0 if upper is None else upper))
+        self.signature = zlib.crc32(repr((self.lengths, sorted(self.ranges.items()),
+                step, tolerance)).encode('utf-8'))
+        self.grid = None
+        self.buildTime = None       # Seconds to build the grid if not cached
+        self.queries = 0
+
+    def cacheFile(self):
+        return self.CacheDir + "/ik-%08x.npz" % self.signature
+
+    # Load the grid from the cache or build and cache it
+    def open(self):
+        if self.grid is not None:
+            return
+        try:
+            with np.load(self.cacheFile()) as data:
+                self.grid = dict((name, data[name]) for name in data.files)
+            return
+        except (IOError, OSError, ValueError, KeyError, zipfile.BadZipFile):
+            pass
+        start = time.perf_counter()
+        self.grid = self.build()
+        self.buildTime = time.perf_counter() - start
+        log.message("IK grid of " + str(len(self.grid['r'])) + " points built in "
+                + "%.2f s" % self.buildTime, log.INFO)
+        tmpfile = self.cacheFile() + ".tmp.npz"
+        try:
+            os.makedirs(self.CacheDir, exist_ok=True)
+            np.savez(tmpfile, **self.grid)
+            os.replace(tmpfile, self.cacheFile())
+        except (IOError, OSError) as e:
+            log.message("Cannot cache IK grid: " + str(e), log.WARNING)
+
+    # Reach and height of the grip tip for every combination of angles on
+    # the grid. The shoulder angle is from horizontal and the elbow and
+    # wrist angles from straight in line with the joint before. The points
+    # are sorted into square cells the size of the tolerance so that a
+    # query only has to look at the cells around the point
+    def build(self):
+        height, upper, fore, grip = self.lengths
+        axes = [np.arange(lower, upper + self.step / 2, self.step)
+                for lower, upper in (self.ranges[joint] for joint in self.JOINTS)]
+        shoulder, elbow, wrist = (a.ravel() for a in np.meshgrid(*axes, indexing='ij'))
+        a1 = np.radians(shoulder)
+        a2 = a1 + np.radians(elbow)
+        a3 = a2 + np.radians(wrist)
+        r = upper * np.cos(a1) + fore * np.cos(a2) + grip * np.cos(a3)
+        z = height + upper * np.sin(a1) + fore * np.sin(a2) + grip * np.sin(a3)
+
+        cell = self.tolerance
+        origin = (r.min(), z.min())
+        columns = ((r - origin[0]) // cell).astype(np.int64)
+        rows = int((z.max() - origin[1]) // cell) + 1
+        keys = columns * rows + ((z - origin[1]) // cell).astype(np.int64)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        return {
+            'shoulder' : shoulder[order].astype(np.float32),
+            'elbow' : elbow[order].astype(np.float32),
+            'wrist' : wrist[order].astype(np.float32),
+            'r' : r[order].astype(np.float32),
+            'z' : z[order].astype(np.float32),
+            'starts' : np.searchsorted(keys, np.arange(keys[-1] + 2)).astype(np.int32),
+            'origin' : np.array((origin[0], origin[1], cell, rows)),
+            }
+
+    # Joint angles from start up (as PoseEstimator) that reach x, y, z in
+    # the least time from the current angles, or None if out of reach.
+    # angles maps each joint to its angle and speeds to (up, down) speeds
+    def solve(self,x,y,z,angles,speeds):
+        self.open()
+        self.queries += 1
+        grid = self.grid
+        rmin, zmin, cell, rows = grid['origin']
+        rows = int(rows)
+
+        # The base turns to face the point
+        lower, upper = self.ranges['base']
+        base = math.degrees(math.atan2(y, x))
+        for turn in (base, base - 360.0, base + 360.0):
+            if lower <= turn <= upper:
+                break
+        else:
+            return None
+        target = {'base' : turn - self.home.get('base', 0.0)}
+
+        # Grid points in the cells around the point
+        r = math.hypot(x, y)
+        column = int((r - rmin) // cell)
+        row = int((z - zmin) // cell)
+        first = max(row - 1, 0)
+        last = min(row + 1, rows - 1)
+        starts = grid['starts']
+        cells = len(starts) - 1
+        slices = []
+        for c in (column - 1, column, column + 1):
+            if c < 0 or first > last or c * rows + first >= cells:
+                continue
+            slices.append(np.arange(starts[c * rows + first],
+                    starts[min(c * rows + last + 1, cells)]))
+        if len(slices) == 0:
+            return None
+        index = np.concatenate(slices)
+        dr = grid['r'][index] - r
+        dz = grid['z'][index] - z
+        index = index[dr * dr + dz * dz <= self.tolerance * self.tolerance]
+        if len(index) == 0:
+            return None
+
+        # The move takes as long as its slowest joint, ties are broken
+        # by the least total movement
+        turn = target['base'] - angles['base']
+        up, down = speeds['base']
+        longest = np.full(len(index), turn / up if turn > 0 else -turn / down)
+        total = longest.copy()
+        for joint in self.JOINTS:
+            d = grid[joint][index] - (self.home.get(joint, 0.0) + angles[joint])
+            up, down = speeds[joint]
+            t = np.where(d > 0, d / up, -d / down)
+            longest = np.maximum(longest, t)
+            total += t
+        best = index[np.lexsort((total, longest))[0]]
+        for joint in self.JOINTS:
+            target[joint] = float(grid[joint][best]) - self.home.get(joint, 0.0)
+        return target
+
+    # The moves that take the arm from the angles of a pose estimator to
+    # x, y, z as a list of (command, time) for a parallel block, or None
+    # if the point is out of reach
+    def plan(self,x,y,z,pose):
+        angles = dict(zip(pose.names, pose.angle))
+        speeds = dict((name, (up, -down)) for name, (up, down) in zip(pose.names, pose.speeds))
+        target = self.solve(x, y, z, angles, speeds)
+        if target is None:
+            return None
+        moves = []
+        for joint, angle in target.items():
+            i = pose.names.index(joint)
+            d = angle - pose.angle[i]
+            up, down = pose.commands[i]
+            if d > 0:
+                moves.append((up, d / pose.speeds[i][0]))
+            elif d < 0:
+                moves.append((down, d / pose.speeds[i][1]))
+        return moves
+
+    # Replace the move-to instructions of a program with parallel moves.
+    # The pose estimator follows the program on its virtual clock so each
+    # move starts from where the one before left the arm
+    def expand(self,compiler,path,program,pose):
+        if OP_MOVETO not in program.ops:
+            return program
+        planned = Program()
+        errors = []
+        pose.startClock()
+        for i in range(len(program)):
+            op = program.ops[i]
+            line = program.lines[i]
+            if op != OP_MOVETO:
+                planned.append(op, program.payloads[i], program.durations[i], line)
+                pose.step(op, program.payloads[i], program.durations[i])
+                continue
+            x, y, z = program.target(i)
+            moves = self.plan(x, y, z, pose)
+            if moves is None:
+                errors.append((line, "Cannot reach %g %g %g" % (x, y, z)))
+                continue
+            block = Program()
+            if len(moves) > 0:
+                compiler.lowerParallel(block, (line, 'parallel', moves))
+            for op, payload, duration in zip(block.ops, block.payloads, block.durations):
+                planned.append(op, payload, duration, line)
+                pose.step(op, payload, duration)
+        if len(errors) > 0:
+            raise ScriptError(path, errors)
+        return planned
+
+# End of IKPlanner class
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Joystick input classes
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# The joystick is read directly from the Linux joystick (/dev/input/js*)
+# or event (/dev/input/event*) device through a non-blocking file
+# descriptor, so pygame is not needed to read two axes and a few buttons.
+# Recorded joystick streams can be played back for testing and pygame
+# can still be used if wanted.
+#
+# All input classes return InputEvent objects and have the same methods:
+#   fileno()      - File descriptor to wait on (None if there is not one)
+#   read()        - Events available now without blocking
+#   wait(timeout) - Wait up to timeout seconds for events
+#   close()       - Close the device
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import os
+import time
+import fcntl
+import select
+import struct
+
+# Input event types
+QUIT = 1
+AXIS = 2
+BUTTONDOWN = 3
+BUTTONUP = 4
+
+# Linux joystick API event types
+JS_EVENT_BUTTON = 0x01
+JS_EVENT_AXIS = 0x02
+JS_EVENT_INIT = 0x80
+
+# An input event. value is the axis position from -1.0 to 1.0 and
+# time is the monotonic time the event happened or was read
+class InputEvent:
+
+    __slots__ = ('type', 'axis', 'value', 'button', 'time')
+
+    def __init__(self,type,axis=0,value=0.0,button=0,time=None):
+        self.type = type
+        self.axis = axis
+        self.value = value
+        self.button = button
+        self.time = time
+
+# Methods common to the device based inputs
+class DeviceInput:
+
+    fd = None
+    record = None
+
+    def fileno(self):
+        return self.fd
+
+    # Wait for the device to become readable then read it
+    def wait(self,timeout=None):
+        events = self.read()
+        if len(events) > 0:
+            return events
+        readable, w, x = select.select([self.fd], [], [], timeout)
+        if len(readable) == 0:
+            return events
+        return self.read()
+
+    # Read whole records from the device
+    def readRecords(self,size):
+        try:
+            data = os.read(self.fd, size * 64)
+        except BlockingIOError:
+            return b''
+        if len(data) == 0:
+            raise IOError("Joystick disconnected")
+        if self.record is not None:
+            self.record.write(data)
+        return data[:len(data) - len(data) % size]
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self.record is not None:
+            self.record.close()
+            self.record = None
+
+# Linux joystick API (joydev), records are struct js_event
+class JoydevInput(DeviceInput):
+
+    EVENT = struct.Struct('IhBB')       # time (ms), value, type, number
+
+    # If recordfile is given the raw events are also written to it
+    # so that they can be played back by ReplayInput
+    def __init__(self,path=None,recordfile=None):
+        if path is None:
+            path = findJoystick()
+        if path is None:
+            raise IOError("No joystick found")
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        if recordfile is not None:
+            self.record = open(recordfile, 'ab')
+
+    def name(self):
+        return "joydev " + self.path
+
+    # Convert the joystick records to input events
+    def read(self):
+        data = self.readRecords(self.EVENT.size)
+        now = time.monotonic()
+        return [event for event in (jsEvent(r, now)
+                for r in self.EVENT.iter_unpack(data)) if event is not None]
+
+
+# Linux event device (evdev). Axes and buttons are numbered in the same
+# order as SDL (and so pygame) numbers them
+class EvdevInput(DeviceInput):
+
+    EV_KEY = 0x01
+    EV_ABS = 0x03
+    BTN_MISC = 0x100
+    BTN_JOYSTICK = 0x120
+    KEY_MAX = 0x2ff
+    ABS_HAT0X = 0x10
+    ABS_HAT3Y = 0x17
+    ABS_MAX = 0x3f
+    CLOCK_MONOTONIC = 1
+
+    # struct input_event uses native longs for the timeval
+    EVENT = struct.Struct('llHHi')      # seconds, microseconds, type, code, value
+    ABSINFO = struct.Struct('6i')       # value, minimum, maximum, fuzz, flat, resolution
+
+    def __init__(self,path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+
+        # Ask for monotonic timestamps so they can be compared with time.monotonic()
+        try:
+            fcntl.ioctl(self.fd, self.ioc(1, 0xa0, 4), struct.pack('i', self.CLOCK_MONOTONIC))
+            self.monotonic = True
+        except OSError:
+            self.monotonic = False
+
+        # Button and axis numbers
+        keys = self.bits(self.EV_KEY, self.KEY_MAX)
+        order = list(range(self.BTN_JOYSTICK, self.KEY_MAX + 1)) + \
+                list(range(self.BTN_MISC, self.BTN_JOYSTICK))
+        self.buttons = {}
+        for code in order:
+            if code in keys:
+                self.buttons[code] = len(self.buttons)
+
+        self.axes = {}
+        for code in sorted(self.bits(self.EV_ABS, self.ABS_MAX)):
+            if self.ABS_HAT0X <= code <= self.ABS_HAT3Y:
+                continue
+            info = bytearray(self.ABSINFO.size)
+            fcntl.ioctl(self.fd, self.ioc(2, 0x40 + code, self.ABSINFO.size), info)
+            value, minimum, maximum, fuzz, flat, resolution = self.ABSINFO.unpack(info)
+            if maximum <= minimum:
+                continue
+            self.axes[code] = (len(self.axes), minimum, maximum)
+
+    def name(self):
+        return "evdev " + self.path
+
+    # ioctl request number (Linux _IOC)
+    def ioc(self,direction,nr,size):
+        return (direction << 30) | (size << 16) | (ord('E') << 8) | nr
+
+    # Set of codes supported for an event type (EVIOCGBIT)
+    def bits(self,evtype,maximum):
+        buf = bytearray(maximum // 8 + 1)
+        fcntl.ioctl(self.fd, self.ioc(2, 0x20 + evtype, len(buf)), buf)
+        return set(i for i in range(maximum + 1) if buf[i // 8] & (1 << (i % 8)))
+
+    # Convert the event device records to input events
+    def read(self):
+        data = self.readRecords(self.EVENT.size)
+        now = time.monotonic()
+        events = []
+        for sec, usec, evtype, code, value in self.EVENT.iter_unpack(data):
+            t = now
+            if self.monotonic:
+                t = sec + usec / 1000000.0
+            if evtype == self.EV_ABS and code in self.axes:
+                number, minimum, maximum = self.axes[code]
+                value = (2.0 * (value - minimum) / (maximum - minimum)) - 1.0
+                events.append(InputEvent(AXIS, axis=number, value=value, time=t))
+            elif evtype == self.EV_KEY and code in self.buttons and value != 2:
+                events.append(InputEvent(BUTTONDOWN if value else BUTTONUP,
+                        button=self.buttons[code], time=t))
+        return events
+
+# Plays back a joystick stream recorded by JoydevInput with its original
+# timing (speed 2.0 plays it twice as fast, 0 as fast as possible)
+class ReplayInput:
+
+    def __init__(self,path,speed=1.0):
+        self.path = path
+        self.speed = speed
+        with open(path, 'rb') as f:
+            data = f.read()
+        size = JoydevInput.EVENT.size
+        self.records = list(JoydevInput.EVENT.iter_unpack(data[:len(data) - len(data) % size]))
+        self.next = 0
+        self.start = None
+
+    def name(self):
+        return "replay " + self.path
+
+    def fileno(self):
+        return None
+
+    # Has the whole recording been played
+    def finished(self):
+        return self.next >= len(self.records)
+
+    # Monotonic time a record is due
+    def due(self,index):
+        if self.speed <= 0:
+            return self.start
+        return self.start + (self.records[index][0] - self.records[0][0]) / 1000.0 / self.speed
+
+    def read(self):
+        if self.start is None:
+            self.start = time.monotonic()
+        now = time.monotonic()
+        events = []
+        while self.next < len(self.records) and self.due(self.next) <= now:
+            event = jsEvent(self.records[self.next], self.due(self.next))
+            self.next += 1
+            if event is not None:
+                events.append(event)
+        return events
+
+    def wait(self,timeout=None):
+        events = self.read()
+        if len(events) > 0 or self.finished():
+            if len(events) == 0 and timeout:
+                time.sleep(timeout)
+            return events
+        delay = self.due(self.next) - time.monotonic()
+        if timeout is not None:
+            delay = min(delay, timeout)
+        if delay > 0:
+            time.sleep(delay)
+        return self.read()
+
+    def close(self):
+        pass
+
+# Joystick read through pygame
+class PygameInput:
+
+    def __init__(self):
+        os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+        import pygame
+        self.pygame = pygame
+        pygame.init()
+        # Look again for joysticks plugged in since the last time
+        pygame.joystick.quit()
+        pygame.joystick.init()
+        if pygame.joystick.get_count() == 0:
+            raise IOError("No joystick found")
+        self.joystick = pygame.joystick.Joystick(0)
+        self.joystick.init()
+        # Wake up once a second even when idle so that signals are handled
+        pygame.time.set_timer(pygame.USEREVENT, 1000)
+
+    def name(self):
+        return "pygame " + self.joystick.get_name()
+
+    def fileno(self):
+        return None
+
+    def convert(self,event,now):
+        pygame = self.pygame
+        if event.type == pygame.QUIT:
+            return InputEvent(QUIT, time=now)
+        elif event.type == pygame.JOYAXISMOTION:
+            return InputEvent(AXIS, axis=event.axis, value=event.value, time=now)
+        elif event.type == pygame.JOYBUTTONDOWN:
+            return InputEvent(BUTTONDOWN, button=event.button, time=now)
+        elif event.type == pygame.JOYBUTTONUP:
+            return InputEvent(BUTTONUP, button=event.button, time=now)
+        return None
+
+    def read(self):
+        now = time.monotonic()
+        return [e for e in (self.convert(event, now)
+                for event in self.pygame.event.get()) if e is not None]
+
+    # Block until the next event, the timeout is the one second timer
+    def wait(self,timeout=None):
+        event = self.pygame.event.wait()
+        events = [self.convert(event, time.monotonic())] + self.read()
+        return [e for e in events if e is not None]
+
+    def close(self):
+        self.pygame.joystick.quit()
+
+# Convert a js_event record (time, value, type, number) to an input event
+def jsEvent(record,now):
+    ms, value, evtype, number = record
+    init = evtype & JS_EVENT_INIT
+    evtype &= ~JS_EVENT_INIT
+    if evtype == JS_EVENT_AXIS:
+        return InputEvent(AXIS, axis=number, value=value / 32767.0, time=now)
+    elif evtype == JS_EVENT_BUTTON:
+        # Initial button states are only of interest if pressed
+        if value:
+            return InputEvent(BUTTONDOWN, button=number, time=now)
+        elif not init:
+            return InputEvent(BUTTONUP, button=number, time=now)
+    return None
+
+# First device in a directory with a name matching test(name) or None
+def findDevice(directory,test):
+    try:
+        names = sorted(name for name in os.listdir(directory) if test(name))
+    except OSError:
+        return None
+    if len(names) == 0:
+        return None
+    return directory + '/' + names[0]
+
+# First joystick device or None
+def findJoystick():
+    return findDevice('/dev/input', lambda name: name.startswith('js'))
+
+# Open a joystick using the named backend (joydev, evdev or pygame)
+def openInput(backend='joydev',path=None):
+    if backend == 'joydev':
+        return JoydevInput(path)
+    elif backend == 'evdev':
+        if path is None:
+            path = findDevice('/dev/input/by-id', lambda name: name.endswith('-event-joystick'))
+        if path is None:
+            raise IOError("No joystick found")
+        return EvdevInput(path)
+    elif backend == 'pygame':
+        return PygameInput()
+    raise ValueError("Unknown input backend " + backend)
+
+# End of input classes
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
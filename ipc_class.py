@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Local control socket for the robot daemon
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# The daemon listens on a Unix domain socket so that command line
+# programs can use the arm it already has open. Each request is one
+# line of text and the reply is one line starting with OK or ERR.
+#
+#   PING                    - Check the daemon is listening
+#   STATUS                  - Daemon status as key=value pairs
+#   EXEC <command> <time>   - Execute a single arm command
+#   HOLD [<command> ...]    - Move until the next HOLD, stopped if the
+#                             client goes away
+#   LIGHT ON|OFF            - Switch the light without stopping the moves
+#   RUN <file> [<arm>|all] [PRIORITY <n>]
+#                           - Execute a commands file on an arm or all arms
+#   CANCEL [<arm>|all]      - Cancel the commands files queued or running
+#   HOME [<arm>|all]        - The arms are back in their start up position
+#   RECORD <file>|OFF       - Start or stop recording the live inputs
+#   REPLAY <file>           - Replay a recording
+#
+# Requests from all clients are run one at a time in the order received,
+# apart from RUN which queues its commands file with the arm (See
+# worker_class.py) so that files run in priority order. EXEC and REPLAY
+# are run as programs queued with the first arm too, so that they wait for
+# the file running on it and live input takes over from them in the same
+# way.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import os
+import queue
+import threading
+import socketserver
+
+from log_class import Log
+from client_class import SocketPath
+
+log = Log()
+
+# Handles the requests from one client connection
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        holding = False
+        for line in self.rfile:
+            request = line.decode('utf-8', 'replace').split()
+            if len(request) == 0:
+                continue
+            reply = self.server.robotServer.dispatch(request)
+            if request[0].upper() == 'HOLD' and reply == "OK":
+                holding = len(request) > 1
+            self.wfile.write((reply + "\n").encode('utf-8'))
+        # Do not leave the arm moving if the client has gone
+        if holding:
+            self.server.robotServer.dispatch(['HOLD'])
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+# The daemon side of the socket
+class RobotServer:
+
+    def __init__(self,robot,path=SocketPath):
+        self.robot = robot
+        self.path = path
+        self.server = None
+        self.jobs = queue.Queue()
+        self.requests = 0
+
+    # Create the socket and start the listener and worker threads
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = UnixServer(self.path, RequestHandler)
+        self.server.robotServer = self
+        os.chmod(self.path, 0o660)
+        for target, name in ((self.server.serve_forever, 'ipc'), (self.worker, 'ipc-worker')):
+            t = threading.Thread(target=target, name=name)
+            t.daemon = True
+            t.start()
+        log.message("Listening on " + self.path, log.INFO)
+
+    # Close and remove the socket
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    # Run queued arm work one job at a time. The work returns None or an
+    # error message, an exception is turned into its message
+    def worker(self):
+        while True:
+            func, args, done, result = self.jobs.get()
+            try:
+                result.append(func(*args))
+            except Exception as e:
+                log.message("Request failed: " + str(e), log.ERROR)
+                result.append(str(e))
+            done.set()
+
+    # Queue work for the arm and wait for it to finish
+    def submit(self,func,*args):
+        done = threading.Event()
+        result = []
+        self.jobs.put((func, args, done, result))
+        done.wait()
+        return result[0]
+
+    # Handle a request, returns the reply line
+    def dispatch(self,request):
+        self.requests += 1
+        cmd = request[0].upper()
+        robot = self.robot
+        if cmd == 'PING':
+            return "OK"
+        elif cmd == 'STATUS':
+            return "OK " + ' '.join(k + "=" + str(v) for k, v in robot.getStatus())
+        elif cmd == 'EXEC' and len(request) == 3:
+            try:
+                t = float(request[2])
+            except ValueError:
+                return "ERR Invalid time: " + request[2]
+            if not robot.isCommand(request[1]):
+                return "ERR Invalid command: " + request[1]
+            error = self.submit(robot.executeJob, t, request[1])
+            if error is None:
+                return "OK"
+            return "ERR " + error
+        elif cmd == 'HOLD':
+            for name in request[1:]:
+                if not robot.isCommand(name) or name == 'wait' or 'light' in name:
+                    return "ERR Invalid command: " + name
+            robot.hold(request[1:])
+            return "OK"
+        elif cmd == 'LIGHT' and len(request) == 2 and request[1].upper() in ('ON', 'OFF'):
+            robot.setLight(request[1].upper() == 'ON')
+            return "OK"
+        elif cmd == 'RUN' and len(request) in (2, 3, 4, 5):
+            args = request[1:]
+            priority = 0
+            if len(args) >= 3 and args[-2].upper() == 'PRIORITY':
+                try:
+                    priority = int(args[-1])
+                except ValueError:
+                    return "ERR Invalid priority: " + args[-1]
+                args = args[:-2]
+            if len(args) > 2:
+                return "ERR Invalid request: " + ' '.join(request)
+            error = robot.executeFile(*args, priority=priority)
+            if error is None:
+                return "OK"
+            return "ERR " + error
+        elif cmd == 'CANCEL' and len(request) in (1, 2):
+            error = robot.cancelJobs(*request[1:])
+            if error is None:
+                return "OK"
+            return "ERR " + error
+        elif cmd == 'HOME' and len(request) in (1, 2):
+            error = robot.homeArms(*request[1:])
+            if error is None:
+                return "OK"
+            return "ERR " + error
+        elif cmd == 'RECORD' and len(request) == 2:
+            if request[1].upper() == 'OFF':
+                error = robot.stopRecording()
+            else:
+                error = robot.startRecording(request[1])
+            if error is None:
+                return "OK"
+            return "ERR " + error
+        elif cmd == 'REPLAY' and len(request) == 2:
+            error = self.submit(robot.replay, request[1])
+            if error is None:
+                return "OK"
+            return "ERR " + error
+        return "ERR Invalid request: " + ' '.join(request)
+
+# End of IPC classes
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Keyboard input class
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# A terminal only sends characters, not key presses and releases. A key
+# held down sends its character once, then again after the repeat delay
+# and from then on at the repeat rate. A key is taken as pressed when its
+# character first arrives and as released when the next repeat is
+# overdue, so a move key drives its joint for as long as it is held.
+# The repeat rate is learnt from the gaps between repeats.
+#
+# The terminal only repeats the last key pressed, so holding two keys
+# only moves one joint. To move several joints at once a move key typed
+# with shift (the upper case character) is latched on until it is typed
+# with shift again or stop is pressed.
+#
+# The terminal is read with select so that releases are seen on time
+# when no characters arrive.
+#
+# runKeyboard() drives the arm from the terminal through a client, a
+# RobotClient talking to the daemon or the Robot itself. It only needs the
+# key map so a client does not have to load the daemon.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import os
+import sys
+import time
+import select
+from log_class import Log
+
+log = Log()
+
+# Commands run when their key is typed, the other keys are held to move
+UNHELD = ('stop', 'light-on', 'light-off')
+
+class KeyboardInput:
+
+    MIN_TIMEOUT = 0.05      # Shortest wait for a repeat (seconds)
+
+    # fd is the terminal in cbreak mode. holdable are the keys that are
+    # held or latched, all other characters are returned as typed.
+    # delay is the longest time before the first repeat and interval a
+    # first guess at the repeat interval
+    def __init__(self,fd,holdable,delay=0.6,interval=0.035):
+        self.fd = fd
+        self.holdable = set(holdable)
+        self.delay = delay
+        self.interval = interval
+        self.held = {}              # Held key to time it is released
+        self.latched = set()        # Keys latched on with shift
+        self.last = {}              # Character to when it was last seen
+        self.repeating = set()      # Held keys past their first repeat
+        self.keys = []              # Keys held or latched, sorted
+        self.presses = 0
+        self.repeats = 0
+
+    # Time to wait for the next repeat of a key that is repeating
+    def repeatTimeout(self):
+        return min(max(3 * self.interval, self.MIN_TIMEOUT), self.delay)
+
+    # Handle a character, returns it if it is not a held or latched key
+    def character(self,char,now):
+        last = self.last.get(char)
+        self.last[char] = now
+        repeat = last is not None and now - last < self.delay
+        lower = char.lower()
+        if lower != char and lower in self.holdable:
+            # Shift toggles a latch, repeats of it are ignored
+            if not repeat:
+                self.latched ^= {lower}
+            return None
+        if char not in self.holdable:
+            return None if repeat else char
+        if repeat and char in self.held:
+            # The gap before the first repeat is the repeat delay
+            if char in self.repeating:
+                self.interval += 0.25 * (now - last - self.interval)
+            self.repeating.add(char)
+            self.repeats += 1
+            self.held[char] = now + self.repeatTimeout()
+        else:
+            self.presses += 1
+            self.repeating.discard(char)
+            self.held[char] = now + self.delay
+        return None
+
+    # Wait up to timeout seconds for characters. Returns a list of the
+    # typed characters that are not move keys and True if the keys held
+    # or latched have changed
+    def poll(self,timeout=None):
+        now = time.monotonic()
+        wait = self.timeout(now)
+        if timeout is not None and (wait is None or timeout < wait):
+            wait = timeout
+        typed = []
+        readable, writable, errors = select.select([self.fd], [], [], wait)
+        if len(readable) > 0:
+            data = os.read(self.fd, 64)
+            if len(data) == 0:
+                raise EOFError("End of keyboard input")
+            now = time.monotonic()
+            for char in data.decode('utf-8', 'replace'):
+                char = self.character(char, now)
+                if char is not None:
+                    typed.append(char)
+        else:
+            now = time.monotonic()
+        for key, release in list(self.held.items()):
+            if release <= now:
+                del self.held[key]
+        return typed, self.update()
+
+    # Seconds until the next held key is released, None if none are held
+    def timeout(self,now):
+        if len(self.held) == 0:
+            return None
+        return max(min(self.held.values()) - now, 0.0)
+
+    # Work out the keys held or latched, returns True if they have changed
+    def update(self):
+        keys = sorted(self.latched.union(self.held))
+        if keys == self.keys:
+            return False
+        self.keys = keys
+        return True
+
+    # Let go of every key, returns True if any were held or latched
+    def releaseAll(self):
+        self.held.clear()
+        self.latched.clear()
+        return self.update()
+
+# End of KeyboardInput class
+
+# Print the keys of a key map
+def displayKeys(keyMap):
+    print ("Key Command")
+    print ("--- -------")
+    for key in keyMap:
+        print (key + "   " + keyMap[key])
+    print  ("x   Exit program")
+    print ("Enter command: ")
+
+# Read the keyboard until x is typed, the keys held or latched are sent to
+# client.hold() each time they change
+def keyLoop(keyboard,keyMap,client):
+    while True:
+        typed, changed = keyboard.poll(1.0)
+        for key in typed:
+            if key == 'x':
+                client.hold([])
+                return
+            cmd = keyMap.get(key)
+            if cmd is None:
+                displayKeys(keyMap)
+                continue
+            log.message("key " + key + " cmd = " + cmd, log.INFO)
+            if cmd == 'stop':
+                changed = keyboard.releaseAll() or changed
+            elif cmd == 'light-on' or cmd == 'light-off':
+                client.setLight(cmd == 'light-on')
+        if changed:
+            client.hold([keyMap[key] for key in keyboard.keys])
+
+# Drive the arm from the terminal until x is typed
+def runKeyboard(keyMap,client,delay=0.6):
+    import termios
+    import tty
+    displayKeys(keyMap)
+    fd = sys.stdin.fileno()
+    old_settings = termios.tcgetattr(fd)
+    tty.setcbreak(sys.stdin)
+    holdable = [key for key, cmd in keyMap.items() if cmd not in UNHELD]
+    try:
+        keyLoop(KeyboardInput(fd, holdable, delay), keyMap, client)
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
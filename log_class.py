@@ -7,6 +7,10 @@
 # Author : Bob Rathbone
 # Site   : http://www.bobrathbone.com
 #
+# Messages are filtered by level in the caller and then passed through
+# a queue to a single long-lived file handler running in a background
+# writer thread. No sub-processes are run when logging a message.
+#
 # License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
 #
 # Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
@@ -14,84 +18,130 @@
 #
 
 import os
-import logging
-import pdb
+import atexit
 
+# The logging package is only imported when the first message is written
+# so that short lived commands such as status do not wait for it
 class Log:
 
-    INFO = logging.INFO
-    WARNING = logging.WARNING
-    ERROR = logging.ERROR
-    DEBUG = logging.DEBUG
+    # The same values as logging.INFO etc.
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+    DEBUG = 10
 
     RobotLibDir = "/var/lib/robotd"
     LogLevelFile = RobotLibDir + "/loglevel"
     LogDir = "/var/log"
+    LogOwner = "pi"
 
+    # One log file and writer thread per process, shared by all instances
     module = ''
-    level = logging.INFO
+    level = INFO
+    logger = None
+    listener = None
+    truncate = False    # Truncate the log file when the writer starts
 
     def __init__(self):
-            return 
+            return
 
     # Initialise log file
     def init(self,module):
-        self.module = module
-        self.execCommand ("mkdir -p " + self.RobotLibDir )
+        Log.module = module
+        os.makedirs(self.RobotLibDir, exist_ok=True)
 
         # Set up loglevel file
         if not os.path.isfile(self.LogLevelFile) or os.path.getsize(self.LogLevelFile) == 0:
-            os.popen("echo INFO > " + self.LogLevelFile)
-        self.level = self.getLogLevel()
-
-        # Truncate log file
-        logfile = self.LogDir + '/' + self.module + '/' + self.module + '.log'
-        self.execCommand ("echo '' > " + logfile )
-
-    # Log message 
-    def message(self,message,level):
-        # Set up logging, level can be INFO, WARNING, ERROR, DEBUG
-        logrobot = self.LogDir + "/" + self.module
-        self.execCommand ("sudo mkdir -p " +  logrobot)
-        self.execCommand ("sudo chown pi:pi " + logrobot)
-        logger = logging.getLogger('gipiod')
-        hdlr = logging.FileHandler(self.LogDir + '/' + self.module + 
-                '/' + self.module + '.log')
+            with open(self.LogLevelFile,'w') as f:
+                f.write("INFO\n")
+        Log.level = self.getLogLevel()
+
+        # The log file is truncated when the first message is written
+        Log.stop()
+        Log.truncate = True
+
+    # Start the background writer for the log file
+    @staticmethod
+    def start(truncate=False):
+        import shutil
+        import queue
+        import logging
+        import logging.handlers
+        Log.stop()
+        module = Log.module or 'robot'
+        logdir = Log.LogDir + "/" + module
+        os.makedirs(logdir, exist_ok=True)
+        try:
+            shutil.chown(logdir, Log.LogOwner, Log.LogOwner)
+        except (LookupError, OSError):
+            pass
+        logfile = logdir + '/' + module + '.log'
+        if truncate or Log.truncate:
+            open(logfile,'w').close()
+            Log.truncate = False
+
+        hdlr = logging.FileHandler(logfile)
         formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
         hdlr.setFormatter(formatter)
-        logger.addHandler(hdlr)
-        logger.setLevel(self.level)
-        if level == logging.INFO:
-            logger.info(message)
-        if level == logging.WARNING:
-            logger.warning(message)
-        if level == logging.DEBUG:
-            logger.debug(message)
-        if level == logging.ERROR:
-            logger.error(message)
-        logger.removeHandler(hdlr)
-        hdlr.close()
+
+        logQueue = queue.SimpleQueue()
+        logger = logging.getLogger('robotd.' + module)
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        for h in list(logger.handlers):
+            logger.removeHandler(h)
+        logger.addHandler(logging.handlers.QueueHandler(logQueue))
+        Log.logger = logger
+        Log.listener = logging.handlers.QueueListener(logQueue, hdlr)
+        Log.listener.start()
+
+    # Flush outstanding messages and stop the writer thread
+    @staticmethod
+    def stop():
+        listener = Log.listener
+        Log.listener = None
+        if listener is not None:
+            if listener._thread is not None and listener._thread.is_alive():
+                listener.stop()
+            for hdlr in listener.handlers:
+                hdlr.close()
+
+    # The writer thread is not copied by fork() so restart it in the child
+    @staticmethod
+    def restart():
+        if Log.listener is not None:
+            Log.listener = None
+            Log.start()
+
+    # Log message
+    def message(self,message,level):
+        # Level can be INFO, WARNING, ERROR, DEBUG
+        if level < Log.level:
+            return
+        if Log.listener is None:
+            Log.start()
+        Log.logger.log(level, message)
 
     # Temporary set log level
     def setLevel(self,level):
-        self.level = level
+        Log.level = level
 
     # Get the log level from the configuration file
     def getLogLevel(self):
-        self.loglevel = logging.INFO
+        self.loglevel = self.INFO
         if os.path.isfile(self.LogLevelFile):
             try:
-                p = os.popen("cat " + self.LogLevelFile)
-                strLogLevel = p.readline().rstrip('\n')
+                with open(self.LogLevelFile) as f:
+                    strLogLevel = f.readline().rstrip('\n')
                 if strLogLevel == "DEBUG":
-                        self.loglevel = logging.DEBUG
+                        self.loglevel = self.DEBUG
                 elif strLogLevel == "WARNING":
-                        self.loglevel = logging.WARNING
+                        self.loglevel = self.WARNING
                 elif strLogLevel == "ERROR":
-                        self.loglevel = logging.ERROR
+                        self.loglevel = self.ERROR
 
-            except ValueError:
-                self.loglevel = logging.INFO
+            except (ValueError, IOError):
+                self.loglevel = self.INFO
 
         return self.loglevel
 
@@ -100,6 +150,9 @@ class Log:
         p = os.popen(cmd)
         return  p.readline().rstrip('\n')
 
+atexit.register(Log.stop)
+os.register_at_fork(after_in_child=Log.restart)
+
 # End of log class
 
 #set tabstop=4 shiftwidth=4 expandtab
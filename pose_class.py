@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Joint position estimator class
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# The Maplin arm has no position sensors so the angle of each joint is
+# estimated from how long it has been driven in each direction and its
+# measured speed. The estimate is updated each time a new command is
+# sent to the arm. A joint that has reached its soft travel limit has its
+# bits masked off so that it is not driven into the end stop.
+#
+# Angles are in degrees from the position the arm was in at start up.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import time
+import threading
+
+from command_class import JOINTS
+from script_class import OP_WAIT
+
+class PoseEstimator:
+
+    SLACK = 0.001       # Degrees past a limit that are put down to rounding
+
+    # moves maps each joint to ((command, speed), (command, speed)) where
+    # the first command increases the angle. limits maps each joint to
+    # (minimum, maximum) angle, either may be None
+    def __init__(self,table,moves,limits):
+        self.table = table
+        self.lock = threading.Lock()
+        self.names = []             # Joint names
+        self.commands = []          # Commands for each direction (+, -)
+        self.speeds = []            # Signed speed for each direction (+, -)
+        self.minimum = []
+        self.maximum = []
+        self.angle = []
+        self.runTime = []           # Seconds driven in each direction [+, -]
+        directions = {}             # Joint bits to (joint number, +1 or -1)
+        for name, armBits, baseBits in JOINTS:
+            if name not in moves:
+                continue
+            joint = len(self.names)
+            (up, upSpeed), (down, downSpeed) = moves[name]
+            for cmd, direction in ((up, 1), (down, -1)):
+                payload = table.byName[cmd]
+                directions[(payload[0], payload[1])] = (joint, direction)
+            lower, upper = limits.get(name, (None, None))
+            self.names.append(name)
+            self.commands.append((up, down))
+            self.speeds.append((upSpeed, -downSpeed))
+            self.minimum.append(lower)
+            self.maximum.append(upper)
+            self.angle.append(0.0)
+            self.runTime.append([0.0, 0.0])
+
+        # The joints moved by every payload as a tuple of (joint number,
+        # direction, arm bits, base bits), indexed as the command table
+        self.moving = []
+        for payload in table.payloads:
+            joints = []
+            for name, armBits, baseBits in JOINTS:
+                bits = (payload[0] & armBits, payload[1] & baseBits)
+                if bits in directions:
+                    joint, direction = directions[bits]
+                    joints.append((joint, direction, bits[0], bits[1]))
+            self.moving.append(tuple(joints))
+
+        self.payload = table.byName['stop']     # Last payload sent
+        self.since = time.monotonic()           # When it was sent
+        self.limited = 0                        # Moves masked off at a limit
+
+    # Bring the angles up to date for the time the last payload has been on
+    def advance(self,now):
+        dt = now - self.since
+        if dt <= 0:
+            return
+        for joint, direction, armBits, baseBits in self.moving[self.table.index(self.payload)]:
+            self.angle[joint] += self.speeds[joint][direction < 0] * dt
+            self.runTime[joint][direction < 0] += dt
+        self.since = now
+
+    # Has a joint moving in a direction reached its limit
+    def atLimit(self,joint,direction):
+        if direction > 0:
+            limit = self.maximum[joint]
+            return limit is not None and self.angle[joint] >= limit
+        limit = self.minimum[joint]
+        return limit is not None and self.angle[joint] <= limit
+
+    # The payload with the bits of joints at their limits masked off
+    def limit(self,payload,now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            self.advance(now)
+            arm = payload[0]
+            base = payload[1]
+            for joint, direction, armBits, baseBits in self.moving[self.table.index(payload)]:
+                if self.atLimit(joint, direction):
+                    arm &= ~armBits
+                    base &= ~baseBits
+            if arm == payload[0] and base == payload[1]:
+                return payload
+            self.limited += 1
+            return self.table.payload(arm, base, payload[2])
+
+    # Record a payload sent to the arm
+    def update(self,payload,now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            self.advance(now)
+            self.payload = self.table.withLight(payload, 0)
+
+    # Seconds a payload can run for before a joint reaches a limit,
+    # None if there is no limit
+    def timeLeft(self,payload,now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            self.advance(now)
+            left = None
+            for joint, direction, armBits, baseBits in self.moving[self.table.index(payload)]:
+                if direction > 0:
+                    limit = self.maximum[joint]
+                else:
+                    limit = self.minimum[joint]
+                if limit is None:
+                    continue
+                t = max((limit - self.angle[joint]) / self.speeds[joint][direction < 0], 0.0)
+                if left is None or t < left:
+                    left = t
+            return left
+
+    # Time the last payload sent will take a joint to a limit, None if never
+    def limitTime(self):
+        left = self.timeLeft(self.payload, self.since)
+        if left is None:
+            return None
+        return self.since + left
+
+    # Estimated angles as a list of (joint, degrees)
+    def pose(self):
+        with self.lock:
+            self.advance(time.monotonic())
+            return list(zip(self.names, self.angle))
+
+    # Set the estimated angle of a joint
+    def setAngle(self,name,angle):
+        with self.lock:
+            self.advance(time.monotonic())
+            self.angle[self.names.index(name)] = angle
+
+    # Use a virtual clock that starts at 0 and only moves on with step(),
+    # for following a compiled program without running it
+    def startClock(self):
+        with self.lock:
+            self.since = 0.0
+            self.payload = self.table.byName['stop']
+
+    # Follow one instruction of a compiled program on the virtual clock.
+    # Returns a list of (joint, angle) for each joint that would pass a
+    # limit. The joint is held at the limit as it would be when run, so
+    # each move is only reported once
+    def step(self,op,payload,duration):
+        problems = []
+        with self.lock:
+            if op != OP_WAIT:
+                # The light payload also stops the arm
+                self.payload = self.table.withLight(payload, 0)
+                return problems
+            self.advance(self.since + duration)
+            for joint, direction, armBits, baseBits in \
+                    self.moving[self.table.index(self.payload)]:
+                angle = self.angle[joint]
+                if direction > 0:
+                    limit = self.maximum[joint]
+                    past = limit is not None and angle > limit + self.SLACK
+                else:
+                    limit = self.minimum[joint]
+                    past = limit is not None and angle < limit - self.SLACK
+                if past:
+                    problems.append((self.names[joint], angle))
+                    self.angle[joint] = limit
+        return problems
+
+    # Run a compiled commands file on the virtual clock starting at the
+    # current angles. Returns a list of (line, joint, angle) for each move
+    # that would take a joint past a limit
+    def check(self,program):
+        problems = []
+        line = 0
+        self.startClock()
+        for op, payload, duration, opLine in zip(program.ops, program.payloads,
+                program.durations, program.lines):
+            if op != OP_WAIT:
+                line = opLine
+            for joint, angle in self.step(op, payload, duration):
+                problems.append((line, joint, angle))
+        return problems
+
+    # One line summary
+    def summary(self):
+        return ' '.join("%s=%.1f" % (name, angle) for name, angle in self.pose()) \
+                + " limited=" + str(self.limited)
+
+# End of PoseEstimator class
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Session recorder classes
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# Every change of the command wanted by the joystick, buttons, switches,
+# keyboard and light can be appended to a recording file. A recording
+# can be replayed with its original timing (See Robot.replay) or turned
+# into a commands file and back.
+#
+# The file starts with an 8 byte header (RREC and the format version)
+# followed by 12 byte records of a monotonic time in nanoseconds, the
+# source number and the 3 byte payload. A session record is written each
+# time recording starts so that several sessions can be in one file.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import os
+import time
+import struct
+import threading
+
+from command_class import JOINTS
+
+MAGIC = b'RREC'
+VERSION = 1
+HEADER = struct.Struct('<4sI')          # magic, version
+RECORD = struct.Struct('<qB3s')         # monotonic ns, source, payload
+
+# Source numbers, the position in this list is stored in the file
+SOURCES = ('session', 'joystick', 'buttons', 'switches', 'keyboard', 'light', 'script')
+SESSION = 0
+
+class RecordError(Exception):
+    pass
+
+# Appends source changes to a recording file
+class Recorder:
+
+    def __init__(self,path,stop):
+        self.path = path
+        self.lock = threading.Lock()
+        self.last = {}                  # Last payload recorded for each source
+        self.records = 0
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if os.fstat(self.fd).st_size == 0:
+            os.write(self.fd, HEADER.pack(MAGIC, VERSION))
+        self.write(SESSION, stop, time.monotonic_ns())
+
+    # Record the payload wanted by a source if it has changed. Each record
+    # is a single write so nothing is lost if the program stops
+    def record(self,source,payload,eventTime=None):
+        if eventTime is None:
+            ns = time.monotonic_ns()
+        else:
+            ns = int(eventTime * 1000000000)
+        with self.lock:
+            if self.fd is None or self.last.get(source) is payload:
+                return
+            self.last[source] = payload
+            self.write(SOURCES.index(source), payload, ns)
+
+    def write(self,source,payload,ns):
+        os.write(self.fd, RECORD.pack(ns, source, payload))
+        self.records += 1
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+# Read a recording, returns a list of (ns, source name, payload) with the
+# payloads taken from the command table
+def load(path,table):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise RecordError(path + ": not a recording")
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise RecordError(path + ": not a recording or unknown version")
+    end = len(data) - (len(data) - HEADER.size) % RECORD.size
+    records = []
+    for ns, source, payload in RECORD.iter_unpack(data[HEADER.size:end]):
+        if source >= len(SOURCES) or payload[1] >= table.BASE_VALUES or payload[2] > 1:
+            raise RecordError(path + ": invalid record at offset " + str(HEADER.size
+                    + len(records) * RECORD.size))
+        records.append((ns, SOURCES[source], table.withLight(payload, payload[2])))
+    return records
+
+# Write records to a new recording file
+def save(path,records):
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION))
+        for ns, source, payload in records:
+            f.write(RECORD.pack(ns, SOURCES.index(source), payload))
+
+# The commands sent to the arm by a recording as a list of (ns, payload
+# sent, light on). A session starts with everything stopped and its
+# first record at the time the previous session ended
+def timeline(table,records):
+    steps = []
+    sources = {}
+    light = False
+    offset = 0
+    last = 0
+    for ns, source, payload in records:
+        if source == 'session':
+            sources = {}
+            offset = last - ns
+            light = False
+        elif source == 'light':
+            light = payload[2] == 1
+        else:
+            sources[source] = payload
+        last = ns + offset
+        steps.append((last, table.merge(sources.values()), light))
+    return steps
+
+# The command names that make up a payload, one per joint
+def jointCommands(table,payload):
+    names = []
+    for joint, armBits, baseBits in JOINTS:
+        bits = table.payload(payload[0] & armBits, payload[1] & baseBits, 0)
+        if bits[0] or bits[1]:
+            names.append(table.name(bits))
+    return names
+
+# Convert a recording to lines of a commands file (See script_class.py)
+def toScript(table,records):
+    lines = []
+    steps = timeline(table, records)
+    light = False
+    for i in range(len(steps)):
+        ns, payload, on = steps[i]
+        if on != light:
+            lines.append(('light-on' if on else 'light-off') + " 0")
+            light = on
+        if i + 1 == len(steps):
+            break
+        # Times are rounded to the millisecond from the start of the
+        # recording so rounding errors do not add up
+        t = (round(steps[i + 1][0] / 1000000.0) - round(ns / 1000000.0)) / 1000.0
+        if t <= 0:
+            continue
+        names = jointCommands(table, payload)
+        if len(names) == 0:
+            lines.append("wait %.3f" % t)
+        elif len(names) == 1:
+            lines.append("%s %.3f" % (names[0], t))
+        else:
+            lines.append("parallel { " + '; '.join("%s %.3f" % (name, t)
+                    for name in names) + " }")
+    return lines
+
+# Convert a recording to a program that sends its changes with their
+# original timing, so it is run by an arm worker like a commands file
+# (See worker_class.py). The light is set with each change that switches
+# it, and at the start, without stopping the arm
+def toProgram(table,records):
+    from script_class import Program, OP_SEND, OP_WAIT, OP_LIGHT
+    stop = table.byName['stop']
+    program = Program()
+    last = None
+    light = None
+    due = None
+    line = 0
+    for ns, payload, on in timeline(table, records):
+        line += 1
+        if payload is last and on == light:
+            continue
+        if due is not None and ns > due:
+            program.append(OP_WAIT, stop, (ns - due) / 1000000000.0, line)
+        due = ns
+        if on != light:
+            program.append(OP_LIGHT, table.withLight(payload, 1 if on else 0), 0.0, line)
+        else:
+            program.append(OP_SEND, payload, 0.0, line)
+        last = payload
+        light = on
+    if len(program) > 0:
+        program.append(OP_SEND, stop, 0.0, line)
+    return program
+
+# Convert a compiled commands file to records, starting at time 0
+def fromProgram(table,program):
+    from script_class import OP_WAIT, OP_LIGHT
+    stop = table.byName['stop']
+    records = [(0, 'session', stop)]
+    ns = 0
+    for op, payload, duration in zip(program.ops, program.payloads, program.durations):
+        if op == OP_WAIT:
+            ns += int(round(duration * 1000000000))
+        elif op == OP_LIGHT:
+            # The light payload also stops the arm
+            records.append((ns, 'light', payload))
+            records.append((ns, 'script', stop))
+        else:
+            records.append((ns, 'script', payload))
+    return records
+
+# End of recorder classes
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
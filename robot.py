@@ -32,23 +32,26 @@
 
 import os
 import sys
-import tty
-import termios
-import time
 import atexit
-from robotd import Robot
 from log_class import Log
+from client_class import RobotClient
+from keyboard_class import runKeyboard
 
 log = Log()
-robot = Robot('/var/run/robotd.pid')
-old_settings = None
+
+# Use the arm session of the running daemon if there is one, otherwise
+# talk to the arm directly
+robot = RobotClient()
+if not robot.connect():
+    from robotd import Robot
+    robot = Robot('/var/run/robotd.pid')
 
 # Register exit routine
 def finish():
-    global old_settings
-    robot.execute(0,'stop')
-    # Restore stty settings
-    termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
+    try:
+        robot.execute(0,'stop')
+    except IOError:
+        pass
     log.message("Robot program stopped", log.INFO)
     print("Program stopped")
 
@@ -70,17 +73,6 @@ commands = {
     'k' : 'stop',
     }
 
-def displayKeys():
-    log.init("robot")
-    log.message("Robot program started", log.INFO)
-    print ("Key Command")
-    print ("--- -------")
-    for cmd in commands:
-        print (cmd + "   " + commands[cmd])
-    print  ("x   Exit program")
-    print
-    return
-
 ### Main routine ###
 if __name__ == "__main__":
 
@@ -89,28 +81,18 @@ if __name__ == "__main__":
         print ("This program must be run with sudo or root permissions!")
         sys.exit(1)
 
-    displayKeys()
-    fd = sys.stdin.fileno()
-    old_settings = termios.tcgetattr(fd)
-    tty.setcbreak(sys.stdin)
-
-    t = 0.1
-    while True:
-        key = sys.stdin.read(1)
-
-        if key ==  'x': 
-            termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
-            sys.exit(0)
+    log.init("robot")
+    log.message("Robot program started", log.INFO)
 
-        else:
-            try:
-                cmd = commands[key]
-                log.message(cmd, log.INFO)
-                robot.execute(t,cmd)
-            except Exception as e:
-                print("robot.execute " + cmd + ": " +  str(e))
-                sys.exit(1)
-                #displayKeys()
+    # Keys are held down to move the arm (See keyboard_class.py)
+    if isinstance(robot, RobotClient):
+        runKeyboard(commands, robot)
+    else:
+        robot.control.start()
+        try:
+            runKeyboard(commands, robot)
+        finally:
+            robot.stopLive()
 
 # End of main
 
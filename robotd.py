@@ -20,21 +20,19 @@
 
 import os
 import signal
-import usb.core
 import sys
 import time
-import termios
-import tty
-import RPi.GPIO as GPIO
+import threading
 from signal import SIGTERM
 
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
-import pygame
-
-# Class imports
+# Class imports. Those only needed to run the daemon, the arm or the
+# keyboard are imported when first used so that commands such as status
+# and version start quickly
 from robot_daemon import Daemon
 from log_class import Log
-import pdb
+from command_class import CommandTable
+from client_class import RobotClient
+from input_class import QUIT, AXIS, BUTTONDOWN, BUTTONUP
 
 log = Log()
 
@@ -92,6 +90,23 @@ commands={
 # Joystick axis settings
 AXIS_HORIZONTAL = 0
 AXIS_VERTICAL = 1
+AXIS_TWIST = 2
+AXIS_THROTTLE = 3
+AXIS_HAT_HORIZONTAL = 4
+AXIS_HAT_VERTICAL = 5
+
+# Joystick axis to functions, the first when the axis value is positive.
+# Only the stick is mapped as the other axes differ from one joystick to
+# another. On many pads axes 2 and 5 are triggers that rest at one end,
+# and evdev leaves out the hat so its axis numbers are not those of
+# joydev. Check the numbers with jstest before adding them
+axisMap = {
+    AXIS_HORIZONTAL : ('base-anti-clockwise', 'base-clockwise'),
+    AXIS_VERTICAL : ('shoulder-up', 'shoulder-down'),
+    #AXIS_TWIST : ('wrist-up', 'wrist-down'),
+    #AXIS_HAT_HORIZONTAL : ('grip-open', 'grip-close'),
+    #AXIS_HAT_VERTICAL : ('elbow-up', 'elbow-down'),
+    }
 
 # Switch definitions (GPIO inputs)
 GRIP_OPEN = 21
@@ -107,20 +122,184 @@ ELBOW_DOWN = 12
 LIGHT_ON = 22
 LIGHT_OFF = 23
 
+# Switch to function mapping
+switchMap = {
+    BASE_CLOCKWISE : 'base-clockwise',
+    BASE_ANTI_CLOCKWISE : 'base-anti-clockwise',
+    SHOULDER_UP : 'shoulder-up',
+    SHOULDER_DOWN : 'shoulder-down',
+    ELBOW_UP : 'elbow-up',
+    ELBOW_DOWN : 'elbow-down',
+    WRIST_UP : 'wrist-up',
+    WRIST_DOWN : 'wrist-down',
+    GRIP_OPEN : 'grip-open',
+    GRIP_CLOSE : 'grip-close',
+    LIGHT_ON : 'light-on',
+    LIGHT_OFF : 'light-off',
+    }
+
+# All of the above compiled into one dispatch table of preallocated payloads
+table = CommandTable(commands, buttonMap, switchMap, keyMap)
+
+# Switch debounce time in milliseconds. Both edges are detected so this
+# must be shorter than the quickest press and release of a switch. An edge
+# within this time of the one before is dropped by RPi.GPIO so a switch is
+# read again once it has passed
+switch_bouncetime = 20
+
 
 # How far to move the JoyStick before it has an effect (0.60 = 60%)
 threshold = 0.60
 
+# Joystick speed control. Past the dead zone a joint is pulsed on and off
+# by the control loop, for longer the further the stick is moved, and is
+# on all the time from the threshold. Set joystick_pwm to False to only
+# move at full speed past the threshold
+joystick_pwm = True
+joystick_deadzone = 0.15
+
+# Joystick speed levels between the dead zone and the threshold. An axis
+# only changes level once it is past the boundary by the hysteresis and
+# small movements are smoothed (1.0 is no smoothing) so that a wobbling
+# stick does not keep changing the command sent to the arm
+joystick_levels = 8
+joystick_hysteresis = 0.05
+joystick_smoothing = 0.5
+
+# Axes with their own (deadzone, hysteresis, smoothing), such as a hat
+# switch which is only ever -1, 0 or 1
+axisTuning = {
+    AXIS_HAT_HORIZONTAL : (0.5, 0.0, 1.0),
+    AXIS_HAT_VERTICAL : (0.5, 0.0, 1.0),
+    }
+
+# Longest time a terminal takes to repeat a held key (seconds). A move
+# key that is tapped moves its joint for this long
+key_repeat_delay = 0.6
+
+# Joystick input: joydev (/dev/input/js*), evdev or pygame
+input_backend = 'joydev'
+
+# How often to look for devices if hotplug uevents cannot be used (seconds)
+hotplug_poll_interval = 1.0
+
+# Estimated joint speeds in degrees per second as ((command, speed),
+# (command, speed)), the first command of each joint increases its angle
+joint_moves = {
+    'shoulder' : (('shoulder-up', 12.0), ('shoulder-down', 15.0)),
+    'elbow' : (('elbow-up', 14.0), ('elbow-down', 18.0)),
+    'wrist' : (('wrist-up', 25.0), ('wrist-down', 25.0)),
+    'grip' : (('grip-open', 15.0), ('grip-close', 15.0)),
+    'base' : (('base-anti-clockwise', 18.0), ('base-clockwise', 18.0)),
+    }
+
+# Degrees each joint travels from one end stop to the other, used by
+# "robotd.py calibrate" to measure the speeds above
+joint_travel = {
+    'shoulder' : 180.0,
+    'elbow' : 300.0,
+    'wrist' : 120.0,
+    'grip' : 60.0,
+    'base' : 270.0,
+    }
+
+# Arm geometry for "move-to x y z" in millimetres: the height of the
+# shoulder above the table and the lengths from the shoulder to the elbow,
+# the elbow to the wrist and the wrist to the tip of the grip
+arm_lengths = (70.0, 92.0, 113.0, 80.0)
+
+# Angles of the joints in the position the arm is in at start up. The
+# shoulder is from horizontal, the elbow and wrist from straight in line
+# and the base from facing along x
+joint_home = {
+    'shoulder' : 90.0,
+    'elbow' : 0.0,
+    'wrist' : 0.0,
+    'base' : 0.0,
+    }
+
+# The move-to grid step in degrees and how close to the point it must get (mm)
+ik_step = 3.0
+ik_tolerance = 5.0
+
+# Soft travel limits in degrees (minimum, maximum) from the position the
+# arm was in at start up, None for no limit. Start with the arm in the
+# middle of its travel, or put it back there and run "robotd.py home".
+# The grip has none as it stalls when it closes on something, so the time
+# it is driven for says little about where it is
+joint_limits = {
+    'shoulder' : (-90.0, 90.0),
+    'elbow' : (-150.0, 150.0),
+    'wrist' : (-60.0, 60.0),
+    'grip' : (None, None),
+    'base' : (-135.0, 135.0),
+    }
+
+# Rate of the control loop that merges the live inputs (Hz)
+control_rate = 100
+
+# How often to log the latency histogram (seconds)
+latency_report_interval = 60
+
+# How often the daemon state is written to the status file (seconds)
+status_interval = 0.2
+
 # USB vendor and product IDs
 usb_vendor_id=0x1267
 usb_prod_id=0x000
 
+# How far ahead a commands file run on all arms is started so that every
+# arm starts it at the same time (seconds)
+sync_start_delay = 0.05
+
+# What a running commands file does when the joystick, buttons, switches
+# or keyboard move the arm: 'resume' once they have been let go for
+# script_resume_delay seconds, or 'abort'
+script_policy = 'resume'
+script_resume_delay = 0.5
+
+
+# Import RPi.GPIO, returns None if not running on a Raspberry Pi
+def loadGPIO():
+    try:
+        import RPi.GPIO as GPIO
+    except (ImportError, RuntimeError):
+        return None
+    return GPIO
+
+# An attribute of the worker for the first arm
+def firstArm(name):
+    return property(lambda self: getattr(self.worker, name),
+            lambda self, value: setattr(self.worker, name, value))
+
+# Print the state published by the running daemon, or get the pid from
+# the pidfile if it is not publishing it. Kept out of the Robot class so
+# that "robotd.py status" does not have to load the arm classes
+def printStatus(pidfile):
+    from status_class import readStatus, isRunning, formatStatus
+    status = readStatus()
+    if status is not None and isRunning(status):
+        print ("robotd status: " + formatStatus(status))
+        return
+    try:
+            pf = open(pidfile,'r')
+            pid = int(pf.read().strip())
+            pf.close()
+    except IOError:
+            pid = None
+
+    if not pid:
+            print("robotd status: not running")
+    else:
+            print("robotd running pid " + str(pid))
+
+PidFile = '/var/run/robotd.pid'
 
 #Daemon class
 class Robot(Daemon):
 
     # Robot Arm  defaults
-    command = (0,0,0)
+    command = table.byName['stop']
     lightc = 0
     shoulder = 0
     base = 0
@@ -135,323 +314,785 @@ class Robot(Daemon):
     base_command = 0
     elbow_command = 0 
 
-    light_on = False    # Light on/off
+    # USB session, estimated pose, timers and light of the first arm
+    arm = firstArm('arm')
+    pose = firstArm('pose')
+    timer = firstArm('timer')
+    moveTimer = firstArm('moveTimer')
+    light_on = firstArm('light_on')
+
+    def __init__(self, pidfile, stdin='/dev/null', stdout='/dev/null', stderr='/dev/null'):
+        from usb_class import UsbArm
+        from script_class import ScriptCompiler
+        from control_class import ControlLoop
+        from calibration_class import Calibration
+        from axis_class import AxisMap
+        Daemon.__init__(self, pidfile, stdin, stdout, stderr)
+
+        # GPIO interface for the switches, loaded by run() (See sim_class.py to simulate)
+        self.gpio = None
+
+        # Switches and joystick buttons currently pressed
+        self.switchArm = 0
+        self.switchBase = 0
+        self.switchLock = threading.Lock()
+        self.buttonArm = 0
+        self.buttonBase = 0
+        self.keysHeld = 0
+
+        # Joystick axes to joint moves and speeds
+        self.axes = AxisMap(table, axisMap, threshold, joystick_deadzone,
+                joystick_hysteresis, joystick_smoothing,
+                joystick_levels if joystick_pwm else 1, axisTuning)
+
+        # Joint speeds, measured by calibrate() if it has been run
+        self.calibration = Calibration(joint_moves)
+        self.calibration.load()
+
+        # A worker for each arm with its USB session, estimated joint angles
+        # and timer. The first is also driven by the live inputs, the others
+        # are added by findArms() and when plugged in
+        self.worker = self.newWorker('1', UsbArm(usb_vendor_id, usb_prod_id))
+        self.workers = [self.worker]
+
+        # The joystick, buttons, switches and keyboard are merged by the
+        # control loop into one transfer per tick, sent by the transfer thread
+        self.control = ControlLoop(table, self.postCommand, control_rate, self.limitCommand)
+
+        # Compiler for commands files
+        self.compiler = ScriptCompiler(table, calibration=self.calibration)
+        self.planner = None
+        self.plannerLock = threading.Lock()
+
+        # Control socket for command line clients, started by run()
+        self.server = None
+
+        # Joystick input, opened by run()
+        self.joystick = None
+        self.joystickPlugged = threading.Event()
+
+        # Arm and joystick hotplug events, started by run()
+        self.hotplug = None
+
+        # Records the live inputs when recording (See record_class.py)
+        self.recorder = None
+
+        # Daemon state for monitors, started by run() (See status_class.py)
+        self.statusWriter = None
+
+        # Latency reporting
+        self.latencyReported = 0
+        self.latencyReportTime = time.monotonic()
         
     # Signal SIGTERM handler
     def signalHandler(self,sig,frame):
         msg = "Caught signal.SIGTERM: Exiting"
         if sig == signal.SIGTERM:
            log.message(msg, log.INFO)
+           for worker in self.workers:
+               log.message(worker.summary(), log.INFO)
+           if self.hotplug is not None:
+               log.message("Hotplug " + self.hotplug.summary(), log.INFO)
+           self.reportLatency(force=True)
            print(msg)
+           if self.server is not None:
+               self.server.stop()
            try:
                os.remove(self.pidfile)
            except:
                pass
            sys.exit(0) 
      
-    # ARM control related stuff
-    def setCommand(self,axis_val):
-        cmd = 0
-        if axis_val > threshold:
-            cmd = 1
-        elif axis_val < -threshold:
-            cmd = 2
-        elif abs(axis_val) < threshold:
-            cmd = 0
-        return cmd
-
-    def buildcommand(self,shoulc,basec,elbowc,wristc,gripc,lightc):
-        arm = shoulc + elbowc +  wristc + gripc
-        comm_bytes = (arm, basec, self.lightc)
-        return comm_bytes
+    # Switch the light on or off, sent on the next control loop tick
+    def setLight(self,on,eventTime=None):
+        self.light_on = on
+        self.recordLight(eventTime)
+        self.control.touch(eventTime)
+
+    # Record the light being switched on or off
+    def recordLight(self,eventTime=None):
+        if self.recorder is not None:
+            self.recorder.record('light', table.withLight(table.byName['stop'],
+                    1 if self.light_on else 0), eventTime)
 
     # Main event handler
     def handleEvent(self,event):
-        global commands
-        if event.type is pygame.QUIT:
+        # Events from other input sources may carry their own timestamp
+        eventTime = getattr(event, 'time', None) or time.monotonic()
+        if event.type == QUIT:
             log.message("Exiting robotd program", log.INFO)
-            self.sendCommand(self.rctl,commands['stop'])
-            pygame.joystick.quit()
+            self.sendCommand(table.byName['stop'])
+            if self.joystick is not None:
+                self.joystick.close()
             sys.exit(0)
 
-        elif event.type == pygame.JOYAXISMOTION:
-            self.handle_joystick(event)
+        elif event.type == AXIS:
+            # Only a change of joint or speed goes to the control loop
+            if self.handle_joystick(event):
+                self.control.setDuty('joystick', self.axes.joystickMoves(), eventTime)
         
-        elif event.type is pygame.JOYBUTTONDOWN:
-            log.message("JOYBUTTONDOWN " + str(event.button), log.DEBUG)
-            cmd = self.getButtonCommand(event.button)
-            log.message("Command " + cmd, log.DEBUG)
-
-            if cmd == 'light-on':
-                self.light_on = True
-            elif cmd == 'light-off':
-                self.light_on = False
-
-            if cmd != '':
-                self.execute(-1,cmd)
-
-            log.message("A light = " + str(self.light_on), log.DEBUG)
-
-        elif event.type is pygame.JOYBUTTONUP:
-            button = event.button
-            log.message("JOYBUTTONUP " + str(button), log.DEBUG)
-            log.message("light_on " + str(self.light_on), log.DEBUG)
-            if self.light_on:
-                self.sendCommand(self.rctl,commands['light-on'])
+        elif event.type == BUTTONDOWN or event.type == BUTTONUP:
+            pressed = event.type == BUTTONDOWN
+            entry = table.lookup(table.BUTTON, event.button)
+            if log.level == log.DEBUG:
+                log.message("JOYBUTTON " + str(event.button) + " pressed " + str(pressed)
+                        + " light_on " + str(self.light_on), log.DEBUG)
+            if entry is None:
+                return
+            cmd, bits = entry
+            if cmd == 'light-on' or cmd == 'light-off':
+                if pressed:
+                    self.setLight(cmd == 'light-on', eventTime)
+                return
+
+            # Buttons held at once combine in the same way as switches
+            if pressed:
+                self.buttonArm |= bits[0]
+                self.buttonBase |= bits[1]
             else:
-                self.sendCommand(self.rctl,commands['stop'])
+                self.buttonArm &= ~bits[0]
+                self.buttonBase &= ~bits[1]
+            self.control.set('buttons', table.payload(self.buttonArm, self.buttonBase, 0),
+                    eventTime, not pressed)
 
-        # Work out what to send out to the robot
-        if self.light_on:
-            self.lightc = 1
-        else:
-            self.lightc = 0
-        newcommand = self.buildcommand(self.shoulder_command,self.base_command, 
-            self.elbow_command, self.wrist_command, self.grip_command,self.lightc)
-                      
-        # If the command has changed, send out the new one
-        if newcommand != self.command:
-            self.sendCommand(self.rctl, newcommand)
-            self.command = newcommand
-
-    # Handle the joystick event
+    # Handle the joystick event, returns True if the joystick moves changed
     def handle_joystick(self,event):
-        if event.axis == AXIS_VERTICAL:
-            self.shoulder = event.value
-        elif event.axis == AXIS_HORIZONTAL:
-            self.base = event.value
-
-        # setCommand returns 0, 1 or 2 so shoulder command is 0, 64 or 128
-        self.shoulder_command = self.setCommand(self.shoulder)*64
-
-        # setCommand returns 0, 1 or 2 so base command is 0, 1 or 2
-        self.base_command = self.setCommand(self.base)
+        return self.axes.update(event.axis, event.value)
 
     # Get button command
     def getButtonCommand(self,button):
-        try:
-            cmd = buttonMap[button]
-            return cmd
-        except:
+        entry = table.lookup(table.BUTTON, button)
+        if entry is None:
             return ""
+        return entry[0]
 
 
-    # Get the pid from the pidfile
+    # Print the state published by the running daemon, or get the pid
+    # from the pidfile if it is not publishing it
     def status(self):
+        printStatus(self.pidfile)
+
+    # The daemon state in the layout of the status file (See status_class.py)
+    # Only values that can be read without a lock are used so that
+    # publishing it does not hold up the control loop
+    def statusRecord(self):
+        from command_class import JOINTS
+        control = self.control
+        pose = self.pose
+        payload = pose.payload
+        angles = dict(zip(pose.names, pose.angle))
+        record = [os.getpid(), time.time(), self.arm.isOpen(), self.light_on,
+                payload[0], payload[1], self.arm.transfers, self.arm.reconnects,
+                self.arm.timeouts, control.transfers, control.overruns,
+                control.latency.mean()*1000, control.latency.maximum*1000,
+                control.stopLatency.mean()*1000, control.stopLatency.maximum*1000,
+                self.arm.transferTime.mean()*1000, self.arm.transferTime.maximum*1000,
+                control.jitter.maximum*1000,
+                sum(worker.queued() for worker in self.workers),
+                sum(worker.running is not None for worker in self.workers),
+                sum(worker.preemptions for worker in self.workers),
+                len(self.workers)]
+        for name, armBits, baseBits in JOINTS:
+            record.append(angles.get(name, float('nan')))
+        return record
+
+    # Publish the daemon state in the status file
+    def startStatus(self):
+        from status_class import StatusWriter
+        self.statusWriter = StatusWriter()
         try:
-                pf = open(self.pidfile,'r')
-                pid = int(pf.read().strip())
-                pf.close()
-        except IOError:
-                pid = None
-
-        if not pid:
-                message = "robotd status: not running"
-                log.message(message, log.INFO)
-                print(message)
-        else:
-                message = "robotd running pid " + str(pid)
-                log.message(message, log.INFO)
-                print(message)
-        return
+            self.statusWriter.start(self.statusRecord, status_interval)
+        except (IOError, OSError) as e:
+            log.message("Cannot write status file: " + str(e), log.WARNING)
+            self.statusWriter = None
+
+    # Daemon status as a list of (name, value)
+    def getStatus(self):
+        light = 'off'
+        if self.light_on:
+            light = 'on'
+        status = [('pid', os.getpid()),
+                ('arm', 'attached' if self.arm.isOpen() else 'detached'),
+                ('transfers', self.arm.transfers),
+                ('reconnects', self.arm.reconnects),
+                ('usb_timeouts', self.arm.timeouts),
+                ('usb_transfer_ms', "%.3f" % (self.arm.transferTime.mean()*1000)),
+                ('usb_transfer_max_ms', "%.3f" % (self.arm.transferTime.maximum*1000)),
+                ('transfers_posted', self.worker.sender.posted),
+                ('transfers_superseded', self.worker.sender.superseded),
+                ('transfers_failed', self.worker.sender.failures),
+                ('post_to_transfer_ms', "%.3f" % (self.worker.sender.latency.mean()*1000)),
+                ('light', light),
+                ('control_transfers', self.control.transfers),
+                ('control_saved', self.control.saved()),
+                ('control_overruns', self.control.overruns),
+                ('axis_events', self.axes.events),
+                ('axis_changes', self.axes.changes),
+                ('timing_steps', self.timer.steps),
+                ('timing_error_ms', "%.3f" % (self.timer.accuracy()[0]*1000)),
+                ('timing_jitter_ms', "%.3f" % (self.timer.accuracy()[1]*1000)),
+                ('limited', self.pose.limited)]
+        for name, angle in self.pose.pose():
+            status.append(('pose_' + name, "%.1f" % angle))
+        status.append(('jobs_queued', sum(worker.queued() for worker in self.workers)))
+        status.append(('jobs_running', sum(worker.running is not None for worker in self.workers)))
+        status.append(('job_wait_ms', "%.3f" % (self.worker.waitTime.mean()*1000)))
+        status.append(('job_wait_max_ms', "%.3f" % (self.worker.waitTime.maximum*1000)))
+        status.append(('job_preemptions', sum(worker.preemptions for worker in self.workers)))
+        status.append(('job_aborted', sum(worker.aborted for worker in self.workers)))
+        status.append(('job_cancelled', sum(worker.cancelled for worker in self.workers)))
+        status.append(('arms', len(self.workers)))
+        for worker in self.workers[1:]:
+            prefix = 'arm' + worker.name + '_'
+            status.append((prefix + 'port', worker.arm.port))
+            status.append((prefix + 'attached', worker.arm.isOpen()))
+            status.append((prefix + 'transfers', worker.arm.transfers))
+            status.append((prefix + 'programs', worker.programs))
+        if self.hotplug is not None:
+            for name in sorted(self.hotplug.attaches):
+                status.append((name + '_attached', self.hotplug.attaches[name]))
+                status.append((name + '_detached', self.hotplug.detaches[name]))
+        return status
+
+    # Is this a valid command for execute
+    def isCommand(self,cmd):
+        return cmd == 'wait' or cmd in table.byName
+
+    # Execute the commands in a file, returns None or an error message
+    # The whole file is checked before anything is sent to the arm. Its
+    # move-to instructions are planned from the pose of each arm when the
+    # arm comes to run it.
+    # target is an arm number or USB port, or all to run the file on every
+    # arm with the same start time (See targetWorkers). Files waiting for
+    # an arm are run highest priority first
+    def executeFile(self,commandfile,target=None,priority=0):
+        from script_class import ScriptError
+        workers = self.targetWorkers(target)
+        if workers is None:
+            return "No arm " + target
+        try:
+            program = self.compiler.compile(commandfile)
+        except (IOError, OSError) as e:
+            return "Cannot read " + commandfile + ": " + str(e)
+        except ScriptError as e:
+            return str(e)
+        print ("Execute " + commandfile + ": " + str(len(program)) + " steps")
+        log.message("Execute " + commandfile + " on " + str(len(workers)) + " arms", log.INFO)
+        for worker in workers:
+            if not worker.arm.open():
+                log.message("Couldn't talk to robot arm " + worker.name, log.ERROR)
+                return "Couldn't talk to robot arm " + worker.name
+        start = None
+        if len(workers) > 1:
+            start = time.monotonic() + sync_start_delay
+        plan = lambda program, pose: self.planProgram(commandfile, program, pose)
+        jobs = [worker.submit(program, start, priority, script_policy, plan=plan)
+                for worker in workers]
+        for job in jobs:
+            job.wait()
+        errors = [job.error for job in jobs if isinstance(job.error, ScriptError)]
+        if len(errors) > 0:
+            return str(errors[0])
+        for worker in workers:
+            log.message("Timing arm " + worker.name + " " + worker.timer.summary(), log.INFO)
+        if any(job.cancelled for job in jobs):
+            return "Cancelled " + commandfile
+        failed = [worker.name for worker, job in zip(workers, jobs) if not job.result]
+        if len(failed) > 0:
+            if any(job.preemptions > 0 for job in jobs):
+                return "Stopped by live input on arm " + ', '.join(failed)
+            return "Lost robot arm " + ', '.join(failed)
+        return None
+
+    # Cancel the commands files queued and running on the target arms,
+    # returns None or an error message
+    def cancelJobs(self,target=None):
+        workers = self.targetWorkers(target)
+        if workers is None:
+            return "No arm " + target
+        for worker in workers:
+            worker.cancel()
+        return None
+
+    # Set the estimated angles of the target arms back to the start up
+    # position, once the arms have been put back there. Returns None or
+    # an error message
+    def homeArms(self,target=None):
+        workers = self.targetWorkers(target)
+        if workers is None:
+            return "No arm " + target
+        for worker in workers:
+            for name in worker.pose.names:
+                worker.pose.setAngle(name, 0.0)
+            log.message("Arm " + worker.name + " set to its start up position", log.INFO)
+        return None
+
+    # Plan the move-to instructions of a program from the angles of a pose
+    # estimator, or from the start up position if there is not one
+    def planProgram(self,path,program,pose=None):
+        from script_class import ScriptError, OP_MOVETO
+        from pose_class import PoseEstimator
+        if OP_MOVETO not in program.ops:
+            return program
+        start = PoseEstimator(table, self.calibration.moves(), joint_limits)
+        if pose is not None:
+            for name, angle in pose.pose():
+                start.setAngle(name, angle)
+        # The arms may plan at the same time, the planner builds its grid
+        # when first used
+        with self.plannerLock:
+            if self.planner is None:
+                try:
+                    from ik_class import IKPlanner
+                except ImportError:
+                    raise ScriptError(path, [(program.lines[program.ops.index(OP_MOVETO)],
+                            "move-to needs NumPy: sudo apt install python3-numpy")])
+                self.planner = IKPlanner(arm_lengths, joint_home, joint_limits,
+                        ik_step, ik_tolerance)
+            return self.planner.expand(self.compiler, path, program, start)
+
+    # Check commands files without running them. Each is compiled and run
+    # on a virtual clock from the start up position to find moves that
+    # would pass a soft limit. Returns the number of files with errors
+    def validateFiles(self,files):
+        from script_class import ScriptError
+        from pose_class import PoseEstimator
+        failed = 0
+        for commandfile in files:
+            try:
+                program = self.compiler.compile(commandfile)
+            except (IOError, OSError) as e:
+                print ("Cannot read " + commandfile + ": " + str(e))
+                failed += 1
+                continue
+            except ScriptError as e:
+                print (e)
+                failed += 1
+                continue
+            try:
+                program = self.planProgram(commandfile, program)
+            except ScriptError as e:
+                print (e)
+                failed += 1
+                continue
+            pose = PoseEstimator(table, self.calibration.moves(), joint_limits)
+            problems = pose.check(program)
+            for line, joint, angle in problems:
+                print ("%s line %d: %s passes its limit (%.1f degrees)"
+                        % (commandfile, line, joint, angle))
+            if len(problems) > 0:
+                failed += 1
+            else:
+                print (commandfile + ": OK")
+        return failed
+
+    # Measure the speed of each joint in both directions. Each joint is
+    # jogged to one end stop then swept to the other and back while the
+    # time is taken. The soft limits are not used as the joint angles
+    # are not known until the arm has been calibrated
+    def calibrate(self):
+        import termios
+        import tty
+        if not self.checkComms():
+            return "Couldn't talk to the robot arm"
+        stop = table.byName['stop']
+        fd = sys.stdin.fileno()
+        old_settings = termios.tcgetattr(fd)
+        tty.setcbreak(sys.stdin)
+        try:
+            for joint, (up, down) in self.calibration.joints.items():
+                travel = joint_travel.get(joint)
+                if travel is None:
+                    continue
+                print ("Calibrate " + joint + " (" + str(travel) + " degrees)")
+                print ("Jog to the " + down + " end with u and d, Enter when there, s to skip")
+                key = self.jog(up, down)
+                if key == 's':
+                    continue
+                for cmd in (up, down):
+                    print ("Enter to start " + cmd + ", Enter again at the other end")
+                    while sys.stdin.read(1) != '\n':
+                        pass
+                    if not self.arm.transfer(table.byName[cmd]):
+                        return "USB communication error"
+                    start = time.monotonic()
+                    while sys.stdin.read(1) != '\n':
+                        pass
+                    self.arm.transfer(stop)
+                    seconds = time.monotonic() - start
+                    self.calibration.measure(cmd, travel, seconds)
+                    print ("%s %.2f degrees/s" % (cmd, self.calibration.speeds[cmd]))
+        finally:
+            self.arm.transfer(stop)
+            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+        self.calibration.save()
+        print ("Calibration saved in " + self.calibration.CalibrationFile)
+        return None
+
+    # Move a joint a little for each u or d key, returns Enter or s
+    def jog(self,up,down):
+        while True:
+            key = sys.stdin.read(1)
+            if key == '\n' or key == 's':
+                return key
+            if key == 'u' or key == 'd':
+                self.arm.transfer(table.byName[up if key == 'u' else down])
+                time.sleep(0.1)
+                self.arm.transfer(table.byName['stop'])
+
+    # Run a compiled program on the first arm (See ArmWorker.runProgram)
+    def runProgram(self,program):
+        return self.worker.runProgram(program)
+
+    # Run a program on the first arm as a job, after the file running on
+    # it and taken over by live input in the same way. Returns None or an
+    # error message
+    def runJob(self,program,what):
+        if not self.checkComms():
+            return "Couldn't talk to the robot arm"
+        job = self.worker.submit(program, policy=script_policy)
+        job.wait()
+        if job.cancelled:
+            return "Cancelled " + what
+        if not job.result:
+            if job.preemptions > 0:
+                return "Stopped by live input " + what
+            return "Lost robot arm " + what
+        return None
+
+    # Execute a command sent by a client (See ipc_class.py). Moves are
+    # queued with the first arm, returns None or an error message
+    def executeJob(self,t,cmd):
+        from script_class import Program
+        log.message("Execute " + cmd, log.DEBUG)
+        if "light" in cmd and self.control.running:
+            self.setLight(cmd == 'light-on')
+            return None
+        program = Program()
+        self.compiler.lower(program, (1, cmd, t))
+        return self.runJob(program, cmd)
 
     # Execute robot arm command
     def execute(self,t,cmd):
-        global commands
-
         print("execute " + cmd)
         log.message("Execute " + cmd, log.DEBUG)
 
-        try:
-            if cmd == 'wait':
-                    time.sleep(t)
-
-            #Check that we can send commands to the arm
-            elif self.checkComms():
-                if cmd == 'light-on':
-                    self.light_on = True
-                if cmd == 'light-off':
-                    self.light_on = False
-                self.sendCommand(self.rctl, commands[cmd])
-                if not "light" in cmd and t > 0:
-                    time.sleep(t) #Wait
-                    self.sendCommand(self.rctl,commands['stop'])
-                    return True
-                else:
-                    return False
+        if cmd == 'wait':
+                time.sleep(t)
 
-        except usb.core.USBError:
-            log.message("USB communication error.", log.ERROR)
-            return False
+        # With the control loop running the light is sent with the moves
+        # it is merging, sending it alone would stop them
+        elif "light" in cmd and self.control.running:
+            self.setLight(cmd == 'light-on')
 
-    # Checks that the arm is connected and we can talk to it
-    def checkComms(self):
-        #Object to talk to the robot
-        self.rctl = usb.core.find(idVendor=usb_vendor_id, idProduct=usb_prod_id)
+        #Check that we can send commands to the arm
+        elif self.checkComms():
+            if cmd == 'light-on':
+                self.light_on = True
+            if cmd == 'light-off':
+                self.light_on = False
+            if "light" in cmd:
+                self.recordLight()
+            if "light" in cmd or t <= 0:
+                self.sendCommand(table.byName[cmd])
+                return False
+            # Run for t seconds against a deadline. Commands from clients
+            # are the keyboard (See robot.py) so record them as such
+            if self.recorder is not None:
+                self.recorder.record('keyboard', table.byName[cmd])
+            # Stop at a soft limit if it is reached first
+            left = self.pose.timeLeft(table.byName[cmd])
+            if left is not None and left < t:
+                log.message(cmd + " stopped at its limit after " + "%.3f" % left + "s", log.INFO)
+                t = left
+            moved = self.moveTimer.move(self.sendCommand, table.byName[cmd],
+                    table.byName['stop'], t) is not None
+            if self.recorder is not None:
+                self.recorder.record('keyboard', table.byName['stop'])
+            return moved
+
+    # Start recording the live inputs to a file, returns None or an error message
+    def startRecording(self,path):
+        from record_class import Recorder
+        self.stopRecording()
         try:
-            if self.rctl != None:
-                    return True
-            else:
-                    log.message("Couldn't talk to the robot arm.", log.ERROR)
-                    return False
+            recorder = Recorder(path, table.byName['stop'])
+        except (IOError, OSError) as e:
+            return "Cannot record to " + path + ": " + str(e)
+
+        # Start with what the inputs want now
+        with self.control.lock:
+            sources = list(self.control.sources.items())
+        for source, payload in sources:
+            recorder.record(source, payload)
+        self.recorder = recorder
+        self.recordLight()
+        self.control.recorder = recorder
+        log.message("Recording to " + path, log.INFO)
+        return None
+
+    # Stop recording, returns None
+    def stopRecording(self):
+        recorder = self.recorder
+        if recorder is not None:
+            self.control.recorder = None
+            self.recorder = None
+            recorder.close()
+            log.message("Recorded " + str(recorder.records) + " changes to "
+                    + recorder.path, log.INFO)
+        return None
+
+    # Replay a recording with its original timing, returns None or an error message
+    def replay(self,path):
+        import record_class
+        try:
+            records = record_class.load(path, table)
+        except (IOError, OSError) as e:
+            return "Cannot read " + path + ": " + str(e)
+        except record_class.RecordError as e:
+            return str(e)
+        program = record_class.toProgram(table, records)
+        print ("Replay " + path + ": " + str(len(program)) + " steps")
+        log.message("Replay " + path, log.INFO)
+        if len(program) == 0:
+            return None
+        error = self.runJob(program, path)
+        log.message("Timing " + self.timer.summary(), log.INFO)
+        # The live inputs take over again on the next control loop tick
+        self.control.touch()
+        return error
 
-        except usb.core.USBError:
-            log.message( "USB communication error.", log.ERROR)
+    # Checks that the arm is connected and we can talk to it
+    # The bus is only searched if the device handle is not already open
+    def checkComms(self):
+        if self.arm.open():
+            return True
+        else:
+            log.message("Couldn't talk to the robot arm.", log.ERROR)
             return False
 
-    # Send a command to the Robot arm
-    def sendCommand(self,rctl,cmd):
-        connected = False
-        sCommand = self.getKey(cmd)
-        if sCommand == None:
-            sCommand = "Joystick"
-        #pdb.set_trace()
-        log.message("sendCommand " + str(sCommand) + ' ' + str(cmd), log.DEBUG)
-        if self.checkComms():
-            if self.light_on:
-                l = list(cmd)   # Convert to a list
-                l[2] = 1
-                cmd = tuple(l)  # Convert back to tuple
-            rctl.ctrl_transfer(0x40,6,0x100,0,cmd,1000) 
-            connected = True
-        return connected
+    # Send a command to the first arm
+    # The command is a payload from the command table
+    def sendCommand(self,cmd):
+        return self.worker.sendCommand(cmd)
+
+    # Post a command to the first arm without waiting for the transfer
+    def postCommand(self,cmd):
+        return self.worker.postCommand(cmd)
+
+    # Mask off joints that have reached their soft limits
+    def limitCommand(self,cmd):
+        return self.pose.limit(cmd)
+
+    # Stop any joint that reaches its soft limit before the deadline
+    # when it gets there
+    def stopAtLimits(self,deadline):
+        self.worker.stopAtLimits(deadline)
+
+    # Send a payload at a deadline (See MotionTimer.sendAt)
+    def sendAt(self,deadline,cmd):
+        return self.worker.sendAt(deadline, cmd)
+
+    # A worker for an arm
+    def newWorker(self,name,arm):
+        from pose_class import PoseEstimator
+        from worker_class import ArmWorker
+        pose = PoseEstimator(table, self.calibration.moves(), joint_limits)
+        worker = ArmWorker(name, arm, pose, table)
+        worker.resumeDelay = script_resume_delay
+        return worker
+
+    # The worker for the arm plugged into a port. A port not seen before
+    # is taken by the first arm if it has no port yet, otherwise a new
+    # worker is added for it
+    def armWorker(self,port):
+        from usb_class import UsbArm
+        for worker in self.workers:
+            if worker.arm.port == port:
+                return worker
+        if self.worker.arm.port is None:
+            self.worker.arm.port = port
+            return self.worker
+        arm = UsbArm(usb_vendor_id, usb_prod_id, self.worker.arm.backend, port)
+        worker = self.newWorker(str(len(self.workers) + 1), arm)
+        self.workers.append(worker)
+        log.message("Arm " + worker.name + " on USB port " + port, log.INFO)
+        return worker
+
+    # Give every arm on the bus a worker
+    def findArms(self):
+        for port in self.worker.arm.findPorts():
+            self.armWorker(port)
+        return len(self.workers)
+
+    # Workers for a target given to execute: None for the first arm,
+    # all or an arm number or USB port. Returns None if there is no such arm
+    def targetWorkers(self,target=None):
+        if target is None:
+            return [self.worker]
+        if target == 'all':
+            return list(self.workers)
+        for worker in self.workers:
+            if target == worker.name or target == worker.arm.port:
+                return [worker]
+        return None
+
+    # Log the latency histograms if there are new samples
+    def reportLatency(self,force=False):
+        now = time.monotonic()
+        control = self.control
+        count = control.latency.count + control.stopLatency.count
+        if count == self.latencyReported:
+            return
+        if force or now - self.latencyReportTime >= latency_report_interval:
+            log.message("Control " + control.summary(), log.INFO)
+            log.message("Latency " + control.latency.summary(), log.INFO)
+            log.message("Latency " + control.stopLatency.summary(), log.INFO)
+            log.message("Latency " + control.jitter.summary(), log.INFO)
+            log.message("Transfers " + self.worker.sender.summary(), log.INFO)
+            log.message("Latency " + self.arm.transferTime.summary(), log.INFO)
+            self.latencyReported = count
+            self.latencyReportTime = now
 
     # Get key (command) by value
     def getKey(self,val):
-        key = None
-        for keyx, value in commands.items():
-             if val == value:
-                 key = keyx
-        return key
+        return table.name(val)
                 
-    # Initialise the JoyStick
+    # Open the JoyStick. If there is not one wait for the hotplug
+    # watcher to say that one has been plugged in
     def initJoyStick(self):
-        # Wait for a joystick
-        while pygame.joystick.get_count() == 0:
-            count = pygame.joystick.get_count()
-            log.message("Waiting for joystick count = " + str(count), log.DEBUG)
-            time.sleep(10)
-            pygame.joystick.quit()
-            pygame.joystick.init()
-
-        joystick = pygame.joystick.Joystick(0)
-        joystick.init()
-        return joystick
+        from input_class import openInput
+        waiting = False
+        while True:
+            self.joystickPlugged.clear()
+            try:
+                joystick = openInput(input_backend)
+                log.message('Initialized Joystick :' + joystick.name(), log.INFO)
+                return joystick
+            except (IOError, OSError) as e:
+                if not waiting:
+                    log.message("Waiting for joystick: " + str(e), log.INFO)
+                    waiting = True
+            # Wake up once a second so that signals are handled
+            while not self.joystickPlugged.wait(1.0):
+                self.reportLatency()
+
+    # Hotplug handlers, called by the hotplug watcher thread. The last
+    # part of the device path is the USB port (See usb_class.devicePort)
+    def armAttached(self,event):
+        worker = self.armWorker(os.path.basename(event.devpath))
+        worker.arm.hotplug(True)
+        if worker.arm.open():
+            log.message('Arm ' + worker.name + ' attached', log.INFO)
+            # The arm starts stopped so send it the current command again
+            if worker is self.worker:
+                self.control.touch()
+
+    def armDetached(self,event):
+        port = os.path.basename(event.devpath)
+        for worker in self.workers:
+            if worker.arm.port == port or worker.arm.port is None:
+                worker.arm.hotplug(False)
+                log.message('Arm ' + worker.name + ' detached', log.INFO)
+                return
+
+    # A lost joystick is noticed by the run loop when reading it fails
+    def joystickAttached(self,event):
+        self.joystickPlugged.set()
+
+    # Watch for the arm and joystick being plugged in and out
+    def startHotplug(self,source=None):
+        from hotplug_class import HotplugWatcher, openSource, usbMatch, joystickMatch
+        if source is None:
+            source = openSource(hotplug_poll_interval)
+        self.hotplug = HotplugWatcher(source)
+        self.hotplug.watch('arm', usbMatch(usb_vendor_id, usb_prod_id),
+                self.armAttached, self.armDetached)
+        self.hotplug.watch('joystick', joystickMatch, self.joystickAttached, None)
+        self.hotplug.start()
 
     # Setup GPIO to to handle switches
     def setupSwitches(self):
+        GPIO = self.gpio
         GPIO.setmode(GPIO.BOARD)
         GPIO.setwarnings(False)
-        GPIO.setup(BASE_CLOCKWISE,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(BASE_ANTI_CLOCKWISE,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(SHOULDER_UP,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(SHOULDER_DOWN,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(ELBOW_UP,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(ELBOW_DOWN,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(WRIST_UP,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(WRIST_DOWN,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(GRIP_OPEN,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(GRIP_CLOSE,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(LIGHT_ON,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(LIGHT_OFF,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-
-        # Set up switch event processing
-        t = 200
-        GPIO.add_event_detect(BASE_CLOCKWISE,  GPIO.RISING, callback=self.switch_event, bouncetime=t)
-        GPIO.add_event_detect(BASE_ANTI_CLOCKWISE, GPIO.RISING, callback=self.switch_event, bouncetime=t)
-        GPIO.add_event_detect(SHOULDER_UP,   GPIO.RISING, callback=self.switch_event, bouncetime=t)
-        GPIO.add_event_detect(SHOULDER_DOWN, GPIO.RISING, callback=self.switch_event, bouncetime=t)
-        GPIO.add_event_detect(ELBOW_UP,   GPIO.RISING, callback=self.switch_event, bouncetime=t)
-        GPIO.add_event_detect(ELBOW_DOWN, GPIO.RISING, callback=self.switch_event, bouncetime=t)
-        GPIO.add_event_detect(WRIST_UP,   GPIO.RISING, callback=self.switch_event, bouncetime=t)
-        GPIO.add_event_detect(WRIST_DOWN, GPIO.RISING, callback=self.switch_event, bouncetime=t)
-        GPIO.add_event_detect(GRIP_OPEN,  GPIO.RISING, callback=self.switch_event, bouncetime=t)
-        GPIO.add_event_detect(GRIP_CLOSE, GPIO.RISING, callback=self.switch_event, bouncetime=t)
-        GPIO.add_event_detect(LIGHT_ON,  GPIO.RISING, callback=self.switch_event, bouncetime=t)
-        GPIO.add_event_detect(LIGHT_OFF, GPIO.RISING, callback=self.switch_event, bouncetime=t)
+
+        # Set up switch event processing on both the press and release
+        for switch in switchMap:
+            GPIO.setup(switch,GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+            GPIO.add_event_detect(switch, GPIO.BOTH, callback=self.switch_event,
+                    bouncetime=switch_bouncetime)
         return
 
     # Call back routine called by switch events (GPIO event)
+    # Each switch has its own bits so pressing sets them and releasing
+    # clears them. Several switches held at once combine into one command
     def switch_event(self,switch):
-        global commands
-        log.message("Switch event " + str(switch), log.DEBUG)
-        if switch == BASE_CLOCKWISE:
-            cmd = commands['base-clockwise']
-        elif switch == BASE_ANTI_CLOCKWISE:
-            cmd = commands['base-anti-clockwise']
-        elif switch == SHOULDER_UP:
-            cmd = commands['shoulder-up']
-        elif switch == SHOULDER_DOWN:
-            cmd = commands['shoulder-down']
-        elif switch == ELBOW_UP:
-            cmd = commands['elbow-up']
-        elif switch == ELBOW_DOWN:
-            cmd = commands['elbow-down']
-        elif switch == GRIP_CLOSE:
-            cmd = commands['grip-close']
-        elif switch == GRIP_OPEN:
-            cmd = commands['grip-open']
-        elif switch == WRIST_UP:
-            cmd = commands['wrist-up']
-        elif switch == WRIST_DOWN:
-            cmd = commands['wrist-down']
-        elif switch == LIGHT_ON:
-            self.light_on = True
-            cmd = commands['light-on']
-        elif switch == LIGHT_OFF:
-            self.light_on = False
-            cmd = commands['light-off']
-        else:
+        now = time.monotonic()
+        entry = table.lookup(table.SWITCH, switch)
+        if entry is None:
             log.message("Switch event not recognised " + str(switch), log.ERROR)
-
-        if cmd != '':
-            self.sendCommand(self.rctl, cmd)
-
-            switchdown = GPIO.input(switch)
-            while switchdown:
-                time.sleep(0.1)
-                switchdown = GPIO.input(switch)
-
-            if self.light_on:
-                self.sendCommand(self.rctl, commands['light-on'])
+            return
+        cmd, bits = entry
+
+        pressed = self.gpio.input(switch)
+        if log.level == log.DEBUG:
+            log.message("Switch event " + str(switch) + " " + str(pressed), log.DEBUG)
+        if cmd == 'light-on' or cmd == 'light-off':
+            if pressed:
+                self.setLight(cmd == 'light-on', now)
+            return
+
+        with self.switchLock:
+            if pressed:
+                self.switchArm |= bits[0]
+                self.switchBase |= bits[1]
             else:
-                self.sendCommand(self.rctl, commands['stop'])
-
-    # Display list of keyboard commands
-    def displayKeys(self):
-        global keyMap
-        print ("Key Command")
-        print ("--- -------")
-        for key in keyMap:
-            print (key + "   " + keyMap[key])
-        print  ("x   Exit program")
-        print ("Enter command: ")
-        return
-
-    # Handle key events
-    def key_event(self):
-        self.displayKeys()
-        fd = sys.stdin.fileno()
-        old_settings = termios.tcgetattr(fd)
-        tty.setcbreak(sys.stdin)
-
-        t = 0.1
-        while True:
-            key = sys.stdin.read(1)
-
-            if key ==  'x':
-                termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
-                sys.exit(0)
-
-            else:
-                try:
-                    cmd = keyMap[key]
-                    log.message("key " + key + " cmd = " + cmd, log.INFO)
-                    self.execute(t,cmd)
-                except:
-                    self.displayKeys()
-        return
-
+                self.switchArm &= ~bits[0]
+                self.switchBase &= ~bits[1]
+            payload = table.payload(self.switchArm, self.switchBase, 0)
+        self.control.set('switches', payload, now, not pressed)
+
+        # Catch a release, or a press, dropped within the bounce time
+        check = threading.Timer(switch_bouncetime / 1000.0 + 0.005, self.switchCheck,
+                (switch, pressed))
+        check.daemon = True
+        check.start()
+
+    # Handle a switch again if it has changed since switch_event read it
+    def switchCheck(self,switch,pressed):
+        if self.gpio.input(switch) != pressed:
+            self.switch_event(switch)
+
+    # Hold move keys down to move the arm (See keyboard_class.py). The
+    # moves are sent by client if given, a RobotClient, else by this robot
+    def key_event(self,client=None):
+        from keyboard_class import runKeyboard
+        if client is None:
+            self.control.start()
+            client = self
+        try:
+            runKeyboard(keyMap, client, key_repeat_delay)
+        finally:
+            if client is self:
+                self.stopLive()
+        sys.exit(0)
+
+    # Stop the control loop and then the first arm, waiting for the stop
+    # to be sent. The threads that send the live inputs are daemon threads
+    # so would otherwise die at exit with the arm still moving
+    def stopLive(self):
+        self.control.stop()
+        self.worker.sender.stop()
+        self.sendCommand(table.byName['stop'])
+
+    # Move the joints of a list of commands until hold is called again,
+    # through the control loop. hold([]) stops them
+    def hold(self,cmds,eventTime=None):
+        payload = table.merge([table.byName[cmd] for cmd in cmds])
+        released = len(cmds) < self.keysHeld
+        self.keysHeld = len(cmds)
+        self.control.set('keyboard', payload, eventTime, released)
 
     # Routine called by the start command
     def run(self):
@@ -459,45 +1100,55 @@ class Robot(Daemon):
         signal.signal(signal.SIGTERM,self.signalHandler)
         signal.signal(signal.SIGHUP,self.signalHandler)
         log.message('Robot daemon running pid ' + str(os.getpid()), log.INFO)
-        pygame.init()
 
-        # Initialise joystick
-        joystick = self.initJoyStick()
-        if joystick != None:
-            log.message('Initialized Joystick :' + joystick.get_name(),log.INFO)
-        else:
-            log.message('No Joystick found!',log.INFO)
+        # Accept commands from command line clients
+        from ipc_class import RobotServer
+        self.server = RobotServer(self)
+        self.server.start()
+
+        # The arm and joystick are used as soon as they are plugged in
+        self.startHotplug()
+        if self.findArms() > 1:
+            log.message(str(len(self.workers)) + ' arms found', log.INFO)
+        if not self.arm.open():
+            log.message('Arm not found. Waiting for it to be plugged in', log.INFO)
 
         # Set up switches interface
-        self.setupSwitches()
+        if self.gpio is None:
+            self.gpio = loadGPIO()
+        if self.gpio is not None:
+            self.setupSwitches()
+        else:
+            log.message('No GPIO interface, switches disabled', log.INFO)
 
-        armFound = False
-        while not armFound: 
-            self.rctl = usb.core.find(idVendor=usb_vendor_id, idProduct=usb_prod_id)
+        # Start merging the live inputs
+        self.control.start()
+        self.startStatus()
 
-            if self.rctl is None:
-                log.message('Arm not found. Waiting', log.INFO)
-                time.sleep(10)
-            else:
-                armFound = True
-
-        #this arm should just have one configuration...
-        self.rctl.set_configuration()
+        # Initialise joystick
+        self.joystick = self.initJoyStick()
 
         log.message('Listening for commands', log.DEBUG)
         try:
-            # Loop forwever
+            # Loop forwever, blocking until the next events arrive. The wait
+            # times out once a second even when idle so signals are handled
             while True:
-                # Sleep so we don't eat up all the CPU time
-                time.sleep(0.1)
-
-                # read in events and process
-                events = pygame.event.get()
-                
+                try:
+                    events = self.joystick.wait(1.0)
+                except (IOError, OSError) as e:
+                    # Stop anything the joystick was moving and wait for it again
+                    log.message("Joystick lost: " + str(e), log.ERROR)
+                    self.joystick.close()
+                    self.axes.reset()
+                    self.control.set('joystick', table.byName['stop'], released=True)
+                    self.joystick = self.initJoyStick()
+                    continue
                 for event in events:
-                    self.handleEvent(event) 
+                    self.handleEvent(event)
+                self.reportLatency()
             
         except KeyboardInterrupt:
+            self.reportLatency(force=True)
             sys.exit(0)
             #joystick.quit()
             
@@ -510,7 +1161,37 @@ if __name__ == "__main__":
         print ("This program must be run with sudo or root permissions!")
         sys.exit(1)
 
-    daemon = Robot('/var/run/robotd.pid')
+    # The version and the status of a running daemon need nothing else
+    if sys.argv[1:] == ['version']:
+        print ("Version", _version)
+        sys.exit(0)
+    if sys.argv[1:] == ['status']:
+        from status_class import readStatus, isRunning, formatStatus
+        status = readStatus()
+        if status is not None and isRunning(status):
+            print ("robotd status: " + formatStatus(status))
+            sys.exit(0)
+        client = RobotClient()
+        if client.connect():
+            print ("robotd status: " + client.request("STATUS"))
+            sys.exit(0)
+        printStatus(PidFile)
+        sys.exit(0)
+
+    # Cancel the commands files the daemon is running, or tell it the arms
+    # are back in their start up position
+    if len(sys.argv) in (2, 3) and sys.argv[1] in ('cancel', 'home'):
+        client = RobotClient()
+        if not client.connect():
+            print ("robotd is not running")
+            sys.exit(1)
+        error = client.request(' '.join([sys.argv[1].upper()] + sys.argv[2:]))
+        if error != "OK":
+            print (error)
+            sys.exit(1)
+        sys.exit(0)
+
+    daemon = Robot(PidFile)
     robot = daemon
     log.init("robot")
 
@@ -528,48 +1209,110 @@ if __name__ == "__main__":
                 daemon.restart()
             elif cmd == 'status':
                 daemon.status()
-            elif cmd == 'version':
-                print ("Version", _version)
+            elif cmd == 'calibrate':
+                # The arm is driven directly so the daemon must be stopped
+                if RobotClient().connect():
+                    print ("Stop robotd before calibrating the arm")
+                    sys.exit(1)
+                error = robot.calibrate()
+                if error is not None:
+                    print (error)
+                    sys.exit(1)
             elif cmd == 'keyboard':
-                robot.key_event()
+                # Use the running daemon if there is one
+                client = RobotClient()
+                if client.connect():
+                    robot.key_event(client)
+                else:
+                    robot.key_event()
 
         # Robot arm commands
         elif len(sys.argv) >= 3:
             message =  "Command " + cmd + " " + sys.argv[2]
             log.message(message, log.INFO)
             # Handle commands input file
-            if cmd == 'execute':
+            if cmd == 'execute' and len(sys.argv) <= 6:
                 commandfile =  sys.argv[2]
-                commandsfile = open(commandfile, "r")
-                command_list = commandsfile.readlines()
-                commandsfile.close()
-                line = 1
-                for command in command_list:
-                    command = command.rstrip()
-                    command = " ".join(command.split())
-                    if len(command) < 1:
-                        continue
-                    log.message(command, log.INFO)
-                    cmds = command.split(' ')
-                    cmd = cmds[0]
-
+                args = sys.argv[3:]
+                priority = 0
+                if len(args) >= 2 and args[-2] == 'priority':
                     try:
-                        t = float(cmds[1])
-                    except IndexError:
-                        print ("Invalid or missing time: " + cmd + " in " + commandfile)
-                        break
-
-                    try:
-                        # Check the command is valid
-                        print ("Command " + str(line) + ": " + command)
-                        if cmd != 'wait':
-                            x = commands[cmd]
-                        robot.execute(t, cmd)
-                        line = line + 1
-
-                    except KeyError:
-                        print ("Invalid command: " + cmd + " in " + commandfile)
-                        break
+                        priority = int(args[-1])
+                    except ValueError:
+                        print ("Invalid priority " + args[-1])
+                        sys.exit(2)
+                    args = args[:-2]
+                target = None
+                if len(args) > 0:
+                    target = args[0]
+                # Pass the file to the running daemon if there is one
+                client = RobotClient()
+                if client.connect():
+                    request = "RUN " + os.path.abspath(commandfile)
+                    if target is not None:
+                        request += " " + target
+                    if priority != 0:
+                        request += " PRIORITY " + str(priority)
+                    error = client.request(request)
+                    if error == "OK":
+                        error = None
+                else:
+                    robot.findArms()
+                    error = robot.executeFile(commandfile, target, priority)
+                if error is not None:
+                    print (error)
+                    sys.exit(1)
+            # Check commands files against the soft limits
+            elif cmd == 'validate':
+                if robot.validateFiles(sys.argv[2:]) > 0:
+                    sys.exit(1)
+            # Record the live inputs of the running daemon
+            elif cmd == 'record':
+                client = RobotClient()
+                if not client.connect():
+                    print ("robotd is not running")
+                    sys.exit(1)
+                path = sys.argv[2]
+                if path != 'off':
+                    path = os.path.abspath(path)
+                reply = client.request("RECORD " + path)
+                if reply != "OK":
+                    print (reply)
+                    sys.exit(1)
+            # Replay a recording
+            elif cmd == 'replay':
+                recording = sys.argv[2]
+                client = RobotClient()
+                if client.connect():
+                    error = client.request("REPLAY " + os.path.abspath(recording))
+                    if error == "OK":
+                        error = None
+                else:
+                    error = robot.replay(recording)
+                if error is not None:
+                    print (error)
+                    sys.exit(1)
+            # Convert a recording to a commands file
+            elif cmd == 'to-script':
+                import record_class
+                try:
+                    records = record_class.load(sys.argv[2], table)
+                except (IOError, OSError, record_class.RecordError) as e:
+                    print (e)
+                    sys.exit(1)
+                for line in record_class.toScript(table, records):
+                    print (line)
+            # Convert a commands file to a recording
+            elif cmd == 'to-recording' and len(sys.argv) == 4:
+                import record_class
+                from script_class import ScriptError
+                try:
+                    program = robot.compiler.compile(sys.argv[2])
+                    program = robot.planProgram(sys.argv[2], program)
+                    record_class.save(sys.argv[3], record_class.fromProgram(table, program))
+                except (IOError, OSError, ScriptError) as e:
+                    print (e)
+                    sys.exit(1)
             else:
                 message = "Unknown command: " + sys.argv[1]
                 print (message)
@@ -580,7 +1323,15 @@ if __name__ == "__main__":
     else:
         print ("Usage: %s start|stop|restart|status|version|nodaemon|<command>" % sys.argv[0])
         print ("Commands: keyboard - Use keyboard")
-        print ("          execute <file>  - Execute commands in <file>")
+        print ("          execute <file> [<arm>|all] [priority <n>] - Execute commands in <file>")
+        print ("          cancel [<arm>|all] - Cancel the commands files robotd is running")
+        print ("          home [<arm>|all] - The arms are back where they were at start up")
+        print ("          validate <file>... - Check commands files against the joint limits")
+        print ("          calibrate       - Measure the joint speeds")
+        print ("          record <file>|off - Record the joystick, switches and keyboard")
+        print ("          replay <file>   - Replay a recording")
+        print ("          to-script <recording> - Print a recording as commands")
+        print ("          to-recording <file> <recording> - Convert commands to a recording")
         sys.exit(2)
 
 # End of class
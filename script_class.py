@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Motion script compiler
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# A commands file is parsed and checked in full before anything is sent
+# to the arm and is then lowered to a list of instructions, each being
+# an opcode, a 3 byte payload and a duration. Compiled scripts are
+# cached on disk by path, size and modification time and are compiled
+# again if the command table changes.
+#
+# Moves of different joints can be run at the same time in a parallel
+# block, either on one line or over several lines:
+#
+#   parallel { elbow-up 0.6; wrist-down 0.5 }
+#
+#   parallel {
+#       base-clockwise 1
+#       shoulder-up 0.4
+#   }
+#
+# The moves start together and each joint is stopped when its own time
+# is up, so the block takes as long as its longest move.
+#
+# A joint move can be given as an angle instead of a time, for example
+# "shoulder-up 15deg". The angle is turned into a time with the speeds in
+# the calibration (See calibration_class.py).
+#
+# "move-to x y z" moves the grip to a point in millimetres from the base.
+# It is planned when the program is run as the joint moves depend on
+# where the arm is at the time (See ik_class.py).
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import os
+import zlib
+import array
+import struct
+
+from log_class import Log
+from command_class import JOINTS
+
+log = Log()
+
+# Instruction opcodes
+OP_SEND = 1         # Send the payload (the light bit is added when run)
+OP_WAIT = 2         # Wait for the duration
+OP_LIGHT = 3        # Light on or off (payload byte 2)
+OP_MOVETO = 4       # Move to the point numbered by the duration (See Program.target)
+
+# A compile error, holds a list of (line number, message)
+class ScriptError(Exception):
+
+    def __init__(self,path,errors):
+        self.path = path
+        self.errors = errors
+        Exception.__init__(self, '\n'.join("%s line %d: %s" % (path, line, msg)
+                for line, msg in errors))
+
+# A compiled script as parallel arrays of opcode, payload, duration
+# and source line number
+class Program:
+
+    def __init__(self):
+        self.ops = array.array('B')
+        self.payloads = []
+        self.durations = array.array('d')
+        self.lines = array.array('I')
+        self.targets = array.array('d')     # x, y, z of each move-to
+
+    # A send straight after another send replaces it, so a stop followed
+    # by the next move becomes a single transfer
+    def append(self,op,payload,duration,line):
+        if op == OP_SEND and len(self.ops) > 0 and self.ops[-1] == OP_SEND:
+            self.payloads[-1] = payload
+            self.lines[-1] = line
+            return
+        self.ops.append(op)
+        self.payloads.append(payload)
+        self.durations.append(duration)
+        self.lines.append(line)
+
+    def __len__(self):
+        return len(self.ops)
+
+    # Point (x, y, z) of a move-to instruction
+    def target(self,index):
+        n = int(self.durations[index]) * 3
+        return tuple(self.targets[n:n + 3])
+
+    # Total time taken by the waits in seconds
+    def duration(self):
+        total = 0.0
+        for op, t in zip(self.ops, self.durations):
+            if op == OP_WAIT:
+                total += t
+        return total
+
+class ScriptCompiler:
+
+    CacheDir = Log.RobotLibDir + "/cache"
+    MAGIC = b'RSC3'
+    HEADER = struct.Struct('<4sqqIII')      # magic, mtime ns, size, signature, count, points
+
+    # The cache holds the program arrays one after the other, the
+    # payloads are stored as their index in the command table, followed
+    # by the move-to points
+    ARRAYS = (('ops','B'), ('payloads','H'), ('durations','d'), ('lines','I'))
+
+    def __init__(self,table,cachedir=None,calibration=None):
+        self.table = table
+        self.calibration = calibration
+        if cachedir is not None:
+            self.CacheDir = cachedir
+        self.hits = 0
+        self.misses = 0
+
+    # Cached programs are compiled again if the commands or speeds change
+    def signature(self):
+        if self.calibration is None:
+            return self.table.signature
+        return zlib.crc32(struct.pack('<II', self.table.signature, self.calibration.signature))
+
+    # Compile a script file, using the cached copy if it is up to date
+    def compile(self,path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        cachefile = self.cacheFile(path)
+        program = self.load(cachefile, st)
+        if program is not None:
+            self.hits += 1
+            return program
+
+        self.misses += 1
+        with open(path, "r") as f:
+            program = self.compileLines(path, f)
+        self.save(cachefile, st, program)
+        return program
+
+    # Parse and check every line then lower them to instructions
+    def compileLines(self,path,lines):
+        errors = []
+        steps = []
+        block = None        # Open parallel block (line, [(line, words)])
+        lineNumber = 0
+        for text in lines:
+            lineNumber += 1
+            text = text.split('#', 1)[0]
+            if block is None:
+                words = text.split()
+                if len(words) == 0:
+                    continue
+                if not words[0].startswith('parallel'):
+                    step = self.parseLine(words, lineNumber, errors)
+                    if step is not None:
+                        steps.append(step)
+                    continue
+
+                # Start of a parallel block
+                text = text.strip()[len('parallel'):].lstrip()
+                if not text.startswith('{'):
+                    errors.append((lineNumber, "Expected { after parallel"))
+                    continue
+                block = (lineNumber, [])
+                text = text[1:]
+
+            # Inside a parallel block, moves are separated by ; or new lines
+            closed = '}' in text
+            if closed:
+                text, rest = text.split('}', 1)
+                if len(rest.strip()) > 0:
+                    errors.append((lineNumber, "Unexpected text after }: " + rest.strip()))
+            for statement in text.split(';'):
+                words = statement.split()
+                if len(words) > 0:
+                    block[1].append((lineNumber, words))
+            if closed:
+                step = self.parseBlock(block, errors)
+                if step is not None:
+                    steps.append(step)
+                block = None
+
+        if block is not None:
+            errors.append((block[0], "Missing } for parallel"))
+            self.parseBlock(block, errors)
+
+        if len(errors) > 0:
+            raise ScriptError(path, errors)
+
+        program = Program()
+        for step in steps:
+            if step[1] == 'parallel':
+                self.lowerParallel(program, step)
+            else:
+                self.lower(program, step)
+        return program
+
+    # Parse one command line into (line, command, time) or
+    # (line, 'move-to', (x, y, z))
+    def parseLine(self,words,line,errors):
+        cmd = words[0]
+        if cmd == 'move-to':
+            try:
+                if len(words) == 4:
+                    return (line, cmd, tuple(map(float, words[1:])))
+            except ValueError:
+                pass
+            errors.append((line, "Expected move-to <x> <y> <z>: " + ' '.join(words)))
+            return None
+        if len(words) != 2:
+            errors.append((line, "Expected <command> <time>: " + ' '.join(words)))
+            return None
+        degrees = words[1].endswith('deg')
+        try:
+            if degrees:
+                t = float(words[1][:-3])
+            else:
+                t = float(words[1])
+        except ValueError:
+            errors.append((line, "Invalid time: " + words[1]))
+            return None
+        if cmd != 'wait' and cmd not in self.table.byName:
+            errors.append((line, "Invalid command: " + cmd))
+            return None
+        if cmd == 'wait' and t < 0:
+            errors.append((line, "Invalid wait time: " + words[1]))
+            return None
+        if degrees:
+            duration = None
+            if self.calibration is not None and t >= 0:
+                duration = self.calibration.duration(cmd, t)
+            if duration is None:
+                errors.append((line, "An angle can only be given for a joint move: "
+                        + ' '.join(words)))
+                return None
+            t = duration
+        return (line, cmd, t)
+
+    # Parse the moves of a parallel block into (line, 'parallel', moves)
+    # where moves is a list of (command, time). A parallel block may only
+    # move each joint once and only timed joint moves are allowed
+    def parseBlock(self,block,errors):
+        start, statements = block
+        moves = []
+        used = {}
+        failed = False
+        for line, words in statements:
+            step = self.parseLine(words, line, errors)
+            if step is None:
+                failed = True
+                continue
+            cmd, t = step[1], step[2]
+            joint = self.joint(cmd)
+            if joint is None or t <= 0:
+                errors.append((line, "Only timed joint moves are allowed in parallel: "
+                        + ' '.join(words)))
+                failed = True
+            elif joint in used:
+                errors.append((line, "The " + joint + " is already moved by "
+                        + used[joint] + " in this parallel block"))
+                failed = True
+            else:
+                used[joint] = cmd
+                moves.append((cmd, t))
+        if len(statements) == 0:
+            errors.append((start, "Empty parallel block"))
+            failed = True
+        if failed:
+            return None
+        return (start, 'parallel', moves)
+
+    # The joint moved by a command or None
+    def joint(self,cmd):
+        payload = self.table.byName.get(cmd)
+        if payload is None:
+            return None
+        for name, armBits, baseBits in JOINTS:
+            if payload[0] & armBits or payload[1] & baseBits:
+                return name
+        return None
+
+    # Lower a parallel block to a timeline of merged bitmask transfers.
+    # All moves start together and each is removed from the bitmask as
+    # its time runs out
+    def lowerParallel(self,program,step):
+        line, name, moves = step
+        byName = self.table.byName
+        ends = sorted(set(t for cmd, t in moves))
+        now = 0.0
+        for end in [0.0] + ends:
+            if end > now:
+                program.append(OP_WAIT, byName['stop'], end - now, line)
+                now = end
+            arm = 0
+            base = 0
+            for cmd, t in moves:
+                if t > now:
+                    payload = byName[cmd]
+                    arm |= payload[0]
+                    base |= payload[1]
+            program.append(OP_SEND, self.table.payload(arm, base, 0), 0.0, line)
+
+    # Lower a command to instructions in the same way as Robot.execute
+    def lower(self,program,step):
+        line, cmd, t = step
+        byName = self.table.byName
+        stop = byName['stop']
+        if cmd == 'wait':
+            program.append(OP_WAIT, stop, t, line)
+        elif cmd == 'move-to':
+            program.append(OP_MOVETO, stop, len(program.targets) // 3, line)
+            program.targets.extend(t)
+        elif cmd == 'light-on':
+            program.append(OP_LIGHT, byName['light-on'], 0.0, line)
+        elif cmd == 'light-off':
+            program.append(OP_LIGHT, stop, 0.0, line)
+        else:
+            program.append(OP_SEND, byName[cmd], 0.0, line)
+            if t > 0:
+                program.append(OP_WAIT, stop, t, line)
+                program.append(OP_SEND, stop, 0.0, line)
+
+    # Cache file name for a script path
+    def cacheFile(self,path):
+        import hashlib
+        return self.CacheDir + "/" + hashlib.sha1(path.encode('utf-8')).hexdigest() + ".rsc"
+
+    # Load a cached program, returns None if missing or out of date
+    def load(self,cachefile,st):
+        try:
+            with open(cachefile, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+        if len(data) < self.HEADER.size:
+            return None
+        magic, mtime, size, signature, count, points = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC or mtime != st.st_mtime_ns or size != st.st_size \
+                or signature != self.signature():
+            return None
+
+        program = Program()
+        offset = self.HEADER.size
+        for name, typecode in self.ARRAYS:
+            a = array.array(typecode)
+            end = offset + count * a.itemsize
+            if end > len(data):
+                return None
+            a.frombytes(data[offset:end])
+            offset = end
+            if name == 'payloads':
+                a = list(map(self.table.payloads.__getitem__, a))
+            setattr(program, name, a)
+        end = offset + points * 3 * program.targets.itemsize
+        if end > len(data):
+            return None
+        program.targets.frombytes(data[offset:end])
+        return program
+
+    # Save a compiled program, the cache is optional so errors are only logged
+    def save(self,cachefile,st,program):
+        parts = [self.HEADER.pack(self.MAGIC, st.st_mtime_ns, st.st_size,
+                self.signature(), len(program), len(program.targets) // 3)]
+        for name, typecode in self.ARRAYS:
+            a = getattr(program, name)
+            if name == 'payloads':
+                a = array.array(typecode, map(self.table.index, a))
+            parts.append(a.tobytes())
+        parts.append(program.targets.tobytes())
+        tmpfile = cachefile + ".tmp"
+        try:
+            os.makedirs(self.CacheDir, exist_ok=True)
+            with open(tmpfile, 'wb') as f:
+                f.write(b''.join(parts))
+            os.replace(tmpfile, cachefile)
+        except (IOError, OSError) as e:
+            log.message("Cannot cache compiled script " + cachefile + ": " + str(e), log.WARNING)
+
+# End of script compiler
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Simulated arm, joystick and GPIO switches
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# These classes stand in for usb.core, hotplug uevents, the joystick and RPi.GPIO
+# so that the robot software can be run and measured without the arm.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import os
+import time
+import errno
+import select
+import threading
+
+from input_class import InputEvent, AXIS, BUTTONDOWN, BUTTONUP
+from hotplug_class import Uevent
+
+# Raised by the simulated arm in place of usb.core.USBError
+class SimError(IOError):
+    pass
+
+# Emulates the control transfer endpoint of the Maplin arm
+class SimArm:
+
+    idVendor = 0x1267
+    idProduct = 0x0000
+
+    # port is the number of the port on bus 1 it is plugged into
+    def __init__(self,latency=0.0,port=1):
+        self.latency = latency      # Simulated transfer time in seconds
+        self.bus = 1
+        self.port_numbers = (port,)
+        self.attached = True
+        self.failures = 0           # Number of following transfers to fail
+        self.timeouts = 0           # Number of following transfers to time out
+        self.configured = False
+        self.transfers = []         # (monotonic time, 3 byte payload)
+
+    def set_configuration(self):
+        self.configured = True
+
+    # Record the payload of a transfer, the arguments are checked
+    # against those used by the real arm
+    def ctrl_transfer(self,bmRequestType,bRequest,wValue,wIndex,data,timeout):
+        if not self.configured:
+            raise SimError("Device not configured")
+        if self.failures > 0:
+            self.failures -= 1
+            raise SimError("Simulated transfer failure")
+        if self.timeouts > 0:
+            self.timeouts -= 1
+            time.sleep(timeout / 1000.0)
+            raise SimError(errno.ETIMEDOUT, "Simulated transfer timeout")
+        if (bmRequestType, bRequest, wValue, wIndex) != (0x40, 6, 0x100, 0):
+            raise SimError("Unexpected control transfer")
+        if len(data) != 3:
+            raise SimError("Payload must be 3 bytes")
+        if self.latency > 0:
+            time.sleep(self.latency)
+        self.transfers.append((time.monotonic(), bytes(data)))
+        return len(data)
+
+    # Clear recorded transfers
+    def clear(self):
+        self.transfers = []
+
+# Backend for UsbArm that finds simulated arms instead of real ones
+class SimBackend:
+
+    Error = SimError
+
+    # Simulates a number of arms plugged into ports 1-1, 1-2 and so on
+    def __init__(self,latency=0.0,arms=1):
+        self.devices = [SimArm(latency, n + 1) for n in range(arms)]
+        self.device = self.devices[0]
+        self.finds = 0          # Number of bus enumerations
+
+    def find(self,vendor_id,product_id):
+        devices = self.findAll(vendor_id, product_id)
+        if len(devices) == 0:
+            return None
+        return devices[0]
+
+    def findAll(self,vendor_id,product_id):
+        self.finds += 1
+        return [dev for dev in self.devices if dev.attached
+                and dev.idVendor == vendor_id and dev.idProduct == product_id]
+
+    def dispose(self,rctl):
+        rctl.configured = False
+
+    # Simulate plugging an arm in and out
+    def plug(self,index=0):
+        self.devices[index].attached = True
+
+    def unplug(self,index=0):
+        self.devices[index].attached = False
+        self.devices[index].configured = False
+
+# Hotplug event source for HotplugWatcher. Events are queued by add()
+# and remove() and a pipe wakes the watcher as netlink would
+class FakeUevents:
+
+    def __init__(self):
+        self.events = []
+        self.error = None           # Raised by the next wait
+        self.lock = threading.Lock()
+        self.rfd, self.wfd = os.pipe()
+
+    def name(self):
+        return "fake uevents"
+
+    def fileno(self):
+        return self.rfd
+
+    def send(self,action,devpath,props):
+        with self.lock:
+            self.events.append(Uevent(action, devpath, props, time.monotonic()))
+        os.write(self.wfd, b'x')
+
+    # The arm plugged in or out
+    def armAdd(self,devpath='/devices/usb1/1-1'):
+        self.send('add', devpath, {'SUBSYSTEM':'usb', 'DEVTYPE':'usb_device',
+                'PRODUCT':'%x/%x/100' % (SimArm.idVendor, SimArm.idProduct)})
+
+    def armRemove(self,devpath='/devices/usb1/1-1'):
+        self.send('remove', devpath, {'SUBSYSTEM':'usb', 'DEVTYPE':'usb_device',
+                'PRODUCT':'%x/%x/100' % (SimArm.idVendor, SimArm.idProduct)})
+
+    # A joystick plugged in or out
+    def joystickAdd(self,devname='input/js0'):
+        self.send('add', '/devices/virtual/' + devname, {'SUBSYSTEM':'input',
+                'DEVNAME':devname})
+
+    def joystickRemove(self,devname='input/js0'):
+        self.send('remove', '/devices/virtual/' + devname, {'SUBSYSTEM':'input',
+                'DEVNAME':devname})
+
+    # Uevents lost, as when the netlink socket buffer overflows
+    def overflow(self):
+        with self.lock:
+            self.events = []
+            self.error = OSError(errno.ENOBUFS, os.strerror(errno.ENOBUFS))
+        os.write(self.wfd, b'x')
+
+    def wait(self,timeout=None):
+        readable, w, x = select.select([self.rfd], [], [], timeout)
+        if len(readable) > 0:
+            os.read(self.rfd, 4096)
+        with self.lock:
+            events = self.events
+            self.events = []
+            error = self.error
+            self.error = None
+        if error is not None:
+            raise error
+        return events
+
+    def close(self):
+        os.close(self.rfd)
+        os.close(self.wfd)
+
+# Generates joystick events as the input classes do
+class FakeJoystick:
+
+    # Events are stamped with the time they were created
+    def axis(self,axis,value):
+        return InputEvent(AXIS, axis=axis, value=value, time=time.monotonic())
+
+    def buttonDown(self,button):
+        return InputEvent(BUTTONDOWN, button=button, time=time.monotonic())
+
+    def buttonUp(self,button):
+        return InputEvent(BUTTONUP, button=button, time=time.monotonic())
+
+# Replaces the parts of RPi.GPIO used by the robot
+class FakeGPIO:
+
+    BOARD = 10
+    BCM = 11
+    IN = 1
+    OUT = 0
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.levels = {}
+        self.callbacks = {}
+        self.edges = {}
+        self.threads = []
+
+    def setmode(self,mode):
+        self.mode = mode
+
+    def setwarnings(self,flag):
+        pass
+
+    def setup(self,pin,direction,pull_up_down=None):
+        self.levels[pin] = 0
+
+    def add_event_detect(self,pin,edge,callback=None,bouncetime=None):
+        self.edges[pin] = edge
+        self.callbacks[pin] = callback
+
+    def input(self,pin):
+        return self.levels[pin]
+
+    # Set a pin level and run the callback in its own thread
+    # as RPi.GPIO does
+    def setLevel(self,pin,level):
+        old = self.levels[pin]
+        self.levels[pin] = level
+        edge = self.edges.get(pin)
+        rising = level and not old
+        falling = old and not level
+        if (edge == self.BOTH and (rising or falling)) or \
+                (edge == self.RISING and rising) or (edge == self.FALLING and falling):
+            t = threading.Thread(target=self.callbacks[pin], args=(pin,))
+            t.daemon = True
+            self.threads.append(t)
+            t.start()
+            return t
+        return None
+
+    def press(self,pin):
+        return self.setLevel(pin, 1)
+
+    def release(self,pin):
+        return self.setLevel(pin, 0)
+
+    # Wait for all callbacks to finish
+    def join(self):
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def cleanup(self):
+        pass
+
+# End of simulation classes
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
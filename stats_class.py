@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Latency statistics class
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# Records latencies in a fixed set of logarithmic buckets so that adding
+# a sample costs the same regardless of how many have been recorded.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import math
+import threading
+
+class Histogram:
+
+    # Buckets from 1 microsecond to about 17 minutes, 8 per power of two
+    STEPS = 8
+    BUCKETS = 30 * STEPS
+    MINIMUM = 1e-6
+
+    def __init__(self,name=''):
+        self.name = name
+        self.lock = threading.Lock()
+        self.reset()
+
+    # Clear all samples
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * (self.BUCKETS + 1)
+            self.count = 0
+            self.total = 0.0
+            self.maximum = 0.0
+            self.minimum = None
+
+    # Add a sample in seconds
+    def add(self,value):
+        if value < self.MINIMUM:
+            index = 0
+        else:
+            index = int(math.log2(value / self.MINIMUM) * self.STEPS) + 1
+            if index > self.BUCKETS:
+                index = self.BUCKETS
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.maximum:
+                self.maximum = value
+            if self.minimum is None or value < self.minimum:
+                self.minimum = value
+
+    # Upper bound of a bucket in seconds
+    def bucketValue(self,index):
+        return self.MINIMUM * 2 ** (index / self.STEPS)
+
+    # Return the percentile (0 to 100) in seconds
+    def percentile(self,p):
+        with self.lock:
+            if self.count == 0:
+                return 0.0
+            target = math.ceil(self.count * p / 100.0)
+            seen = 0
+            for index, n in enumerate(self.counts):
+                seen += n
+                if seen >= target and n > 0:
+                    return min(self.bucketValue(index), self.maximum)
+            return self.maximum
+
+    # Mean in seconds
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    # One line summary in milliseconds
+    def summary(self):
+        return ("%s n=%d mean=%.3fms p50=%.3fms p90=%.3fms p99=%.3fms max=%.3fms"
+            % (self.name, self.count, self.mean()*1000, self.percentile(50)*1000,
+               self.percentile(90)*1000, self.percentile(99)*1000, self.maximum*1000))
+
+# End of Histogram class
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
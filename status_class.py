@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Shared status file class
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# The daemon publishes its state a few times a second in a fixed layout
+# record in a memory mapped file, /var/lib/robotd/status. "robotd.py
+# status" and other monitors map the file and read it without asking the
+# daemon, so reading it has no effect on the arm.
+#
+# The record is protected by a sequence number. The writer makes it odd
+# before changing the record and even again after. A reader that sees an
+# odd number, or a different number after reading the record, has read it
+# while it was being changed and reads it again.
+#
+# Layout (little endian):
+#   0   4s  magic "RST1"
+#   4   I   size of the record
+#   8   Q   sequence number
+#   16      record of the FIELDS below, in order
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import os
+import mmap
+import time
+import struct
+import threading
+
+from log_class import Log
+
+log = Log()
+
+MAGIC = b'RST1'
+HEADER = struct.Struct('<4sIQ')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+
+# Name and format of each field of the record
+FIELDS = (
+    ('pid', 'I'),
+    ('updated', 'd'),                   # time.time() of the last update
+    ('attached', 'B'),
+    ('light', 'B'),
+    ('arm_bits', 'B'),                  # Last payload sent to the arm
+    ('base_bits', 'B'),
+    ('transfers', 'Q'),
+    ('reconnects', 'Q'),
+    ('usb_timeouts', 'Q'),
+    ('control_transfers', 'Q'),
+    ('control_overruns', 'Q'),
+    ('event_to_transfer_ms', 'f'),      # Means and maxima, the percentiles
+    ('event_to_transfer_max_ms', 'f'),  # would hold the histogram locks
+    ('release_to_stop_ms', 'f'),
+    ('release_to_stop_max_ms', 'f'),
+    ('usb_transfer_ms', 'f'),
+    ('usb_transfer_max_ms', 'f'),
+    ('control_jitter_max_ms', 'f'),
+    ('jobs_queued', 'I'),
+    ('jobs_running', 'I'),
+    ('job_preemptions', 'I'),
+    ('arms', 'I'),
+    ('pose_shoulder', 'f'),
+    ('pose_elbow', 'f'),
+    ('pose_wrist', 'f'),
+    ('pose_grip', 'f'),
+    ('pose_base', 'f'),
+    )
+
+NAMES = tuple(name for name, form in FIELDS)
+RECORD = struct.Struct('<' + ''.join(form for name, form in FIELDS))
+SIZE = HEADER.size + RECORD.size
+
+StatusFile = Log.RobotLibDir + "/status"
+
+# Daemon side of the status file
+class StatusWriter:
+
+    def __init__(self,path=None):
+        self.path = StatusFile if path is None else path
+        self.map = None
+        self.sequence = 0
+        self.thread = None
+        self.running = False
+        self.updates = 0
+
+    # Make a new status file. It is made under another name and renamed
+    # so that a reader never sees it part written
+    def open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmpfile = self.path + ".tmp"
+        fd = os.open(tmpfile, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, SIZE)
+            self.map = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        self.sequence = 0
+        HEADER.pack_into(self.map, 0, MAGIC, RECORD.size, self.sequence)
+        os.replace(tmpfile, self.path)
+
+    # Write a record, a tuple of values in the order of FIELDS
+    def publish(self,values):
+        self.sequence += 1
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+        RECORD.pack_into(self.map, HEADER.size, *values)
+        self.sequence += 1
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+        self.updates += 1
+
+    # Publish collect() every interval seconds until stopped
+    def run(self,collect,interval):
+        deadline = time.monotonic()
+        while self.running:
+            try:
+                self.publish(collect())
+            except Exception as e:
+                log.message("Status update failed: " + str(e), log.ERROR)
+            deadline += interval
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            else:
+                deadline = time.monotonic()
+
+    def start(self,collect,interval=0.2):
+        if self.thread is None:
+            if self.map is None:
+                self.open()
+            self.running = True
+            self.thread = threading.Thread(target=self.run, args=(collect, interval),
+                    name='status')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+# End of StatusWriter class
+
+# Read the status file, returns a dictionary of the FIELDS or None if there
+# is no status file or the record could not be read between updates. A
+# reader that catches the writer part way through an update waits a
+# little for it, the writer may be waiting for the CPU
+def readStatus(path=None,retries=100,wait=0.0001):
+    if path is None:
+        path = StatusFile
+    try:
+        with open(path, 'rb') as f:
+            status = mmap.mmap(f.fileno(), SIZE, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        magic, size, sequence = HEADER.unpack_from(status, 0)
+        if magic != MAGIC or size != RECORD.size:
+            return None
+        for i in range(retries):
+            before = SEQUENCE.unpack_from(status, SEQUENCE_OFFSET)[0]
+            if not before & 1:
+                values = RECORD.unpack_from(status, HEADER.size)
+                if SEQUENCE.unpack_from(status, SEQUENCE_OFFSET)[0] == before:
+                    if before == 0:
+                        return None
+                    return dict(zip(NAMES, values))
+            time.sleep(wait)
+        return None
+    finally:
+        status.close()
+
+# Is the daemon that wrote a status record still running
+def isRunning(status):
+    try:
+        os.kill(status['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# A status record as key=value pairs on one line
+def formatStatus(status):
+    values = []
+    for name, form in FIELDS:
+        value = status[name]
+        if name == 'updated':
+            value = time.strftime('%H:%M:%S', time.localtime(value))
+        elif form in 'fd':
+            value = "%.3f" % value if name.endswith('_ms') else "%.1f" % value
+        values.append(name + "=" + str(value))
+    return ' '.join(values)
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
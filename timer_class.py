@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Motion timer class
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# Motor on-times are scheduled against monotonic deadlines rather than
+# by sleeping for the requested time. Each transfer is started early by
+# the measured send latency so that it completes on its deadline. The
+# timer sleeps until just before a deadline and then spins for the
+# last part to avoid the scheduler waking it late.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import math
+import time
+import collections
+
+from stats_class import Histogram
+
+class MotionTimer:
+
+    SPIN = 0.001            # Spin for the last millisecond before a deadline
+    SMOOTHING = 0.2         # Weight of a new sample in the send latency estimate
+    HISTORY = 1000          # Number of steps kept for inspection
+
+    def __init__(self):
+        self.sendLatency = 0.0
+        self.sendTime = Histogram('send')
+        self.error = Histogram('on-time-error')
+        self.history = collections.deque(maxlen=self.HISTORY)
+        self.steps = 0
+        self.errorTotal = 0.0
+        self.errorSquares = 0.0
+        self.errorMax = 0.0
+        self.interrupt = None   # Event that cuts a wait short when set
+
+    # Wait until the monotonic clock reaches the deadline. Returns False
+    # if the wait was cut short by the interrupt event
+    def sleepUntil(self,deadline):
+        remaining = deadline - time.monotonic()
+        if remaining > self.SPIN:
+            if self.interrupt is None:
+                time.sleep(remaining - self.SPIN)
+            elif self.interrupt.wait(remaining - self.SPIN):
+                return False
+        while time.monotonic() < deadline:
+            pass
+        return self.interrupt is None or not self.interrupt.is_set()
+
+    # Call send(payload) so that it completes as close to the deadline
+    # as possible. Returns the time it completed or None if send failed
+    # or the wait for the deadline was cut short
+    def sendAt(self,deadline,send,payload):
+        if deadline is not None and not self.sleepUntil(deadline - self.sendLatency):
+            return None
+        start = time.monotonic()
+        if not send(payload):
+            return None
+        done = time.monotonic()
+        latency = done - start
+        self.sendTime.add(latency)
+        self.sendLatency += self.SMOOTHING * (latency - self.sendLatency)
+        return done
+
+    # Record the requested and achieved on-time of one step
+    def record(self,requested,achieved):
+        error = achieved - requested
+        self.history.append((requested, achieved))
+        self.error.add(abs(error))
+        self.steps += 1
+        self.errorTotal += error
+        self.errorSquares += error * error
+        if abs(error) > self.errorMax:
+            self.errorMax = abs(error)
+
+    # Turn on a payload for t seconds and then send stop
+    # Returns the achieved on-time or None if a send failed
+    def move(self,send,payload,stop,t):
+        on = self.sendAt(None, send, payload)
+        if on is None:
+            return None
+        off = self.sendAt(on + t, send, stop)
+        if off is None:
+            return None
+        self.record(t, off - on)
+        return off - on
+
+    # Mean error and jitter (standard deviation of the error) in seconds
+    def accuracy(self):
+        if self.steps == 0:
+            return 0.0, 0.0
+        mean = self.errorTotal / self.steps
+        variance = max(self.errorSquares / self.steps - mean * mean, 0.0)
+        return mean, math.sqrt(variance)
+
+    # One line summary in milliseconds
+    def summary(self):
+        mean, jitter = self.accuracy()
+        return ("steps=%d mean error=%.3fms jitter=%.3fms max error=%.3fms send=%.3fms"
+            % (self.steps, mean*1000, jitter*1000, self.errorMax*1000, self.sendLatency*1000))
+
+# End of MotionTimer class
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# USB device session class
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# This class opens and configures the robot arm once and keeps the
+# device handle across transfers. The USB bus is only searched again
+# after a USB error or a hotplug event. When several arms are plugged in
+# each is told apart by the USB port it is plugged into.
+#
+# A TransferThread sends payloads from its own thread so that a slow or
+# failed transfer does not hold up the live inputs.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import time
+import errno
+import threading
+
+from log_class import Log
+from stats_class import Histogram
+
+log = Log()
+
+# Access to the real USB bus using pyusb, imported when first used
+class PyUsbBackend:
+
+    usb = None
+    Error = None
+
+    def load(self):
+        if self.usb is None:
+            import usb.core
+            import usb.util
+            self.usb = usb
+            self.Error = usb.core.USBError
+
+    # Find the first matching device
+    def find(self,vendor_id,product_id):
+        self.load()
+        return self.usb.core.find(idVendor=vendor_id, idProduct=product_id)
+
+    # Find all the matching devices
+    def findAll(self,vendor_id,product_id):
+        self.load()
+        return list(self.usb.core.find(find_all=True, idVendor=vendor_id,
+                idProduct=product_id))
+
+    # Release the resources held for a device
+    def dispose(self,rctl):
+        self.usb.util.dispose_resources(rctl)
+
+# Bus and port path of a device as named in /sys/bus/usb/devices (1-1.2)
+def devicePort(dev):
+    return str(dev.bus) + '-' + '.'.join(str(n) for n in dev.port_numbers)
+
+class UsbArm:
+
+    # Control transfer parameters for the Maplin arm
+    REQUEST_TYPE = 0x40
+    REQUEST = 6
+    VALUE = 0x100
+    INDEX = 0
+    TIMEOUT = 1000
+
+    rctl = None         # Device handle
+    reconnects = 0      # Number of times the bus has been searched again
+    transfers = 0       # Number of successful transfers
+    attached = None     # Set by hotplug events, None if not known
+    timeouts = 0        # Number of transfers that timed out
+
+    # The backend defaults to the real USB bus, see sim_class.py for a simulated arm
+    # port selects the arm plugged into a USB port, None for the first one found
+    def __init__(self,vendor_id,product_id,backend=None,port=None):
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.port = port
+        if backend is None:
+            backend = PyUsbBackend()
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.transferTime = Histogram('usb-transfer')
+        return
+
+    # Search the bus for the arm
+    def find(self):
+        if self.port is None:
+            return self.backend.find(self.vendor_id, self.product_id)
+        for dev in self.backend.findAll(self.vendor_id, self.product_id):
+            if devicePort(dev) == self.port:
+                return dev
+        return None
+
+    # Ports of all the arms on the bus
+    def findPorts(self):
+        return sorted(devicePort(dev) for dev in
+                self.backend.findAll(self.vendor_id, self.product_id))
+
+    # Open and configure the arm if not already open
+    def open(self):
+        if self.rctl is None:
+            # Do not search the bus for an arm known to be unplugged
+            if self.attached is False:
+                return False
+            rctl = self.find()
+            if rctl is None:
+                return False
+            try:
+                #this arm should just have one configuration...
+                rctl.set_configuration()
+            except self.backend.Error as e:
+                log.message("USB set_configuration error " + str(e), log.ERROR)
+                return False
+            self.rctl = rctl
+        return True
+
+    # Release the device handle
+    def close(self):
+        if self.rctl is not None:
+            try:
+                self.backend.dispose(self.rctl)
+            except self.backend.Error:
+                pass
+        self.rctl = None
+
+    # Called on a hotplug event, the next transfer opens the device again.
+    # attached is True if the arm was plugged in and False if unplugged
+    def hotplug(self,attached=None):
+        with self.lock:
+            self.close()
+            self.attached = attached
+
+    # Is the device handle open
+    def isOpen(self):
+        return self.rctl is not None
+
+    # Send a 3 byte command to the arm. On a USB error the handle is
+    # dropped and the bus searched once more before giving up
+    def transfer(self,cmd):
+        with self.lock:
+            for attempt in (0,1):
+                if not self.open():
+                    return False
+                start = time.monotonic()
+                try:
+                    self.rctl.ctrl_transfer(self.REQUEST_TYPE, self.REQUEST,
+                            self.VALUE, self.INDEX, cmd, self.TIMEOUT)
+                    self.transferTime.add(time.monotonic() - start)
+                    self.transfers += 1
+                    return True
+                except self.backend.Error as e:
+                    if getattr(e, 'errno', None) == errno.ETIMEDOUT:
+                        self.timeouts += 1
+                    self.close()
+                    if attempt == 0:
+                        self.reconnects += 1
+                        log.message("USB error " + str(e) + ", reconnecting ("
+                                + str(self.reconnects) + ")", log.ERROR)
+        return False
+
+# Sends payloads with transfer(payload) on its own thread. There is one
+# slot for the next payload and a payload posted while another is still
+# waiting replaces it, as only the newest command for the arm matters.
+# done(payload, ok) is called after each transfer
+class TransferThread:
+
+    def __init__(self,transfer,done=None,name='usb'):
+        self.transfer = transfer
+        self.done = done
+        self.name = name
+        self.cond = threading.Condition()
+        self.pending = None         # (payload, time posted)
+        self.busy = False
+        self.running = False
+        self.thread = None
+
+        # Statistics
+        self.posted = 0
+        self.superseded = 0         # Replaced before they were sent
+        self.failures = 0
+        self.latency = Histogram('post-to-transfer')
+
+    # Queue a payload to send, returns without waiting
+    def post(self,payload):
+        self.start()
+        with self.cond:
+            if self.pending is not None:
+                self.superseded += 1
+            self.pending = (payload, time.monotonic())
+            self.posted += 1
+            self.cond.notify_all()
+        return True
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None and self.running:
+                    self.cond.wait()
+                if self.pending is None:
+                    return
+                payload, posted = self.pending
+                self.pending = None
+                self.busy = True
+            ok = self.transfer(payload)
+            if ok:
+                self.latency.add(time.monotonic() - posted)
+            else:
+                self.failures += 1
+            if self.done is not None:
+                self.done(payload, ok)
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+
+    # Wait until everything posted has been sent
+    def flush(self,timeout=None):
+        with self.cond:
+            return self.cond.wait_for(lambda: self.pending is None and not self.busy, timeout)
+
+    def start(self):
+        with self.cond:
+            if self.thread is not None:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name=self.name)
+            self.thread.daemon = True
+            self.thread.start()
+
+    # Stop once the payload waiting, if any, has been sent
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+            thread = self.thread
+            self.thread = None
+        if thread is not None:
+            thread.join()
+
+    # One line summary
+    def summary(self):
+        return ("posted=%d superseded=%d failures=%d %s"
+            % (self.posted, self.superseded, self.failures, self.latency.summary()))
+
+# End of USB classes
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab
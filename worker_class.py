@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+#
+# Raspberry Pi Maplin Robot Arm
+# Arm worker class
+#
+# Author : Bob Rathbone
+# Site   : http://www.bobrathbone.com
+#
+# Each arm plugged in has a worker with its own USB session, estimated
+# pose and motion timer. Programs are queued to the worker and run by its
+# own thread, so several arms run commands files at the same time. A
+# program given a start time waits for it, which lets every arm start a
+# broadcast program together (See Robot.executeFile).
+#
+# Programs send each payload and wait for it as their timing depends on
+# when it was sent. The live inputs post payloads to a transfer thread
+# instead so that a slow transfer does not hold them up.
+#
+# Queued programs run highest priority first. A program can be planned
+# when it is taken from the queue, from where the programs before it have
+# left the arm. Live input that moves the
+# arm while a program is running takes it over on the next control loop
+# tick. The program is then aborted or, once the live input has been let
+# go for resumeDelay seconds, carries on from where it was with the rest
+# of its timing moved on by the time it was paused. A job can be
+# cancelled while it is queued or running.
+#
+# License: GNU V3, See https://www.gnu.org/copyleft/gpl.html
+#
+# Disclaimer: Software is provided as is and absolutly no warranties are implied or given.
+#       The authors shall not be liable for any loss or damage however caused.
+#
+
+import math
+import time
+import queue
+import itertools
+import threading
+
+from log_class import Log
+from stats_class import Histogram
+from timer_class import MotionTimer
+from usb_class import TransferThread
+from script_class import OP_WAIT, OP_LIGHT
+
+log = Log()
+
+RESUME = 'resume'           # Carry on after live input has been let go
+ABORT = 'abort'             # Stop the program when live input takes over
+
+# A program queued to a worker
+class Job:
+
+    def __init__(self,program,start=None,priority=0,policy=RESUME,plan=None):
+        self.program = program
+        self.plan = plan            # plan(program, pose) gives the program to run
+        self.start = start
+        self.priority = priority    # Higher priorities run first
+        self.policy = policy
+        self.submitted = time.monotonic()
+        self.cancelled = False
+        self.preemptions = 0
+        self.result = None
+        self.error = None           # Exception raised running the job
+        self.done = threading.Event()
+
+    # Wait for the program to finish, returns True if it ran to the end
+    def wait(self,timeout=None):
+        self.done.wait(timeout)
+        return self.result
+
+class ArmWorker:
+
+    def __init__(self,name,arm,pose,table):
+        self.name = name
+        self.arm = arm              # UsbArm
+        self.pose = pose            # PoseEstimator
+        self.table = table
+        self.timer = MotionTimer()
+        self.moveTimer = MotionTimer()  # For Robot.execute, not interrupted
+        self.light_on = False
+        self.jobs = queue.PriorityQueue()
+        self.sequence = itertools.count()   # Keeps jobs of a priority in order
+        self.thread = None
+        self.sender = TransferThread(self.transfer, self.transferDone, 'usb' + name)
+
+        # Live input taking over from a running program
+        self.running = None         # Job being run
+        self.interrupt = threading.Event()
+        self.timer.interrupt = self.interrupt
+        self.live = False           # Live input is moving the arm
+        self.liveTime = 0.0         # When it last stopped
+        self.lastLive = None        # Last live payload posted
+        self.resumeDelay = 0.5
+
+        # Statistics
+        self.programs = 0           # Programs run
+        self.preemptions = 0
+        self.aborted = 0
+        self.cancelled = 0
+        self.lateStarts = 0         # Programs started after their start time
+        self.waitTime = Histogram('job-wait')
+        self.pauseTime = Histogram('job-preempted')
+
+    # Send a payload to the arm as it is
+    def transfer(self,cmd):
+        return self.arm.transfer(cmd)
+
+    # Send a command to the arm with joints at their limits masked off
+    # The command is a payload from the command table
+    def sendCommand(self,cmd):
+        cmd = self.pose.limit(cmd)
+        if self.light_on:
+            cmd = self.table.withLight(cmd, 1)
+        if log.level == log.DEBUG:
+            sCommand = self.table.name(cmd)
+            if sCommand == None:
+                sCommand = "Joystick"
+            log.message("sendCommand arm " + self.name + " " + sCommand + ' '
+                    + str(tuple(cmd)), log.DEBUG)
+        connected = self.arm.transfer(cmd)
+        if not connected:
+            log.message("USB communication error arm " + self.name, log.ERROR)
+        else:
+            self.pose.update(cmd)
+        return connected
+
+    # Post a command to the transfer thread without waiting for it. While
+    # a program is running a live command that moves the arm takes it
+    # over, other live commands are dropped until then
+    def postCommand(self,cmd):
+        cmd = self.pose.limit(cmd)
+        moving = cmd[0] != 0 or cmd[1] != 0
+        wasLive = self.live
+        self.live = moving
+        if wasLive and not moving:
+            self.liveTime = time.monotonic()
+        if self.running is not None:
+            if not moving and not wasLive:
+                return True
+            self.interrupt.set()
+        if self.light_on:
+            cmd = self.table.withLight(cmd, 1)
+        self.lastLive = cmd
+        return self.sender.post(cmd)
+
+    # Called by the transfer thread once a posted command has been sent
+    def transferDone(self,cmd,ok):
+        if ok:
+            self.pose.update(cmd)
+        else:
+            log.message("USB communication error arm " + self.name, log.ERROR)
+
+    # Stop any joint that reaches its soft limit before the deadline
+    # when it gets there
+    def stopAtLimits(self,deadline):
+        limit = self.pose.limitTime()
+        while limit is not None and limit < deadline:
+            if self.timer.sendAt(limit, self.sendCommand, self.pose.payload) is None:
+                return
+            limit = self.pose.limitTime()
+
+    # Wait while live input has the arm. Returns False if the job is to
+    # stop, because it was cancelled or its policy is to abort
+    def pause(self,job):
+        if job.cancelled:
+            return False
+        self.preemptions += 1
+        job.preemptions += 1
+        # The program may have sent a payload just after the live input
+        if self.lastLive is not None:
+            self.sender.post(self.lastLive)
+        if job.policy == ABORT:
+            self.aborted += 1
+            log.message("Arm " + self.name + " program aborted by live input", log.INFO)
+            return False
+        paused = time.monotonic()
+        while True:
+            self.interrupt.clear()
+            if job.cancelled:
+                return False
+            if self.live:
+                self.interrupt.wait()
+                continue
+            left = self.liveTime + self.resumeDelay - time.monotonic()
+            if left <= 0:
+                break
+            self.interrupt.wait(left)
+        self.pauseTime.add(time.monotonic() - paused)
+        return True
+
+    # Send a payload at a deadline (See MotionTimer.sendAt)
+    def sendAt(self,deadline,cmd):
+        self.stopAtLimits(deadline)
+        return self.timer.sendAt(deadline, self.sendCommand, cmd)
+
+    # Run a compiled program. Every transfer has a deadline measured from
+    # the start of the program so timing errors do not add up over a long
+    # script. The time each payload was on is recorded by the timer.
+    # start is the monotonic time to start at, now if None. job is the
+    # Job being run, if any, which says what to do when live input
+    # takes over
+    def runProgram(self,program,start=None,job=None):
+        if job is None:
+            job = Job(program, start)
+        now = time.monotonic()
+        if start is None:
+            start = now
+        elif start < now:
+            # Kept waiting past the start by the jobs before it, its
+            # deadlines would all be gone and its moves sent at once
+            self.lateStarts += 1
+            log.message("Arm " + self.name + " started " + "%.3f" % (now - start)
+                    + "s late, out of step with the other arms", log.WARNING)
+            start = now
+        self.interrupt.clear()
+        self.running = job
+        try:
+            return self.runSteps(program, start, job)
+        finally:
+            self.running = None
+            self.interrupt.clear()
+
+    def runSteps(self,program,start,job):
+        ops = program.ops
+        payloads = program.payloads
+        durations = program.durations
+        timer = self.timer
+        due = 0.0               # Program time of the next transfer
+        lastDue = None          # Program and real time of the last transfer
+        lastDone = None
+        lastPayload = None
+        moving = False
+        for i in range(len(ops)):
+            op = ops[i]
+            if op == OP_WAIT:
+                due += durations[i]
+                continue
+            payload = payloads[i]
+            if op == OP_LIGHT:
+                self.light_on = payload[2] == 1
+            done = self.sendAt(start + due, payload)
+            while done is None and self.interrupt.is_set():
+                shift = self.resume(job, lastPayload if moving else None)
+                if shift is None:
+                    return False
+                start += shift
+                if moving:
+                    lastDone += shift
+                done = self.sendAt(start + due, payload)
+            if done is None:
+                return False
+            if moving:
+                timer.record(due - lastDue, done - lastDone)
+            lastDue = due
+            lastDone = done
+            lastPayload = payload
+            moving = payload[0] != 0 or payload[1] != 0
+
+        # Wait for the program to end
+        self.stopAtLimits(start + due)
+        while not timer.sleepUntil(start + due):
+            shift = self.resume(job, lastPayload if moving else None)
+            if shift is None:
+                return False
+            start += shift
+            self.stopAtLimits(start + due)
+        self.programs += 1
+        return True
+
+    # Pause a job that live input has taken the arm from and then send
+    # the payload that was on when it was, if any. Returns the seconds it
+    # was paused for or None if the job is to stop
+    def resume(self,job,payload):
+        paused = time.monotonic()
+        if not self.pause(job):
+            return None
+        if payload is not None and not self.sendCommand(payload):
+            return None
+        return time.monotonic() - paused
+
+    # Queue a program to run, returns its Job
+    def submit(self,program,start=None,priority=0,policy=RESUME,plan=None):
+        self.start()
+        job = Job(program, start, priority, policy, plan)
+        self.jobs.put((-priority, next(self.sequence), job))
+        return job
+
+    # Cancel the queued jobs and the running one, stopping the arm
+    def cancel(self):
+        with self.jobs.mutex:
+            for priority, sequence, job in self.jobs.queue:
+                if job is not None:
+                    job.cancelled = True
+        job = self.running
+        if job is not None:
+            job.cancelled = True
+            self.interrupt.set()
+
+    # Number of jobs queued, not counting the one running
+    def queued(self):
+        return self.jobs.qsize()
+
+    # Run queued programs until stopped
+    def run(self):
+        while True:
+            priority, sequence, job = self.jobs.get()
+            if job is None:
+                break
+            if job.cancelled:
+                self.cancelled += 1
+                job.result = False
+                job.done.set()
+                continue
+            self.waitTime.add(time.monotonic() - job.submitted)
+            try:
+                if job.plan is not None:
+                    job.program = job.plan(job.program, self.pose)
+                job.result = self.runProgram(job.program, job.start, job)
+            except Exception as e:
+                log.message("Arm " + self.name + " program error: " + str(e), log.ERROR)
+                job.error = e
+                job.result = False
+            if job.cancelled:
+                self.cancelled += 1
+                log.message("Arm " + self.name + " program cancelled", log.INFO)
+                self.sendCommand(self.table.byName['stop'])
+            job.done.set()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='arm' + self.name)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            # After the jobs already queued
+            self.jobs.put((math.inf, next(self.sequence), None))
+            self.thread.join()
+            self.thread = None
+        self.sender.stop()
+
+    # One line summary
+    def summary(self):
+        return ("arm %s port=%s transfers=%d reconnects=%d timeouts=%d programs=%d "
+                "preemptions=%d aborted=%d cancelled=%d late=%d"
+                % (self.name, self.arm.port, self.arm.transfers, self.arm.reconnects,
+                self.arm.timeouts, self.programs, self.preemptions, self.aborted,
+                self.cancelled, self.lateStarts))
+
+# End of ArmWorker class
+
+#set tabstop=4 shiftwidth=4 expandtab
+#retab